@@ -1,13 +1,49 @@
+import asyncio
+import bisect
+import codecs
 import copy
+import difflib
+import hashlib
+import itertools
 import json
 import os
+import re
+import threading
 import time
+import urllib.error
 import urllib.request
-from typing import Any, Dict, List, Tuple, Union
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import numpy as np
+from scipy import sparse
 from scipy.optimize import linprog
 
+try:
+    from scipy.optimize import Bounds, LinearConstraint, milp
+except ImportError:
+    # scipy < 1.9, integral plans are then only rounded by round_plan.
+    milp = None
+
+from Metrics import PhaseTimer, metrics, record_refresh
+from PlanCache import PLAN_CACHE_SIZE_DEFAULT, PlanCache, plan_key
+from SharedModel import (
+    read_segment,
+    read_segment_file,
+    write_segment,
+    write_segment_file,
+)
+from WarmSolver import WarmSolver, highspy
+
 global penguin_url, headers
 penguin_url = "https://penguin-stats.io/PenguinStats/api/"
 headers = {"User-Agent": "ArkPlanner"}
@@ -16,6 +52,172 @@ gamedata_langs = ["en_US", "ja_JP", "ko_KR", "zh_CN"]
 DEFAULT_LANG = "en_US"
 NON_CN_WORLD_NUM = 4
 FILTER_FREQ_DEFAULT = 100
+URL_STATS_DEFAULT = "result/matrix?show_stage_details=true&show_item_details=true"
+URL_RULES_DEFAULT = "formula"
+GAMEDATA_PATH_DEFAULT = (
+    "https://raw.githubusercontent.com/Kengxxiao/ArknightsGameData/"
+    + "master/{}/gamedata/excel/item_table.json"
+)
+# "highs" reads the item values from the marginals of the primal solve,
+# "interior-point" solves the dual problem a second time to get them and
+# "highs-warm" keeps one HiGHS instance per flag combination around to
+# re-optimize from the previous basis (requires highspy).
+SOLVERS = ["highs", "interior-point", "highs-warm"]
+DEFAULT_SOLVER = "highs"
+# linprog methods tried in turn by each solver, the next one is only used when
+# the previous one ends with a status in FALLBACK_STATUSES. A failed highs-warm
+# solve continues with its chain.
+SOLVER_CHAINS = {
+    "highs": ["highs", "highs-ipm", "revised simplex"],
+    "interior-point": ["interior-point", "highs", "highs-ipm"],
+    "highs-warm": ["highs-ipm", "revised simplex"],
+}
+# Iteration limit and numerical difficulties, another method may succeed.
+FALLBACK_STATUSES = (1, 4)
+# linprog methods that don't accept sparse matrices.
+DENSE_METHODS = ["revised simplex", "simplex"]
+# linprog methods told that the matrices are sparse, they warn and switch to
+# their sparse solver otherwise.
+SPARSE_METHODS = ["interior-point"]
+# Bump whenever the arrays stored by save_snapshot or their meaning change.
+SNAPSHOT_VERSION = 2
+SNAPSHOT_MATRICES = ["probs_matrix", "convertion_matrix", "convertion_outc_matrix"]
+# Bump whenever get_plan returns different plans for the same data, the plans
+# persisted in a PlanStore by older versions are then ignored.
+PLAN_FORMAT_VERSION = 1
+# Size of the blocks data files and responses are read and parsed in.
+CHUNK_SIZE = 1 << 16
+# AP worth of 200 exp (a Drill Battle Record) and of 1 LMD.
+EXP_UNIT = 200 * (30.0 - 0.048 * 30) / 7400
+GOLD_UNIT = 0.004
+# Chance of a crafting byproduct.
+EXTRA_OUTCOME_RATE = 0.175
+# Tolerance of the integral plans on the demand.
+ROUND_TOL = 1e-6
+# Integral plans are only improved with a MILP up to this many stages and rules
+# left by _presolve.
+MILP_MAX_COLUMNS = 200
+# Parameters MaterialPlanning.sweep can vary.
+SWEEP_PARAMETERS = ["exclude", "outcome_rate", "exp_unit", "gold_unit"]
+# Resources MaterialPlanning.pareto can trade sanity off against.
+PARETO_RESOURCES = ["gold", "exp"]
+PARETO_POINTS_DEFAULT = 5
+PARETO_POINTS_MAX = 20
+status_dct = {
+    0: "Optimization terminated successfully. ",
+    1: "Iteration limit reached. ",
+    2: "Problem appears to be infeasible. ",
+    3: "Problem appears to be unbounded. ",
+    4: "Numerical difficulties encountered.",
+}
+
+
+class StaleSnapshotError(ValueError):
+    """
+    Raised when a model snapshot doesn't match the current data or settings.
+    """
+
+
+class UnknownItemError(ValueError):
+    """
+    Raised when some keys of a requirement dict don't match any item.
+    Attributes:
+        unknown: list of the keys that didn't match.
+        suggestions: dict mapping each unknown key to a list of similar item names.
+    """
+
+    def __init__(self, unknown, suggestions):
+        self.unknown = unknown
+        self.suggestions = suggestions
+        super().__init__(
+            "Unknown items: "
+            + "; ".join(
+                "{!r}".format(key)
+                + (
+                    " (did you mean {}?)".format(", ".join(suggestions[key]))
+                    if suggestions.get(key)
+                    else ""
+                )
+                for key in unknown
+            )
+        )
+
+    def __reduce__(self):
+        # The default would call __init__ with the message only.
+        return type(self), (self.unknown, self.suggestions)
+
+
+class LPTemplate(NamedTuple):
+    """
+    Prebuilt linear program for one combination of (outcome, gold_demand, exp_demand).
+    Attributes:
+        A_ub: sparse matrix of shape [n_items, n_stages + n_rules].
+            Negated production matrix, ready to be passed to linprog as is.
+        A_dual: sparse matrix of shape [n_stages + n_rules, n_items].
+            Transposed production matrix used by the dual problem.
+        cost: array of shape [n_stages + n_rules]. Objective of the primal problem.
+        row_scale: array of shape [n_items] or None. If set, the program is
+            scaled (see scale_lp) and the rows of A_ub were multiplied by it.
+        col_scale: array of shape [n_stages + n_rules] or None. If set, the
+            columns of A_ub and cost were multiplied by it.
+    """
+
+    A_ub: Any
+    A_dual: Any
+    cost: np.ndarray
+    row_scale: Optional[np.ndarray] = None
+    col_scale: Optional[np.ndarray] = None
+
+
+class PlanInput(NamedTuple):
+    """
+    A plan request converted to the inputs of the linear program.
+    Attributes:
+        demand_lst: list of materials demand, including all items.
+        flags: (outcome, gold_demand, exp_demand), the key of the LPTemplate.
+        stage_idx: array of the indices of the stages allowed in the plan,
+            or None if all of them are.
+        language: string. Language of the item names in the plan.
+        cache_key: string. Key of the plan in the plan cache.
+        request_key: string. Key of the plan in the plan store, independent
+            of the data the model was loaded from.
+        presolve: bool. Solve the reduced problem, see _presolve.
+        integral: bool. Round the plan to whole clears and crafts, see _integral_plan.
+        budget: float. Seconds the MILP of an integral plan may run.
+    """
+
+    demand_lst: List[float]
+    flags: Tuple[bool, bool, bool]
+    stage_idx: Any
+    language: str
+    cache_key: str
+    request_key: str
+    presolve: bool
+    integral: bool = False
+    budget: float = 0.0
+
+
+class Farms(NamedTuple):
+    """
+    Stage data read from the stats records by _read_farms.
+    Attributes:
+        item_array: list of the item names, in column order.
+        item_id_array: list of the item IDs, in column order.
+        stage_array: list of the stage codes, in row order.
+        probs_entries: dict mapping (stage index, item index) to the number of
+            items dropped per clear.
+        cost_lst: array of shape [n_stages]. Costs per clear at each stage.
+        cost_exp_offset: array of shape [n_stages]. Worth of the exp dropped.
+        cost_gold_offset: array of shape [n_stages]. Worth of the LMD dropped.
+    """
+
+    item_array: List[str]
+    item_id_array: List[str]
+    stage_array: List[str]
+    probs_entries: Dict[Tuple[int, int], float]
+    cost_lst: np.ndarray
+    cost_exp_offset: np.ndarray
+    cost_gold_offset: np.ndarray
 
 
 class MaterialPlanning(object):
@@ -23,13 +225,16 @@ class MaterialPlanning(object):
         self,
         filter_freq=FILTER_FREQ_DEFAULT,
         filter_stages=[],
-        url_stats="result/matrix?show_stage_details=true&show_item_details=true",
-        url_rules="formula",
+        url_stats=URL_STATS_DEFAULT,
+        url_rules=URL_RULES_DEFAULT,
         path_stats="data/matrix.json",
         dont_save_data=False,
         path_rules="data/formula.json",
-        gamedata_path="https://raw.githubusercontent.com/Kengxxiao/ArknightsGameData/"
-        + "master/{}/gamedata/excel/item_table.json",
+        gamedata_path=GAMEDATA_PATH_DEFAULT,
+        solver=DEFAULT_SOLVER,
+        cache_size=PLAN_CACHE_SIZE_DEFAULT,
+        cache_ttl=None,
+        path_snapshot="data/model.snapshot",
     ):
         """
         Object initialization.
@@ -40,10 +245,28 @@ class MaterialPlanning(object):
             url_rules: string. url to the composing rules data.
             path_stats: string. local path to the dropping rate stats data.
             path_rules: string. local path to the composing rules data.
+            solver: string. linprog method used to solve plans, one of SOLVERS.
+            cache_size: int. Number of plans kept by get_plan, 0 disables caching.
+            cache_ttl: float or None. Seconds a cached plan stays valid.
+                Cached plans only expire on data updates if None.
+            path_snapshot: string. local path to the preprocessed model, used
+                instead of the data when it is up to date.
         """
+        self._init_runtime(solver, cache_size, cache_ttl)
+
+        if not dont_save_data:
+            try:
+                self._load_snapshot(
+                    path_snapshot, path_stats, path_rules, filter_freq, filter_stages
+                )
+                return
+            except (OSError, ValueError, KeyError):
+                # Missing, stale or unreadable, rebuild it from the data below.
+                pass
+
         if not dont_save_data:
             try:
-                material_probs, convertion_rules = load_data(path_stats, path_rules)
+                material_probs, convertion_rules = stream_data(path_stats, path_rules)
             except FileNotFoundError:
                 material_probs, convertion_rules = request_data(
                     penguin_url + url_stats,
@@ -62,163 +285,754 @@ class MaterialPlanning(object):
                 gamedata_path,
                 dont_save_data,
             )
-        self.itemdata = request_itemdata(gamedata_path)
-        self.itemdata_rv = {
-            lang: {v: k for k, v in dct.items()} for lang, dct in self.itemdata.items()
+        itemdata, item_validators = request_itemdata_conditional(gamedata_path, {}, {})
+        self._load_data(
+            material_probs,
+            convertion_rules,
+            itemdata,
+            filter_freq,
+            filter_stages,
+        )
+        self.validators = {
+            "stats": {} if dont_save_data else file_validators(path_stats),
+            "rules": {} if dont_save_data else file_validators(path_rules),
+            "items": item_validators,
         }
+        if not dont_save_data:
+            self.save_snapshot(path_snapshot)
+
+    @classmethod
+    def from_data(
+        cls,
+        material_probs,
+        convertion_rules,
+        itemdata,
+        filter_freq=FILTER_FREQ_DEFAULT,
+        filter_stages=None,
+        solver=DEFAULT_SOLVER,
+        cache_size=PLAN_CACHE_SIZE_DEFAULT,
+        cache_ttl=None,
+        validators=None,
+        farms=None,
+    ):
+        """
+        Builds a model from already downloaded data, without any network or disk access.
+        Args:
+            material_probs: dictionary. Content of the stats json file.
+            convertion_rules: dictionary. Content of the rules json file.
+            itemdata: dictionary. Item names per region, as returned by request_itemdata.
+            validators: dictionary. HTTP validators of the data, as returned by
+                request_data_conditional. The next update fetches everything if None.
+            farms: Farms or None. Stage data already read from material_probs,
+                which is then ignored.
+            See __init__ for the other arguments.
+        """
+        mp = cls.__new__(cls)
+        mp._init_runtime(solver, cache_size, cache_ttl)
+        mp._load_data(
+            material_probs,
+            convertion_rules,
+            itemdata,
+            filter_freq,
+            filter_stages,
+            farms,
+        )
+        mp.validators = validators or {"stats": {}, "rules": {}, "items": {}}
+        return mp
+
+    def refreshed(
+        self,
+        bodies,
+        validators,
+        url_stats=URL_STATS_DEFAULT,
+        url_rules=URL_RULES_DEFAULT,
+        path_stats="data/matrix.json",
+        path_rules="data/formula.json",
+        dont_save_data=False,
+        path_snapshot="data/model.snapshot",
+    ):
+        """
+        Builds a new model with the same settings from conditionally fetched data.
+        When only drop rates and stage costs changed, the new model is a copy of
+        this one with the changed cells patched, and the cached plans that don't
+        involve the changed stages are kept, see _patched. A summary of the
+        changes is set as the changes attribute of the new model.
+        Args:
+            bodies: dictionary. Response bodies, None where the data is unchanged,
+                as returned by request_data_conditional or request_data_async.
+            validators: dictionary. Validators matching bodies.
+            See update for the other arguments.
+        Returns:
+            mp: a new MaterialPlanning, or None if none of the data changed.
+        """
+        data = self._resolve_bodies(
+            bodies,
+            validators,
+            penguin_url + url_stats,
+            penguin_url + url_rules,
+            path_stats,
+            path_rules,
+            dont_save_data,
+        )
+        if data is None:
+            return None
+        mp = self._patched(data, validators)
+        if not dont_save_data:
+            mp.save_snapshot(path_snapshot)
+        return mp
 
-        filtered_probs = []
-        for dct in material_probs["matrix"]:
-            if (
-                dct["stage"]["apCost"] > 0.1
-                and dct["stage"]["code"] not in filter_stages
+    def _resolve_bodies(
+        self,
+        bodies,
+        validators,
+        url_stats,
+        url_rules,
+        path_stats,
+        path_rules,
+        dont_save_data,
+        force=False,
+    ):
+        """
+        Parses conditionally fetched data, filling the unchanged parts in from the
+        local copies or the current model.
+        Args:
+            bodies: dictionary. Response bodies, None where the data is unchanged.
+            validators: dictionary. Validators matching bodies, updated in place
+                if some data had to be fetched again.
+            force: bool. Parse the data even if none of it changed.
+        Returns:
+            material_probs, convertion_rules, itemdata, or None if nothing changed.
+        """
+        if not force and (
+            bodies["stats"] is None
+            and bodies["rules"] is None
+            and all(body is None for body in bodies["items"].values())
+        ):
+            return None
+
+        parsed = {}
+        for key, url, path in (
+            ("stats", url_stats, path_stats),
+            ("rules", url_rules, path_rules),
+        ):
+            body, sha1 = bodies[key], validators[key].get("sha1")
+            # Unchanged upstream, the local copy is only usable if it holds
+            # the exact same data.
+            if body is None and sha1 and file_validators(path).get("sha1") == sha1:
+                if key == "stats":
+                    parsed[key] = {"matrix": open_matrix(path)}
+                else:
+                    with open(path, "rb") as f:
+                        parsed[key] = json.load(f)
+                continue
+            if body is None:
+                body, validators[key] = request_conditional(url, {})
+            if not dont_save_data:
+                save_data(path, body, validators[key])
+            if key == "stats":
+                # Parsed record by record while the model is built.
+                parsed[key] = {"matrix": iter_matrix(_iter_bytes(body))}
+            else:
+                parsed[key] = json.loads(body)
+
+        itemdata = {}
+        for lang in gamedata_langs:
+            body = bodies["items"].get(lang)
+            if body is None:
+                itemdata[lang] = self.itemdata[lang]
+            else:
+                itemdata[lang] = parse_itemdata(json.loads(body))
+        return parsed["stats"], parsed["rules"], itemdata
+
+    def _patched(self, data, validators):
+        """
+        Applies refreshed data to a copy of the model. If the stages, the items,
+        the rules and the item names are the same, only the changed cells of the
+        drop matrix and the LP templates are patched, the lookup tables are
+        shared and the cached plans whose stages didn't change are kept.
+        Otherwise the model is built from scratch.
+        Args:
+            data: the material_probs, convertion_rules and itemdata returned by
+                _resolve_bodies.
+            validators: dictionary. Validators matching the data.
+        Returns:
+            mp: the refreshed model. Its changes attribute is a dict holding
+                "patched", and either the codes of the changed "stages" and the
+                number of "cells_changed", "cells_added", "cells_removed",
+                "costs_changed" and "plans_kept", or the "reason" of the rebuild.
+                A rebuild for changed stages or items also lists the "stages_added",
+                "stages_removed", "items_added" and "items_removed", and whether
+                the "stages_reordered" or the "items_reordered" without any
+                addition or removal.
+        """
+        material_probs, convertion_rules, itemdata = data
+        farms = _read_farms(
+            _filter_matrix(
+                material_probs["matrix"], self.filter_freq, self.filter_stages
+            )
+        )
+        changes: Dict[str, Any] = {"patched": False}
+        rules_sha1 = validators["rules"].get("sha1")
+        if self._shared_memory is not None:
+            # The unchanged arrays would be views of a segment about to be replaced.
+            changes["reason"] = "model in shared memory"
+        elif not rules_sha1 or rules_sha1 != self.validators["rules"].get("sha1"):
+            changes["reason"] = "formulas changed"
+        elif itemdata != self.itemdata:
+            changes["reason"] = "item names changed"
+        elif (
+            farms.stage_array != self.stage_array.tolist()
+            or farms.item_id_array != self.item_id_array.tolist()
+            or farms.item_array != self.item_array.tolist()
+        ):
+            changes["reason"] = "stages or items changed"
+            for name, new, old in (
+                ("stages", farms.stage_array, self.stage_array.tolist()),
+                ("items", farms.item_id_array, self.item_id_array.tolist()),
             ):
-                if not filter_freq or dct["times"] >= filter_freq:
-                    filtered_probs.append(dct)
-        material_probs["matrix"] = filtered_probs
+                changes[name + "_added"] = sorted(set(new) - set(old))
+                changes[name + "_removed"] = sorted(set(old) - set(new))
+                # The same codes in another order still move every index.
+                changes[name + "_reordered"] = (
+                    new != old
+                    and not changes[name + "_added"]
+                    and not changes[name + "_removed"]
+                )
+            if changes["stages_reordered"] or changes["items_reordered"]:
+                if not any(
+                    changes[name + suffix]
+                    for name in ("stages", "items")
+                    for suffix in ("_added", "_removed")
+                ):
+                    changes["reason"] = "stages or items reordered"
+        if "reason" in changes:
+            mp = self.from_data(
+                None,
+                convertion_rules,
+                itemdata,
+                filter_freq=self.filter_freq,
+                filter_stages=self.filter_stages,
+                solver=self.solver,
+                cache_size=self.plan_cache.maxsize,
+                cache_ttl=self.plan_cache.ttl,
+                validators=validators,
+                farms=farms,
+            )
+            mp.plan_store = self.plan_store
+            mp.changes = changes
+            return mp
+
+        old = self.probs_matrix.tocoo()
+        old_entries = dict(zip(zip(old.row.tolist(), old.col.tolist()), old.data))
+        changed = {
+            cell: rate
+            for cell, rate in farms.probs_entries.items()
+            if old_entries.get(cell) != rate
+        }
+        n_added = sum(cell not in old_entries for cell in changed)
+        removed = [cell for cell in old_entries if cell not in farms.probs_entries]
+        is_cost_changed = (
+            (farms.cost_lst != self.cost_lst)
+            | (farms.cost_exp_offset != self.cost_exp_offset)
+            | (farms.cost_gold_offset != self.cost_gold_offset)
+        )
+        changed_stages = np.unique(
+            [stage for stage, _ in changed]
+            + [stage for stage, _ in removed]
+            + np.flatnonzero(is_cost_changed).tolist()
+        ).astype(int)
+
+        mp = copy.copy(self)
+        mp._init_runtime(self.solver, self.plan_cache.maxsize, self.plan_cache.ttl)
+        mp.plan_store = self.plan_store
+        # The plans of the stages that didn't change stay valid under the same keys.
+        mp.data_generation = self.data_generation
+        mp.validators = validators
+        mp.cost_lst = farms.cost_lst
+        mp.cost_exp_offset = farms.cost_exp_offset
+        mp.cost_gold_offset = farms.cost_gold_offset
+        if n_added or removed:
+            # Cells appeared or disappeared, the matrices have to be rebuilt.
+            mp.probs_matrix = _sparse_from_entries(
+                farms.probs_entries, self.probs_matrix.shape
+            )
+            productions = None
+        else:
+            stages, items = (
+                np.array([cell[k] for cell in changed], dtype=int) for k in (0, 1)
+            )
+            rates = np.fromiter(changed.values(), dtype=float, count=len(changed))
+            mp.probs_matrix = _patch_sparse(self.probs_matrix, stages, items, rates)
+            productions = {}
+            for (outcome, _, _), template in self._lp_templates.items():
+                if outcome not in productions:
+                    productions[outcome] = (
+                        _patch_sparse(template.A_ub, items, stages, -rates),
+                        _patch_sparse(template.A_dual, stages, items, rates),
+                    )
+        mp._lp_templates = mp._build_lp_templates(productions)
+        mp._warm_solvers = {}
+        mp._productions = {}
+        mp._scaled_templates = {}
+        mp.changes = {
+            "patched": True,
+            "stages": sorted(self.stage_array[changed_stages].tolist()),
+            "cells_changed": len(changed) - n_added,
+            "cells_added": n_added,
+            "cells_removed": len(removed),
+            "costs_changed": int(is_cost_changed.sum()),
+        }
+        mp.changes["plans_kept"] = mp.keep_plans(self)
+        return mp
 
-        self._set_lp_parameters(*self._pre_processing(material_probs, convertion_rules))
+    def keep_plans(self, old_mp) -> int:
+        """
+        Replaces the plan cache of a patched model with the plans cached by the
+        model it was patched from that the patch left valid, those excluding
+        every changed stage. Also called by process workers holding their own
+        copy of old_mp, see SolverPool.swap.
+        Args:
+            old_mp: MaterialPlanning. The model this one was patched from.
+        Returns:
+            kept: int. The number of plans kept.
+        """
+        changed_stages = np.flatnonzero(
+            np.isin(self.stage_array, self.changes["stages"])
+        )
+        self.plan_cache = old_mp.plan_cache.copy(
+            lambda stage_idx: not len(changed_stages)
+            or (stage_idx is not None and not np.isin(changed_stages, stage_idx).any())
+        )
+        return self.plan_cache.stats()["size"]
 
-    def _pre_processing(self, material_probs, convertion_rules):
+    def _init_runtime(self, solver, cache_size, cache_ttl):
         """
-        Compute costs, convertion rules and items probabilities from requested dictionaries.
+        Sets up the solver and the plan cache, independently from the data.
+        """
+        if solver not in SOLVERS:
+            raise ValueError(
+                "Unknown solver {}, expected one of {}".format(solver, SOLVERS)
+            )
+        if solver == "highs-warm" and highspy is None:
+            raise ValueError("Solver highs-warm requires highspy to be installed")
+        self.solver = solver
+        self._warm_solvers_lock = threading.Lock()
+        self.plan_cache = PlanCache(cache_size, cache_ttl)
+        self.data_generation = 0
+        # Set when the arrays are views of a segment published by SharedModel.
+        self._shared_memory = None
+        # Summary of the data refresh this model comes from, see refreshed.
+        self.changes = None
+        # PlanStore persisting the plans across processes and restarts, or None.
+        # Set by the owner of the model and passed on to its refreshed models.
+        self.plan_store = None
+        self._data_version = None
+        # (flags, non_cn_compat) -> item values, see item_values.
+        self._item_values = {}
+
+    def _load_data(
+        self,
+        material_probs,
+        convertion_rules,
+        itemdata,
+        filter_freq,
+        filter_stages,
+        farms=None,
+    ):
+        """
+        Filters the stats data and sets up every parameter of the model.
         Args:
-            material_probs: List of dictionaries recording the dropping info per stage per item.
-                Keys of instances: ["itemID", "times", "itemName", "quantity", "apCost", "stageCode", "stageID"].
-            convertion_rules: List of dictionaries recording the rules of composing.
-                Keys of instances: ["id", "name", "level", "source", "madeof"].
+            material_probs: dictionary. Content of the stats json file, the "matrix"
+                records may also be streamed, e.g. by stream_data.
+            convertion_rules: dictionary. Content of the rules json file.
+            itemdata: dictionary. Item names per region, as returned by request_itemdata.
+            filter_freq: int or None. The lowest frequency that we consider.
+                No filter will be applied if None.
+            filter_stages: list of stage codes to ignore, or None.
+            farms: Farms or None. Stage data already read from the filtered
+                records by _read_farms, material_probs is then ignored.
         """
-        # To count items and stages.
-        additional_items = {"30135": u"D32钢", "30125": u"双极纳米片", "30115": u"聚合剂"}
-        exp_unit = 200 * (30.0 - 0.048 * 30) / 7400
-        gold_unit = 0.004
-        exp_worths = {
-            "2001": exp_unit,
-            "2002": exp_unit * 2,
-            "2003": exp_unit * 5,
-            "2004": exp_unit * 10,
-            "3003": exp_unit * 2,
-        }
-        gold_worths = {}
-
-        item_dct = {}
-        stage_dct = {}
-        for dct in material_probs["matrix"]:
-            item_dct[dct["item"]["itemId"]] = dct["item"]["name"]
-            stage_dct[dct["stage"]["code"]] = dct["stage"]["code"]
-        item_dct.update(additional_items)
-
-        # To construct mapping from id to item names.
-        item_array = []
-        item_id_array = []
-        for k, v in item_dct.items():
-            try:
-                float(k)
-                item_array.append(v)
-                item_id_array.append(k)
-            except ValueError:
-                pass
-        self.item_array = np.array(item_array)
-        self.item_id_array = np.array(item_id_array)
-        self.item_id_rv = {int(v): k for k, v in enumerate(item_id_array)}
-        self.item_dct_rv = {v: k for k, v in enumerate(item_array)}
+        if filter_stages is None:
+            filter_stages = []
+        self.filter_freq = filter_freq
+        self.filter_stages = filter_stages
+        self._shared_memory = None
+        self._set_itemdata(itemdata)
+
+        if farms is None:
+            # Filtered on the fly, records may be streamed from the data.
+            farms = _read_farms(
+                _filter_matrix(material_probs["matrix"], filter_freq, filter_stages)
+            )
+        self._set_lp_parameters(*self._pre_processing(farms, convertion_rules))
 
-        # To construct mapping from stage id to stage names and vice versa.
-        stage_array = []
-        for k, v in stage_dct.items():
-            stage_array.append(v)
-        self.stage_array = np.array(stage_array)
-        self.stage_dct_rv = {v: k for k, v in enumerate(self.stage_array)}
+    def _set_itemdata(self, itemdata):
+        """
+        Sets the item names per region and the reverse lookup tables.
+        """
+        self.itemdata = itemdata
+        self.itemdata_rv = {
+            lang: {v: k for k, v in dct.items()} for lang, dct in self.itemdata.items()
+        }
 
-        # To format dropping records into sparse probability matrix
-        probs_matrix = np.zeros([len(stage_array), len(item_array)])
-        cost_lst = np.zeros(len(stage_array))
-        cost_exp_offset = np.zeros(len(stage_array))
-        cost_gold_offset = np.zeros(len(stage_array))
-        for dct in material_probs["matrix"]:
-            try:
-                cost_lst[self.stage_dct_rv[dct["stage"]["code"]]] = dct["stage"][
-                    "apCost"
-                ]
-                float(dct["item"]["itemId"])
-                probs_matrix[
-                    self.stage_dct_rv[dct["stage"]["code"]],
-                    self.item_dct_rv[dct["item"]["name"]],
-                ] = dct["quantity"] / float(dct["times"])
-                if cost_lst[self.stage_dct_rv[dct["stage"]["code"]]] != 0:
-                    cost_gold_offset[self.stage_dct_rv[dct["stage"]["code"]]] = -dct[
-                        "stage"
-                    ]["apCost"] * (12 * gold_unit)
-            except ValueError:
-                pass
+    def save_snapshot(self, path):
+        """
+        Stores the preprocessed model, LP templates and lookup tables included, in
+        a versioned file that from_snapshot loads without parsing the data,
+        requesting the item tables or building the linear programs. The file
+        holds a shared memory segment, see to_shared_memory.
+        Args:
+            path: string. local path of the snapshot.
+        """
+        arrays, meta = self._snapshot_arrays(templates=True)
+        meta["version"] = SNAPSHOT_VERSION
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written aside and renamed so that readers never see a partial file.
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        write_segment_file(tmp_path, arrays, meta)
+        os.replace(tmp_path, path)
+
+    def _snapshot_arrays(
+        self, templates=False
+    ) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+        """
+        Collects everything needed to restore the preprocessed model.
+        Args:
+            templates: bool. Also include the LP templates and the lookup tables,
+                so that they don't have to be rebuilt by _restore_snapshot.
+        Returns:
+            arrays: a dict of numpy arrays.
+            meta: a JSON serializable dict with the filters, the validators,
+                the item names and the lookup tables.
+        """
+        arrays = {
+            "item_array": self.item_array,
+            "item_id_array": self.item_id_array,
+            "stage_array": self.stage_array,
+            "cost_lst": self.cost_lst,
+            "cost_exp_offset": self.cost_exp_offset,
+            "cost_gold_offset": self.cost_gold_offset,
+            "convertion_cost_lst": self.convertion_cost_lst,
+        }
+        for name in SNAPSHOT_MATRICES:
+            arrays.update(_sparse_to_arrays(name, getattr(self, name)))
+        if templates:
+            # The production matrices only depend on outcome and the costs
+            # only on gold_demand and exp_demand, each is stored once.
+            for (outcome, gold_demand, exp_demand), tpl in self._lp_templates.items():
+                suffix = "_{:d}".format(outcome)
+                arrays.update(_sparse_to_arrays("A_ub" + suffix, tpl.A_ub))
+                arrays.update(_sparse_to_arrays("A_dual" + suffix, tpl.A_dual))
+                arrays["cost_{:d}{:d}".format(gold_demand, exp_demand)] = tpl.cost
+            arrays["is_material"] = self.is_material
+            arrays["item_levels"] = self.item_levels
+            arrays["craft_target_idx"] = self.craft_target_idx
+        meta = {
+            "filter_freq": self.filter_freq,
+            "filter_stages": list(self.filter_stages),
+            "validators": self.validators,
+            "convertions_dct": self.convertions_dct,
+            "itemdata": self.itemdata,
+            "templates": templates,
+        }
+        if templates:
+            meta["tables"] = {
+                "item_names": {
+                    lang: names.tolist() for lang, names in self.item_names.items()
+                },
+                "craft_materials": [
+                    [idx.tolist(), counts] for idx, counts in self.craft_materials
+                ],
+                "name_index": self.name_index,
+                "normalized_index": self.normalized_index,
+            }
+        return arrays, meta
+
+    @classmethod
+    def from_snapshot(
+        cls,
+        path,
+        path_stats="data/matrix.json",
+        path_rules="data/formula.json",
+        filter_freq=FILTER_FREQ_DEFAULT,
+        filter_stages=None,
+        solver=DEFAULT_SOLVER,
+        cache_size=PLAN_CACHE_SIZE_DEFAULT,
+        cache_ttl=None,
+    ):
+        """
+        Loads a model stored by save_snapshot.
+        Args:
+            path: string. local path of the snapshot.
+            path_stats: string. local path to the dropping rate stats data.
+            path_rules: string. local path to the composing rules data.
+            See __init__ for the other arguments.
+        Raises:
+            StaleSnapshotError: if the snapshot has another format version, other
+                filters, or doesn't match the local data files.
+        """
+        mp = cls.__new__(cls)
+        mp._init_runtime(solver, cache_size, cache_ttl)
+        mp._load_snapshot(path, path_stats, path_rules, filter_freq, filter_stages)
+        return mp
 
-            try:
-                cost_exp_offset[self.stage_dct_rv[dct["stage"]["code"]]] -= (
-                    exp_worths[dct["item"]["itemId"]]
-                    * dct["quantity"]
-                    / float(dct["times"])
+    def _load_snapshot(self, path, path_stats, path_rules, filter_freq, filter_stages):
+        """
+        Sets up every parameter of the model from a snapshot, see from_snapshot.
+        """
+        if filter_stages is None:
+            filter_stages = []
+        arrays, meta = read_segment_file(path)
+        if meta.get("version") != SNAPSHOT_VERSION:
+            raise StaleSnapshotError("Snapshot format version changed")
+        if meta["filter_freq"] != filter_freq or meta["filter_stages"] != list(
+            filter_stages
+        ):
+            raise StaleSnapshotError("Snapshot was built with other filters")
+        for key, data_path in (("stats", path_stats), ("rules", path_rules)):
+            sha1 = meta["validators"][key].get("sha1")
+            if not sha1 or file_validators(data_path).get("sha1") != sha1:
+                raise StaleSnapshotError("{} changed".format(data_path))
+        self._restore_snapshot(arrays, meta)
+
+    def to_shared_memory(self, name):
+        """
+        Copies the preprocessed model, LP templates and lookup tables included, to
+        a new shared memory segment that from_shared_memory attaches to.
+        Args:
+            name: string. Name of the shared memory segment.
+        Returns:
+            shm: the SharedMemory of the segment.
+        Raises:
+            FileExistsError: if a segment with that name already exists.
+        """
+        arrays, meta = self._snapshot_arrays(templates=True)
+        meta["version"] = SNAPSHOT_VERSION
+        return write_segment(name, arrays, meta)
+
+    @classmethod
+    def from_shared_memory(
+        cls,
+        name,
+        solver=DEFAULT_SOLVER,
+        cache_size=PLAN_CACHE_SIZE_DEFAULT,
+        cache_ttl=None,
+    ):
+        """
+        Attaches to a model published by SharedModel. The arrays of the model are
+        read-only views of the shared memory segment, nothing is copied.
+        Args:
+            name: string. Name of the shared memory segment.
+            See __init__ for the other arguments.
+        Raises:
+            FileNotFoundError: if the segment doesn't exist (anymore).
+            StaleSnapshotError: if the segment has another format version.
+        """
+        shm, arrays, meta = read_segment(name)
+        if meta.get("version") != SNAPSHOT_VERSION:
+            shm.close()
+            raise StaleSnapshotError("Shared model format version changed")
+        mp = cls.__new__(cls)
+        mp._init_runtime(solver, cache_size, cache_ttl)
+        mp._restore_snapshot(arrays, meta)
+        # The views are only valid as long as the segment stays mapped.
+        mp._shared_memory = shm
+        return mp
+
+    def _restore_snapshot(self, arrays, meta):
+        """
+        Sets up every parameter of the model from the output of _snapshot_arrays.
+        Args:
+            arrays: a mapping of numpy arrays, read-only views of a shared
+                memory segment or of a snapshot.
+            meta: dictionary. Metadata stored alongside the arrays.
+        """
+        matrices = {
+            name: _sparse_from_arrays(name, arrays) for name in SNAPSHOT_MATRICES
+        }
+        self._set_indexes(
+            arrays["item_array"], arrays["item_id_array"], arrays["stage_array"]
+        )
+        convertions_group = (
+            matrices["convertion_matrix"],
+            matrices["convertion_outc_matrix"],
+            arrays["convertion_cost_lst"],
+        )
+        farms_group = (
+            matrices["probs_matrix"],
+            arrays["cost_lst"],
+            arrays["cost_exp_offset"],
+            arrays["cost_gold_offset"],
+        )
+        templates = tables = None
+        if meta.get("templates"):
+            productions = {
+                outcome: (
+                    _sparse_from_arrays("A_ub_{:d}".format(outcome), arrays, "csc"),
+                    _sparse_from_arrays("A_dual_{:d}".format(outcome), arrays),
                 )
-            except (KeyError, ValueError):
-                pass
-
-            try:
-                cost_gold_offset[self.stage_dct_rv[dct["stage"]["code"]]] -= (
-                    gold_worths[dct["item"]["itemId"]]
-                    * dct["quantity"]
-                    / float(dct["times"])
+                for outcome in (False, True)
+            }
+            templates = {
+                (outcome, gold_demand, exp_demand): LPTemplate(
+                    A_ub,
+                    A_dual,
+                    arrays["cost_{:d}{:d}".format(gold_demand, exp_demand)],
                 )
-            except (KeyError, ValueError):
-                pass
+                for outcome, (A_ub, A_dual) in productions.items()
+                for gold_demand in (False, True)
+                for exp_demand in (False, True)
+            }
+            tables = dict(
+                meta["tables"],
+                is_material=arrays["is_material"],
+                item_levels=arrays["item_levels"],
+                craft_target_idx=arrays["craft_target_idx"],
+            )
 
-        # Hardcoding: extra gold farmed.
-        cost_gold_offset[self.stage_dct_rv["S4-6"]] -= 3228 * gold_unit
-        cost_gold_offset[self.stage_dct_rv["S5-2"]] -= 2484 * gold_unit
+        self.filter_freq = meta["filter_freq"]
+        self.filter_stages = meta["filter_stages"]
+        self.validators = meta["validators"]
+        self.convertions_dct = meta["convertions_dct"]
+        self._set_itemdata(
+            {
+                lang: {int(k): v for k, v in names.items()}
+                for lang, names in meta["itemdata"].items()
+            }
+        )
+        self._set_lp_parameters(convertions_group, farms_group, templates, tables)
+
+    def __getstate__(self):
+        if self._shared_memory is not None:
+            # Other processes attach to the same segment instead of receiving
+            # a copy of the arrays.
+            return {
+                "shared_memory": self._shared_memory.name,
+                "solver": self.solver,
+                "cache_size": self.plan_cache.maxsize,
+                "cache_ttl": self.plan_cache.ttl,
+                "plan_store": self.plan_store,
+            }
+        # HiGHS instances and locks can't be pickled, they are recreated lazily.
+        state = self.__dict__.copy()
+        del state["_warm_solvers"], state["_warm_solvers_lock"]
+        return state
+
+    def __setstate__(self, state):
+        if "shared_memory" in state:
+            mp = self.from_shared_memory(
+                state["shared_memory"],
+                state["solver"],
+                state["cache_size"],
+                state["cache_ttl"],
+            )
+            self.__dict__.update(mp.__dict__)
+            self.plan_store = state["plan_store"]
+            return
+        self.__dict__.update(state)
+        self._warm_solvers = {}
+        self._warm_solvers_lock = threading.Lock()
+
+    def _pre_processing(self, farms, convertion_rules):
+        """
+        Compute costs, convertion rules and items probabilities from requested dictionaries.
+        Args:
+            farms: Farms. The stage data read from the stats records by _read_farms.
+            convertion_rules: List of dictionaries recording the rules of composing.
+                Keys of instances: ["id", "name", "level", "source", "madeof"].
+        """
+        gold_unit = GOLD_UNIT
+        self._set_indexes(
+            np.array(farms.item_array),
+            np.array(farms.item_id_array),
+            np.array(farms.stage_array),
+        )
+        probs_matrix = _sparse_from_entries(
+            farms.probs_entries, (len(farms.stage_array), len(farms.item_array))
+        )
+        item_array = farms.item_array
 
         # To build equivalence relationship from convert_rule_dct.
         self.convertions_dct = {}
-        convertion_matrix = []
-        convertion_outc_matrix = []
+        convertion_entries = {}
+        convertion_outc_entries = {}
         convertion_cost_lst = []
-        for rule in convertion_rules:
-            convertion = np.zeros(len(self.item_array))
-            convertion[self.item_dct_rv[rule["name"]]] = 1
+        for i, rule in enumerate(convertion_rules):
+            convertion = {self.item_dct_rv[rule["name"]]: 1}
 
             comp_dct = {comp["id"]: comp["count"] for comp in rule["costs"]}
             self.convertions_dct[rule["id"]] = comp_dct
             for item_id in comp_dct:
-                convertion[self.item_id_rv[int(item_id)]] -= comp_dct[item_id]
-            convertion_matrix.append(copy.deepcopy(convertion))
+                idx = self.item_id_rv[int(item_id)]
+                convertion[idx] = convertion.get(idx, 0) - comp_dct[item_id]
+            convertion_entries.update({(i, k): v for k, v in convertion.items()})
 
             outc_dct = {outc["name"]: outc["count"] for outc in rule["extraOutcome"]}
             outc_wgh = {outc["name"]: outc["weight"] for outc in rule["extraOutcome"]}
             weight_sum = float(sum(outc_wgh.values()))
             for item_id in outc_dct:
-                convertion[self.item_dct_rv[item_id]] += (
-                    outc_dct[item_id] * 0.175 * outc_wgh[item_id] / weight_sum
+                idx = self.item_dct_rv[item_id]
+                convertion[idx] = convertion.get(idx, 0) + (
+                    outc_dct[item_id]
+                    * EXTRA_OUTCOME_RATE
+                    * outc_wgh[item_id]
+                    / weight_sum
                 )
-            convertion_outc_matrix.append(convertion)
+            convertion_outc_entries.update({(i, k): v for k, v in convertion.items()})
 
-            convertion_cost_lst.append(rule["goldCost"] * 0.004)
+            convertion_cost_lst.append(rule["goldCost"] * gold_unit)
 
+        convertions_shape = (len(convertion_rules), len(item_array))
         convertions_group = (
-            np.array(convertion_matrix),
-            np.array(convertion_outc_matrix),
+            _sparse_from_entries(convertion_entries, convertions_shape),
+            _sparse_from_entries(convertion_outc_entries, convertions_shape),
             np.array(convertion_cost_lst),
         )
-        farms_group = (probs_matrix, cost_lst, cost_exp_offset, cost_gold_offset)
+        farms_group = (
+            probs_matrix,
+            farms.cost_lst,
+            farms.cost_exp_offset,
+            farms.cost_gold_offset,
+        )
 
         return convertions_group, farms_group
 
-    def _set_lp_parameters(self, convertions_group, farms_group):
+    def _set_indexes(self, item_array, item_id_array, stage_array):
+        """
+        Sets the item and stage arrays and the lookup tables derived from them.
+        Args:
+            item_array: array of the item names, in column order.
+            item_id_array: array of the item IDs, in column order.
+            stage_array: array of the stage codes, in row order.
+        """
+        self.item_array = item_array
+        self.item_id_array = item_id_array
+        self.item_id_rv = {int(v): k for k, v in enumerate(item_id_array)}
+        self.item_dct_rv = {v: k for k, v in enumerate(item_array)}
+        self.stage_array = stage_array
+        self.stage_dct_rv = {v: k for k, v in enumerate(self.stage_array)}
+        self.non_cn_stage_mask = np.array(
+            [is_non_cn_stage(stage) for stage in self.stage_array], dtype=bool
+        )
+
+    def _set_lp_parameters(
+        self, convertions_group, farms_group, templates=None, tables=None
+    ):
         """
         Object initialization.
         Args:
-            convertion_matrix: matrix of shape [n_rules, n_items].
+            convertion_matrix: sparse matrix of shape [n_rules, n_items].
                 Each row represent a rule.
             convertion_cost_lst: list. Cost in equal value to the currency spent in convertion.
             probs_matrix: sparse matrix of shape [n_stages, n_items].
                 Items per clear (probabilities) at each stage.
             cost_lst: list. Costs per clear at each stage.
+            templates: dict of LPTemplate built from the above, as returned
+                by _build_lp_templates. Built here if None.
+            tables: dictionary. The lookup tables of _set_render_tables and
+                _set_name_index, as stored by _snapshot_arrays. Built here if None.
         """
         (
             self.convertion_matrix,
@@ -232,118 +1046,620 @@ class MaterialPlanning(object):
             self.cost_gold_offset,
         ) = farms_group
 
-        assert len(self.probs_matrix) == len(self.cost_lst)
-        assert len(self.convertion_matrix) == len(self.convertion_cost_lst)
+        assert self.probs_matrix.shape[0] == len(self.cost_lst)
+        assert self.convertion_matrix.shape[0] == len(self.convertion_cost_lst)
         assert self.probs_matrix.shape[1] == self.convertion_matrix.shape[1]
 
+        if tables is None:
+            self._set_render_tables()
+            self._set_name_index()
+        else:
+            self._set_lookup_tables(tables)
+        # Assigned in one go so that a concurrent solve never sees a mix of
+        # templates from two different data loads.
+        self._lp_templates = templates or self._build_lp_templates()
+        self._warm_solvers = {}
+        self._productions = {}
+        self._scaled_templates = {}
+        # Plans cached before this point were computed on the previous data.
+        self.data_generation += 1
+        self.plan_cache.clear()
+        self._data_version = None
+        self._item_values = {}
+
+    def _set_render_tables(self):
+        """
+        Precomputes the lookup tables _render_plan formats solutions with: the item
+        names of every language aligned to item_id_array (falling back to the
+        Chinese name), which items are materials and their level, and the target
+        and materials of every convertion rule.
+        """
+        item_ids = [int(item_id) for item_id in self.item_id_array]
+        fallback = self.itemdata["zh_CN"]
+        self.item_names = {
+            lang: np.array(
+                [names.get(item_id, fallback.get(item_id)) for item_id in item_ids],
+                dtype=object,
+            )
+            for lang, names in self.itemdata.items()
+        }
+        self.is_material = np.array(
+            [len(item_id) == 5 for item_id in self.item_id_array], dtype=bool
+        )
+        self.item_levels = np.array(
+            [
+                int(item_id[-1]) if len(item_id) == 5 else 0
+                for item_id in self.item_id_array
+            ]
+        )
+        self.craft_target_idx = np.asarray(
+            self.convertion_matrix.argmax(axis=1)
+        ).ravel()
+        self.craft_materials = []
+        for idx in self.craft_target_idx:
+            materials = self.convertions_dct[self.item_id_array[idx]]
+            self.craft_materials.append(
+                (
+                    np.array([self.item_id_rv[int(k)] for k in materials], dtype=int),
+                    list(materials.values()),
+                )
+            )
+
+    def _set_name_index(self):
+        """
+        Precomputes the lookup tables of convert_requirements: every item ID and
+        every item name in every language mapped to (item index, languages),
+        and the normalized names, sorted for prefix searches.
+        """
+        name_index = {
+            str(int(item_id)): (idx, ("id",))
+            for idx, item_id in enumerate(self.item_id_array)
+        }
+        for lang, names in self.itemdata.items():
+            for item_id, name in names.items():
+                idx = self.item_id_rv.get(item_id)
+                if idx is None:
+                    # Not an item of the model, e.g. furniture.
+                    continue
+                entry = name_index.get(name)
+                if entry is None:
+                    name_index[name] = (idx, (lang,))
+                elif entry[0] == idx:
+                    name_index[name] = (idx, entry[1] + (lang,))
+        self.name_index = name_index
+
+        # normalized name -> (item index, languages, name), first name wins.
+        self.normalized_index = {}
+        for name, (idx, langs) in name_index.items():
+            if langs != ("id",):
+                self.normalized_index.setdefault(
+                    normalize_name(name), (idx, langs, name)
+                )
+        self.normalized_names = sorted(self.normalized_index)
+
+    def _set_lookup_tables(self, tables):
+        """
+        Sets the lookup tables of _set_render_tables and _set_name_index from
+        their copy stored by _snapshot_arrays.
+        """
+        self.item_names = {
+            lang: np.array(names, dtype=object)
+            for lang, names in tables["item_names"].items()
+        }
+        self.is_material = tables["is_material"]
+        self.item_levels = tables["item_levels"]
+        self.craft_target_idx = tables["craft_target_idx"]
+        self.craft_materials = [
+            (np.array(idx, dtype=int), counts)
+            for idx, counts in tables["craft_materials"]
+        ]
+        self.name_index = {
+            name: (idx, tuple(langs))
+            for name, (idx, langs) in tables["name_index"].items()
+        }
+        self.normalized_index = {
+            normalized: (idx, tuple(langs), name)
+            for normalized, (idx, langs, name) in tables["normalized_index"].items()
+        }
+        self.normalized_names = sorted(self.normalized_index)
+
+    def _build_lp_templates(
+        self, productions=None
+    ) -> Dict[Tuple[bool, bool, bool], LPTemplate]:
+        """
+        Builds the linear program of every flag combination accepted by
+        _get_plan_no_prioties.
+        Args:
+            productions: dict mapping outcome to the (A_ub, A_dual) returned by
+                _production. Built if None.
+        Returns:
+            templates: a dict mapping (outcome, gold_demand, exp_demand) to a LPTemplate.
+        """
+        if productions is None:
+            productions = {
+                outcome: self._production(
+                    self.convertion_outc_matrix if outcome else self.convertion_matrix
+                )
+                for outcome in (False, True)
+            }
+
+        templates = {}
+        for gold_demand in (False, True):
+            for exp_demand in (False, True):
+                cost = self._lp_cost(gold_demand, exp_demand)
+                for outcome, (A_ub, A_dual) in productions.items():
+                    templates[outcome, gold_demand, exp_demand] = LPTemplate(
+                        A_ub, A_dual, cost
+                    )
+        return templates
+
+    def _production(self, convertion_matrix):
+        """
+        Builds the constraint matrices of the linear program.
+        Args:
+            convertion_matrix: sparse matrix of shape [n_rules, n_items].
+        Returns:
+            A_ub: sparse matrix of shape [n_items, n_stages + n_rules], see LPTemplate.
+            A_dual: sparse matrix of shape [n_stages + n_rules, n_items].
+        """
+        A = sparse.vstack([self.probs_matrix, convertion_matrix], format="csr")
+        return -A.T.tocsc(), A
+
+    def _lp_cost(self, gold_demand, exp_demand, exp_unit=EXP_UNIT, gold_unit=GOLD_UNIT):
+        """
+        Builds the objective of the linear program.
+        Args:
+            exp_unit: float. AP worth of 200 exp, see EXP_UNIT.
+            gold_unit: float. AP worth of 1 LMD, see GOLD_UNIT.
+        Returns:
+            cost: array of shape [n_stages + n_rules].
+        """
+        # The offsets and the crafting costs are proportional to the units.
+        cost_exp_offset = self.cost_exp_offset
+        if exp_unit != EXP_UNIT:
+            cost_exp_offset = cost_exp_offset * (exp_unit / EXP_UNIT)
+        cost_gold_offset, convertion_cost_lst = (
+            self.cost_gold_offset,
+            self.convertion_cost_lst,
+        )
+        if gold_unit != GOLD_UNIT:
+            cost_gold_offset = cost_gold_offset * (gold_unit / GOLD_UNIT)
+            convertion_cost_lst = convertion_cost_lst * (gold_unit / GOLD_UNIT)
+        farm_cost = (
+            self.cost_lst
+            + (cost_exp_offset if exp_demand else 0)
+            + (cost_gold_offset if gold_demand else 0)
+        )
+        assert np.any(farm_cost >= 0)
+        if not gold_demand:
+            convertion_cost_lst = np.zeros(self.convertion_cost_lst.shape)
+        return np.hstack([farm_cost, convertion_cost_lst])
+
     def update(
         self,
         filter_freq=FILTER_FREQ_DEFAULT,
         filter_stages=None,
-        url_stats="result/matrix?show_stage_details=true&show_item_details=true",
-        url_rules="formula",
+        url_stats=URL_STATS_DEFAULT,
+        url_rules=URL_RULES_DEFAULT,
         path_stats="data/matrix.json",
         path_rules="data/formula.json",
-        gamedata_path="https://raw.githubusercontent.com/Kengxxiao/ArknightsGameData/master/{}/gamedata/excel/item_table.json",
+        gamedata_path=GAMEDATA_PATH_DEFAULT,
         dont_save_data=False,
+        path_snapshot="data/model.snapshot",
     ):
         """
         To update parameters when probabilities change or new items added.
+        The data is requested conditionally and the model is only updated if
+        some of it changed upstream, by patching the changed cells if possible
+        (see refreshed). A summary of the changes is set as self.changes.
         Args:
             url_stats: string. url to the dropping rate stats data.
             url_rules: string. url to the composing rules data.
             path_stats: string. local path to the dropping rate stats data.
             path_rules: string. local path to the composing rules data.
+        Returns:
+            updated: bool. False if the data was unchanged and nothing was rebuilt.
         """
-        material_probs, convertion_rules = request_data(
-            penguin_url + url_stats,
-            penguin_url + url_rules,
-            path_stats,
-            path_rules,
-            gamedata_path,
-            dont_save_data,
-        )
-        self.itemdata = request_itemdata(gamedata_path)
-        self.itemdata_rv = {
-            lang: {v: k for k, v in dct.items()} for lang, dct in self.itemdata.items()
-        }
-
-        if filter_freq:
-            if filter_stages is None:
-                filter_stages = []
-            filtered_probs = []
-            for dct in material_probs["matrix"]:
-                if (
-                    dct["times"] >= filter_freq
-                    and dct["stage"]["code"] not in filter_stages
-                ):
-                    filtered_probs.append(dct)
-            material_probs["matrix"] = filtered_probs
-
-        self._set_lp_parameters(*self._pre_processing(material_probs, convertion_rules))
+        if filter_stages is None:
+            filter_stages = []
+        stt = time.perf_counter()
+        result = "failed"
+        try:
+            bodies, validators = request_data_conditional(
+                penguin_url + url_stats,
+                penguin_url + url_rules,
+                gamedata_path,
+                self.validators,
+            )
+            data = self._resolve_bodies(
+                bodies,
+                validators,
+                penguin_url + url_stats,
+                penguin_url + url_rules,
+                path_stats,
+                path_rules,
+                dont_save_data,
+                # New filters need a rebuild even if the data is identical.
+                force=filter_freq != self.filter_freq
+                or filter_stages != self.filter_stages,
+            )
+            if data is None:
+                result = "unchanged"
+                return False
+            if filter_freq != self.filter_freq or filter_stages != self.filter_stages:
+                self._load_data(*data, filter_freq, filter_stages)
+                self.validators = validators
+                self.changes = {"patched": False, "reason": "filters changed"}
+            else:
+                # Built aside and swapped in, as _load_data would do in place.
+                self.__dict__.update(self._patched(data, validators).__dict__)
+            if not dont_save_data:
+                self.save_snapshot(path_snapshot)
+            result = "patched" if self.changes["patched"] else "updated"
+            return True
+        finally:
+            record_refresh(time.perf_counter() - stt, result)
 
     def _get_plan_no_prioties(
-        self, demand_lst, outcome=False, gold_demand=True, exp_demand=True
+        self,
+        demand_lst,
+        outcome=False,
+        gold_demand=True,
+        exp_demand=True,
+        stage_idx=None,
+        template=None,
+        presolve=False,
+        timer=None,
     ):
         """
         To solve linear programming problem without prioties.
         Args:
             demand_lst: list of materials demand. Should include all items (zero if not required).
+            stage_idx: array of the indices of the stages allowed in the plan.
+                All stages are considered if None.
+            template: LPTemplate of the flags already restricted to stage_idx,
+                as returned by _get_template. Looked up if None.
+            presolve: bool. Solve only the part of the problem that can contribute
+                to the demand, see _presolve. The values of the items outside of
+                it are left at zero. Ignored by the highs-warm solver.
+            timer: PhaseTimer or None. Accumulates the time spent solving.
         Returns:
-            strategy: list of required clear times for each stage.
-            fun: estimated total cost.
-        """
-        A_ub = (
-            np.vstack([self.probs_matrix, self.convertion_outc_matrix])
-            if outcome
-            else np.vstack([self.probs_matrix, self.convertion_matrix])
-        ).T
-        farm_cost = (
-            self.cost_lst
-            + (self.cost_exp_offset if exp_demand else 0)
-            + (self.cost_gold_offset if gold_demand else 0)
-        )
-        convertion_cost_lst = (
-            self.convertion_cost_lst
-            if gold_demand
-            else np.zeros(self.convertion_cost_lst.shape)
-        )
-        cost = np.hstack([farm_cost, convertion_cost_lst])
-        assert np.any(farm_cost >= 0)
+            x: array of the clear times of each stage followed by the crafting
+                times of each rule. None if no solution was found.
+            y: array of the value of each item, the dual solution of the problem.
+                None if no solution was found.
+            status: int. The linprog status of the primal problem.
+        """
+        key = (bool(outcome), bool(gold_demand), bool(exp_demand))
+        timer = timer or PhaseTimer()
+        if self.solver == "highs-warm":
+            warm_solver = self._get_warm_solver(key)
+            metrics.observe("arkplanner_lp_rows", warm_solver.n_items)
+            metrics.observe("arkplanner_lp_columns", warm_solver.n_vars)
+            with timer.phase("primal"):
+                x, y, status = warm_solver.solve(demand_lst, stage_idx)
+            _record_solve(timer, "primal", "highs-warm", status)
+            if status not in FALLBACK_STATUSES:
+                return x, y, status
+            # Continue with the linprog methods of the chain.
+            presolve, template = False, None
+
+        if presolve:
+            return self._solve_presolved(key, demand_lst, stage_idx, timer)
+        with timer.phase("mask"):
+            template = template or self._get_template(key, stage_idx)
+        return self._solve_template(template, demand_lst, timer)
+
+    def _solve_template(self, template: LPTemplate, demand_lst, timer=None):
+        """
+        Solves a linear program with linprog, see _get_plan_no_prioties.
+        """
+        A_ub, A_dual, cost, row_scale, col_scale = template
+        timer = timer or PhaseTimer()
+        metrics.observe("arkplanner_lp_rows", A_ub.shape[0])
+        metrics.observe("arkplanner_lp_columns", A_ub.shape[1])
+        demand = np.asarray(demand_lst, dtype=float)
+        if row_scale is not None:
+            demand = demand * row_scale
+        # The largest demand is brought close to 1 as well, which divides the
+        # solution by the same factor and leaves the item values unchanged.
+        demand_max = np.abs(demand).max()
+        rhs_scale = 2.0 ** -np.round(np.log2(demand_max)) if demand_max > 0 else 1.0
+        demand = demand * rhs_scale
+
+        with timer.phase("primal"):
+            solution, method = self._linprog_chain("primal", cost, A_ub, -demand, timer)
+        if solution.status != 0:
+            return None, None, solution.status
+        x = solution.x / rhs_scale
+
+        if method.startswith("highs"):
+            # The marginals of the demand constraints are the negated item values,
+            # no need to solve the dual problem.
+            y = -solution.ineqlin.marginals
+        else:
+            with timer.phase("dual"):
+                dual_solution, _ = self._linprog_chain(
+                    "dual", -demand, A_dual, cost, timer
+                )
+            if dual_solution.status != 0:
+                return None, None, dual_solution.status
+            y = dual_solution.x
 
-        excp_factor = 1.0
-        dual_factor = 1.0
+        if row_scale is not None:
+            x = x * col_scale
+            y = y * row_scale
+        return x, y, solution.status
 
-        solution = None
-        for _ in range(5):
-            solution = linprog(
-                c=cost,
-                A_ub=-A_ub,
-                b_ub=-np.array(demand_lst) * excp_factor,
-                method="interior-point",
-            )
-            if solution.status != 4:
+    def _linprog_chain(self, problem: str, c, A_ub, b_ub, timer):
+        """
+        Solves min c.x s.t. A_ub x <= b_ub, x >= 0 with the methods of the solver's
+        chain, moving on to the next method only if the previous one hit the
+        iteration limit or numerical difficulties.
+        Args:
+            problem: string. "primal" or "dual", recorded with every solve.
+            timer: PhaseTimer. Records the method and status of every solve.
+        Returns:
+            solution: the OptimizeResult of the last solve.
+            method: string. The linprog method of the last solve.
+        """
+        methods = SOLVER_CHAINS[self.solver]
+        for n, method in enumerate(methods, 1):
+            A, options = A_ub, {}
+            if method in DENSE_METHODS and sparse.issparse(A):
+                A = A.toarray()
+            elif method in SPARSE_METHODS and sparse.issparse(A):
+                options["sparse"] = True
+            solution = linprog(c=c, A_ub=A, b_ub=b_ub, method=method, options=options)
+            _record_solve(timer, problem, method, solution.status)
+            if solution.status not in FALLBACK_STATUSES:
                 break
+        metrics.observe("arkplanner_solve_attempts", n, problem=problem)
+        return solution, method
 
-            excp_factor /= 10.0
-
-        dual_solution = None
-        for _ in range(5):
-            dual_solution = linprog(
-                c=-np.array(demand_lst) * excp_factor * dual_factor,
-                A_ub=A_ub.T,
-                b_ub=cost,
-                method="interior-point",
-            )
-            if dual_solution.status != 4:
+    def _solve_presolved(
+        self, key: Tuple[bool, bool, bool], demand_lst, stage_idx, timer
+    ):
+        """
+        Solves the reduced problem returned by _presolve and maps the solution
+        back to the full size, see _get_plan_no_prioties.
+        """
+        with timer.phase("presolve"):
+            cost = self._lp_templates[key].cost
+            n_stages = len(self.cost_lst)
+            is_col_alive = np.ones(len(cost), dtype=bool)
+            if stage_idx is not None:
+                is_col_alive[:n_stages] = False
+                is_col_alive[stage_idx] = True
+            demand = np.asarray(demand_lst, dtype=float)
+            rows, cols = self._presolve(key, demand, is_col_alive)
+            if rows is not None:
+                # The reduced problem is small enough to be solved from dense matrices.
+                A = self._get_production(key[0])[0][np.ix_(rows, cols)]
+                reduced = LPTemplate(-A, A.T, cost[cols])
+        if rows is None:
+            # Can't be reduced safely, solve the problem as a whole.
+            with timer.phase("mask"):
+                template = self._get_template(key, stage_idx)
+            return self._solve_template(template, demand_lst, timer)
+
+        x_reduced, y_reduced, status = self._solve_template(
+            reduced, demand[rows], timer
+        )
+        if status != 0:
+            return None, None, status
+        x = np.zeros(len(cost))
+        x[cols] = x_reduced
+        y = np.zeros(len(demand))
+        y[rows] = y_reduced
+        if stage_idx is not None:
+            x = np.hstack([x[stage_idx], x[n_stages:]])
+        return x, y, status
+
+    def _presolve(self, key: Tuple[bool, bool, bool], demand, is_col_alive):
+        """
+        Finds the part of a problem that can contribute to the demand. Starting
+        from the demanded items, keeps the stages and rules producing a kept item
+        and the items consumed by the kept rules, until nothing changes. Stages
+        strictly dominated by another kept stage (as cheap or cheaper, dropping
+        at least as much of every kept item) are then dropped.
+        Solving the reduced problem gives the same cost as the full one, as long
+        as no stage or rule has a negative cost (the full problem would then
+        be unbounded).
+        Args:
+            key: (outcome, gold_demand, exp_demand).
+            demand: array of the demand of every item.
+            is_col_alive: boolean array of the stages and rules allowed in the plan.
+        Returns:
+            rows: array of the indices of the kept items.
+            cols: array of the indices of the kept stages and rules.
+            Both are None if the problem can't be reduced.
+        """
+        cost = self._lp_templates[key].cost
+        if np.any(cost[is_col_alive] < 0):
+            return None, None
+        A, produces, consumes = self._get_production(key[0])
+
+        is_row_kept = demand > 0
+        while True:
+            is_col_kept = is_col_alive & produces[is_row_kept].any(axis=0)
+            is_row_next = is_row_kept | consumes[:, is_col_kept].any(axis=1)
+            if (is_row_next == is_row_kept).all():
                 break
+            is_row_kept = is_row_next
+        rows = np.flatnonzero(is_row_kept)
+
+        stages = np.flatnonzero(is_col_kept[: len(self.cost_lst)])
+        drops = A[np.ix_(rows, stages)].T
+        stage_cost = cost[stages]
+        as_good = (drops[:, None, :] >= drops[None, :, :]).all(axis=2) & (
+            stage_cost[:, None] <= stage_cost[None, :]
+        )
+        better = (drops[:, None, :] > drops[None, :, :]).any(axis=2) | (
+            stage_cost[:, None] < stage_cost[None, :]
+        )
+        # dominated[j]: a stage is as good as j on everything and better on something.
+        dominated = (as_good & better).any(axis=0)
+        is_col_kept[stages[dominated]] = False
+        return rows, np.flatnonzero(is_col_kept)
+
+    def _integral_plan(self, plan_input: PlanInput, x, timer):
+        """
+        Turns the solution of a plan's linear program into whole stage clears and
+        crafts whose expected drops still cover the demand, with round_plan. If
+        plan_input.budget is set and the problem left by _presolve is small
+        enough, a MILP time-boxed to the budget then looks for a cheaper plan,
+        kept only if it doesn't cost more sanity either.
+        Args:
+            plan_input: PlanInput. The request the problem was built from.
+            x: the solution of the problem, as returned by _get_plan_no_prioties.
+            timer: PhaseTimer. Records the MILP solve.
+        Returns:
+            x: array of the same shape as x holding whole numbers.
+        Raises:
+            ValueError: if the plan couldn't be rounded.
+        """
+        key = plan_input.flags
+        A_full = self._get_production(key[0])[0]
+        cost = self._lp_templates[key].cost
+        n_stages = len(self.cost_lst)
+        demand = np.asarray(plan_input.demand_lst, dtype=float)
+        is_col_alive = np.ones(len(cost), dtype=bool)
+        if plan_input.stage_idx is not None:
+            is_col_alive[:n_stages] = False
+            is_col_alive[plan_input.stage_idx] = True
+        alive = np.flatnonzero(is_col_alive)
+        A = A_full[:, alive]
+        x_int = round_plan(A, cost[alive], demand, x)
+        if not plan_input.budget or milp is None:
+            return x_int
+
+        rows, cols = self._presolve(key, demand, is_col_alive)
+        if rows is None or len(cols) > MILP_MAX_COLUMNS:
+            return x_int
+        # Bounding the objective by the rounded plan's cost prunes most of the
+        # search, scipy's milp can't be given a starting solution.
+        bound = np.dot(cost[alive], x_int)
+        solution = milp(
+            cost[cols],
+            integrality=np.ones(len(cols)),
+            bounds=Bounds(0, np.inf),
+            constraints=[
+                LinearConstraint(A_full[np.ix_(rows, cols)], demand[rows], np.inf),
+                LinearConstraint(cost[cols][None], -np.inf, bound),
+            ],
+            options={"time_limit": plan_input.budget},
+        )
+        _record_solve(timer, "integral", "milp", solution.status)
+        if solution.x is None:
+            return x_int
+        x_full = np.zeros(len(cost))
+        x_full[cols] = np.round(solution.x)
+        x_milp = x_full[alive]
+        # The MILP tolerances are looser than round_plan's, keep its plan only if
+        # it covers the demand as well. Its objective also values the LMD and
+        # the exp dropped, which may trade a lower objective for more sanity.
+        sanity = np.hstack([self.cost_lst, np.zeros(len(cost) - n_stages)])[alive]
+        if (
+            np.all(A @ x_milp - demand >= -ROUND_TOL)
+            and np.dot(cost[alive], x_milp) < bound
+            and np.dot(sanity, x_milp) <= np.dot(sanity, x_int)
+        ):
+            return x_milp
+        return x_int
+
+    def _get_production(self, outcome: bool):
+        """
+        Returns the dense production matrix used by _presolve, built on first use.
+        Args:
+            outcome: bool. Whether byproducts are considered.
+        Returns:
+            A: array of shape [n_items, n_stages + n_rules]. Items produced per
+                stage clear and per crafting, negative for consumed items.
+            produces: boolean array of the same shape, where A is positive.
+            consumes: boolean array of the same shape, where A is negative.
+        """
+        try:
+            return self._productions[outcome]
+        except KeyError:
+            pass
+        A = -self._lp_templates[outcome, True, True].A_ub.toarray()
+        self._productions[outcome] = (A, A > 0, A < 0)
+        return self._productions[outcome]
+
+    def _get_template(self, key: Tuple[bool, bool, bool], stage_idx=None) -> LPTemplate:
+        """
+        Returns the linear program of a flag combination restricted to some stages.
+        Args:
+            key: (outcome, gold_demand, exp_demand).
+            stage_idx: array of the indices of the stages allowed in the plan.
+                All stages are considered if None.
+        """
+        return self._slice_template(self._get_scaled_template(key), stage_idx)
 
-            dual_factor /= 10.0
+    def _slice_template(self, template: LPTemplate, stage_idx=None) -> LPTemplate:
+        """
+        Restricts a linear program to some stages.
+        Args:
+            stage_idx: array of the indices of the stages allowed in the plan.
+                All stages are considered if None.
+        """
+        if stage_idx is None:
+            return template
+        A_ub, A_dual, cost, row_scale, col_scale = template
+        n_stages = len(cost) - len(self.convertion_cost_lst)
+        cols = np.hstack([stage_idx, np.arange(n_stages, len(cost))])
+        return LPTemplate(
+            A_ub[:, cols],
+            A_dual[cols],
+            cost[cols],
+            row_scale,
+            None if col_scale is None else col_scale[cols],
+        )
 
-        return solution, dual_solution, excp_factor
+    def _get_scaled_template(self, key: Tuple[bool, bool, bool]) -> LPTemplate:
+        """
+        Returns the linear program of a flag combination scaled by scale_lp,
+        computed on first use. The matrices are shared by the combinations with
+        the same outcome.
+        Args:
+            key: (outcome, gold_demand, exp_demand).
+        """
+        try:
+            return self._scaled_templates[key]
+        except KeyError:
+            pass
+        template = self._lp_templates[key]
+        scaled = next(
+            (t for k, t in self._scaled_templates.items() if k[0] == key[0]), None
+        )
+        if scaled is None:
+            scaled = scale_lp(template)
+        self._scaled_templates[key] = scaled._replace(
+            cost=template.cost * scaled.col_scale
+        )
+        return self._scaled_templates[key]
+
+    def _get_warm_solver(self, key: Tuple[bool, bool, bool]) -> WarmSolver:
+        """
+        Returns the WarmSolver of a flag combination, creating it on first use.
+        Args:
+            key: (outcome, gold_demand, exp_demand).
+        """
+        warm_solvers = self._warm_solvers
+        try:
+            return warm_solvers[key]
+        except KeyError:
+            pass
+        with self._warm_solvers_lock:
+            if key not in warm_solvers:
+                template = self._lp_templates[key]
+                n_stages = len(template.cost) - len(self.convertion_cost_lst)
+                warm_solvers[key] = WarmSolver(template.A_ub, template.cost, n_stages)
+            return warm_solvers[key]
 
     def convert_requirements(
-        self, requirement_dct: Union[None, Dict[str, int]]
+        self, requirement_dct: Union[None, Dict[str, int]], fuzzy=False
     ) -> Tuple[Dict[int, int], str]:
         """
         Converts a requirement dict with variable keys into a dict mapping an
@@ -352,35 +1668,89 @@ class MaterialPlanning(object):
             requirement_dct: a Dict[str, int] where the item keys are one of the
                 follow types: English name, Chinese name, Japanese name, Korean name,
                 or item ID.
+            fuzzy: bool. Also match names regardless of case and whitespace, and
+                unambiguous prefixes of names.
         Returns:
             requirements: a Dict[int, int]
-            lang: the language successfully parsed language or "id"
+            lang: the language shared by all the keys (the first one in
+                gamedata_langs order if there are several) or "id". The language
+                of the first key if they don't share any.
         Raises:
-            A BaseException initialized with all the KeyErrors that occured during
-            execution if the function was unable to parse the input dict.
+            UnknownItemError: if some keys don't match any item of the model,
+                with suggestions for each of them.
         """
         if requirement_dct is None:
             return {}, ""
-        err_lst: List[BaseException] = []
-        # Try parsing as IDs
-        try:
-            ret = {}
-            for k, v in requirement_dct.items():
-                ret[int(k)] = int(v)
-            return ret, "id"
-        except (ValueError, KeyError) as err:
-            err_lst.append(err)
-        # Try parsing as each lang
-        for lang, nameMap in self.itemdata_rv.items():
-            ret = {}
+        requirements = {}
+        unknown = []
+        langs = first_langs = None
+        for k, v in requirement_dct.items():
+            entry = self._lookup_item(k, fuzzy)
+            if entry is None:
+                unknown.append(k)
+                continue
+            idx, key_langs = entry
+            requirements[int(self.item_id_array[idx])] = int(v)
+            if langs is None:
+                langs = first_langs = key_langs
+            else:
+                langs = tuple(lang for lang in langs if lang in key_langs)
+        if unknown:
+            raise UnknownItemError(unknown, {k: self.suggest_items(k) for k in unknown})
+        if first_langs is None:
+            # Nothing was requested, the same as an empty dict of IDs.
+            return requirements, "id"
+        return requirements, (langs or first_langs)[0]
+
+    def _lookup_item(self, key, fuzzy=False):
+        """
+        Finds the item a requirement key refers to.
+        Returns:
+            entry: (item index, languages the key is a name in), or None.
+        """
+        entry = self.name_index.get(key)
+        if entry is None:
             try:
-                for k, v in requirement_dct.items():
-                    ret[nameMap[k]] = int(v)
-                return ret, lang
-            except (ValueError, KeyError) as err:
-                err_lst.append(err)
-        # TODO: create custom exception class
-        raise BaseException(err_lst)
+                # IDs written differently, e.g. with leading zeros.
+                entry = self.name_index.get(str(int(key)))
+            except ValueError:
+                pass
+        if entry is None and fuzzy:
+            normalized = normalize_name(key)
+            entry = self.normalized_index.get(normalized)
+            if entry is None and normalized:
+                names = self._names_with_prefix(normalized)
+                if len({self.normalized_index[name][0] for name in names}) == 1:
+                    entry = self.normalized_index[names[0]]
+            if entry is not None:
+                entry = entry[:2]
+        return entry
+
+    def suggest_items(self, key, n=5) -> List[str]:
+        """
+        Lists item names close to a key that didn't match any item.
+        Args:
+            key: string. The unknown key.
+            n: int. Maximum number of suggestions.
+        Returns:
+            names: list of item names, starting with the key or similar to it.
+        """
+        normalized = normalize_name(key)
+        names = self._names_with_prefix(normalized)[:n] if normalized else []
+        if not names:
+            names = difflib.get_close_matches(normalized, self.normalized_names, n)
+        return [self.normalized_index[name][2] for name in names]
+
+    def _names_with_prefix(self, prefix) -> List[str]:
+        """
+        Returns:
+            names: the normalized names starting with prefix, in sorted order.
+        """
+        names = self.normalized_names
+        i = j = bisect.bisect_left(names, prefix)
+        while j < len(names) and names[j].startswith(prefix):
+            j += 1
+        return names[i:j]
 
     def get_plan(
         self,
@@ -393,163 +1763,718 @@ class MaterialPlanning(object):
         language=None,
         exclude=None,
         non_cn_compat=False,
+        fuzzy=False,
+        presolve=False,
+        integral=False,
+        budget=0.0,
+        debug=False,
     ):
         """
         User API. Computing the material plan given requirements and owned items.
         Args:
                 requirement_dct: dictionary. Contain only required items with their numbers.
                 deposit_dct: dictionary. Contain only owned items with their numbers.
+                fuzzy: bool. Match item names loosely, see convert_requirements.
+                presolve: bool. Only solve the stages and rules that can contribute
+                    to the requirements. Faster for small requirements, the values
+                    are then only given for the items involved.
+                integral: bool. Plan whole stage clears and crafts whose expected
+                    drops still cover the requirements, see _integral_plan.
+                budget: float. Seconds an integral plan may spend looking for a
+                    cheaper solution than the rounded one with a MILP. Only the
+                    rounding is done if 0.
+                debug: bool. Add the time spent in each phase, in milliseconds,
+                    to the plan under "timings" and the solver calls, with their
+                    method and status, under "solver_path".
         """
-        status_dct = {
-            0: "Optimization terminated successfully. ",
-            1: "Iteration limit reached. ",
-            2: "Problem appears to be infeasible. ",
-            3: "Problem appears to be unbounded. ",
-            4: "Numerical difficulties encountered.",
-        }
         stt = time.time()
-        requirement_dct, requirement_lang = self.convert_requirements(requirement_dct)
-        if language is None:
-            language = requirement_lang
-        deposited_dct, _ = self.convert_requirements(None)
+        timer = PhaseTimer()
+        plan_input = self._prepare_plan(
+            requirement_dct,
+            deposited_dct,
+            outcome,
+            gold_demand,
+            exp_demand,
+            language,
+            exclude,
+            non_cn_compat,
+            fuzzy,
+            presolve,
+            integral,
+            budget,
+            timer,
+        )
+        with timer.phase("cache"):
+            res, source = self._cached_plan(plan_input)
+        if res is not None:
+            metrics.inc("arkplanner_plans_total", cache=source)
+            timer.record()
+            if print_output:
+                print("Loaded from cache in %.4f seconds," % (time.time() - stt))
+                _print_plan(res)
+            res = copy.deepcopy(res)
+            if debug:
+                res["timings"] = timer.milliseconds()
+                res["solver_path"] = timer.solves
+            return res
+
+        metrics.inc("arkplanner_plans_total", cache="miss")
+        x, y, status = self._get_plan_no_prioties(
+            plan_input.demand_lst,
+            *plan_input.flags,
+            plan_input.stage_idx,
+            presolve=plan_input.presolve,
+            timer=timer,
+        )
+        if plan_input.integral and status == 0:
+            with timer.phase("integral"):
+                x = self._integral_plan(plan_input, x, timer)
+        with timer.phase("render"):
+            res = self._render_plan(plan_input, x, y, status)
+        timer.record()
 
-        demand_lst = [0 for x in range(len(self.item_array))]
-        for k, v in requirement_dct.items():
-            demand_lst[self.item_id_rv[k]] = v
-        for k, v in deposited_dct.items():
-            demand_lst[self.item_dct_rv[k]] -= v
+        if print_output:
+            print(
+                status_dct[status]
+                + (" Computed in %.4f seconds," % (time.time() - stt))
+            )
+            _print_plan(res)
 
-        if exclude is None:
-            exclude = set()
-        else:
-            exclude = set(exclude)
+        self._cache_plan(plan_input, res)
+        if debug:
+            res["timings"] = timer.milliseconds()
+            res["solver_path"] = timer.solves
+        return res
 
-        is_stage_alive = []
-        for stage in self.stage_array:
-            if stage in exclude:
-                is_stage_alive.append(False)
+    def get_plans(
+        self, batch, print_output=False
+    ) -> List[Union[Dict[str, Any], Exception]]:
+        """
+        User API. Computing many material plans at once. Requests are grouped by
+        flags and excluded stages, each group is solved on the same linear program
+        (and the same warm HiGHS instance) and identical requests are solved once.
+        Args:
+            batch: list of dictionaries of get_plan keyword arguments,
+                print_output excluded.
+            print_output: bool. Print every computed plan.
+        Returns:
+            plans: a list in the order of batch holding, for each request, the plan
+                get_plan would have returned or the exception it would have raised.
+        """
+        plans: List[Any] = [None] * len(batch)
+        # (flags, stage_idx) -> cache_key -> (plan_input, positions in batch)
+        groups: Dict[Any, Dict[str, Tuple[PlanInput, List[int]]]] = {}
+        timer = PhaseTimer()
+        for i, request in enumerate(batch):
+            try:
+                plan_input = self._prepare_plan(timer=timer, **request)
+            except (TypeError, ValueError) as err:
+                plans[i] = err
+                continue
+            with timer.phase("cache"):
+                res, source = self._cached_plan(plan_input)
+            if res is not None:
+                metrics.inc("arkplanner_plans_total", cache=source)
+                plans[i] = copy.deepcopy(res)
                 continue
-            if non_cn_compat:
+            metrics.inc("arkplanner_plans_total", cache="miss")
+            stage_key = None
+            if plan_input.stage_idx is not None:
+                stage_key = plan_input.stage_idx.tobytes()
+            group = groups.setdefault(
+                (plan_input.flags, stage_key, plan_input.presolve), {}
+            )
+            group.setdefault(plan_input.cache_key, (plan_input, []))[1].append(i)
+
+        for group in groups.values():
+            template = None
+            for plan_input, positions in group.values():
+                if template is None and not (
+                    self.solver == "highs-warm" or plan_input.presolve
+                ):
+                    with timer.phase("mask"):
+                        template = self._get_template(
+                            plan_input.flags, plan_input.stage_idx
+                        )
+                try:
+                    x, y, status = self._get_plan_no_prioties(
+                        plan_input.demand_lst,
+                        *plan_input.flags,
+                        plan_input.stage_idx,
+                        template,
+                        plan_input.presolve,
+                        timer,
+                    )
+                    if plan_input.integral and status == 0:
+                        with timer.phase("integral"):
+                            x = self._integral_plan(plan_input, x, timer)
+                    with timer.phase("render"):
+                        res = self._render_plan(plan_input, x, y, status)
+                except ValueError as err:
+                    for i in positions:
+                        plans[i] = err
+                    continue
+                if print_output:
+                    _print_plan(res)
+                self._cache_plan(plan_input, res)
+                plans[positions[0]] = res
+                for i in positions[1:]:
+                    plans[i] = copy.deepcopy(res)
+        # The phases of a batch are recorded once, summed over its plans.
+        timer.record()
+        return plans
+
+    def _cached_plan(self, plan_input: PlanInput) -> Tuple[Optional[Any], str]:
+        """
+        Looks a plan up in the plan cache, then in the plan store.
+        Returns:
+            plan: the cached plan, not to be modified, or None on a miss.
+            source: string. "hit", "store" or "miss", the cache label of
+                arkplanner_plans_total.
+        """
+        res = self.plan_cache.get(plan_input.cache_key)
+        if res is not None:
+            return res, "hit"
+        if self.plan_store is not None:
+            res = self.plan_store.get(plan_input.request_key, self.data_version())
+            if res is not None:
+                self.plan_cache.put(plan_input.cache_key, res, plan_input.stage_idx)
+                return res, "store"
+        return None, "miss"
+
+    def _cache_plan(self, plan_input: PlanInput, res: Dict[str, Any]):
+        """
+        Stores a computed plan in the plan cache and the plan store.
+        """
+        self.plan_cache.put(
+            plan_input.cache_key, copy.deepcopy(res), plan_input.stage_idx
+        )
+        if self.plan_store is not None:
+            self.plan_store.put(plan_input.request_key, self.data_version(), res)
+
+    def data_version(self) -> str:
+        """
+        Hashes everything the plans depend on: the matrices, the costs, the
+        rules, the item names and the filters, but not the validators of the data.
+        Models loaded from the same data, or patched into it, share a version.
+        Returns:
+            version: a hex digest, the version of the plans in the plan store.
+        """
+        if self._data_version is None:
+            arrays, meta = self._snapshot_arrays()
+            del meta["validators"]
+            digest = hashlib.sha1()
+            digest.update(
+                json.dumps(
+                    [PLAN_FORMAT_VERSION, meta], sort_keys=True, ensure_ascii=False
+                ).encode()
+            )
+            for name in sorted(arrays):
+                digest.update(name.encode())
+                digest.update(str(arrays[name].dtype).encode())
+                digest.update(np.ascontiguousarray(arrays[name]).tobytes())
+            self._data_version = digest.hexdigest()
+        return self._data_version
+
+    def item_values(
+        self,
+        outcome=False,
+        gold_demand=True,
+        exp_demand=True,
+        non_cn_compat=False,
+        language=None,
+    ) -> Dict[str, Any]:
+        """
+        User API. The value in sanity of every material, as given in the "values"
+        section of a plan demanding every material that can be obtained. Solved
+        once per flag combination and model, see precompute_item_values.
+        Args:
+            language: string. Language of the item names, defaults to DEFAULT_LANG.
+            See get_plan for the other arguments.
+        Returns:
+            values: dictionary holding "lang" and "values", in the format of get_plan.
+        Raises:
+            ValueError: if the problem has no solution.
+        """
+        key = (bool(outcome), bool(gold_demand), bool(exp_demand), bool(non_cn_compat))
+        y = self._item_values.get(key)
+        if y is None:
+            y = self._item_values[key] = self._solve_item_values(*key)
+        language = language or DEFAULT_LANG
+        names = self.item_names.get(language, self.item_names["zh_CN"])
+        return {"lang": language, "values": self._render_values(y, names)}
+
+    def has_item_values(
+        self, outcome=False, gold_demand=True, exp_demand=True, non_cn_compat=False
+    ) -> bool:
+        """
+        Whether item_values answers the flags without solving, see item_values
+        for the arguments.
+        """
+        key = (bool(outcome), bool(gold_demand), bool(exp_demand), bool(non_cn_compat))
+        return key in self._item_values
+
+    def precompute_item_values(self):
+        """
+        Solves the item values of every flag combination, so that item_values
+        answers without solving. Combinations without a solution are skipped,
+        item_values raises their error.
+        """
+        for key in itertools.product((False, True), repeat=4):
+            if key not in self._item_values:
                 try:
-                    if int(stage.lstrip("S")[0]) > NON_CN_WORLD_NUM:
-                        is_stage_alive.append(False)
-                        continue
+                    self._item_values[key] = self._solve_item_values(*key)
                 except ValueError:
                     pass
-            is_stage_alive.append(True)
-
-        if exclude or non_cn_compat:
-            BackTrace = [
-                copy.copy(self.stage_array),
-                copy.copy(self.cost_lst),
-                copy.copy(self.probs_matrix),
-                copy.copy(self.cost_exp_offset),
-                copy.copy(self.cost_gold_offset),
-            ]
-            self.stage_array = self.stage_array[is_stage_alive]
-            self.cost_lst = self.cost_lst[is_stage_alive]
-            self.probs_matrix = self.probs_matrix[is_stage_alive]
-            self.cost_exp_offset = self.cost_exp_offset[is_stage_alive]
-            self.cost_gold_offset = self.cost_gold_offset[is_stage_alive]
 
-        solution, dual_solution, excp_factor = self._get_plan_no_prioties(
-            demand_lst, outcome, gold_demand, exp_demand
+    def _solve_item_values(self, outcome, gold_demand, exp_demand, non_cn_compat):
+        """
+        Returns:
+            y: array of the value of each item, the dual solution of the problem
+                demanding one of every material that the allowed stages and the
+                rules can produce.
+        """
+        stage_idx = self._stage_idx(set(), non_cn_compat)
+        _, produces, consumes = self._get_production(outcome)
+        n_stages = len(self.cost_lst)
+        is_col_alive = np.ones(produces.shape[1], dtype=bool)
+        if stage_idx is not None:
+            is_col_alive[:n_stages] = False
+            is_col_alive[stage_idx] = True
+        # Starting from the drops, adds the products of the rules whose
+        # materials can all be obtained, until nothing changes.
+        is_obtainable = np.zeros(produces.shape[0], dtype=bool)
+        while True:
+            is_col_usable = is_col_alive & ~consumes[~is_obtainable].any(axis=0)
+            is_next = produces[:, is_col_usable].any(axis=1)
+            if (is_next == is_obtainable).all():
+                break
+            is_obtainable = is_next
+        demand_lst = (self.is_material & is_obtainable).astype(float)
+        timer = PhaseTimer()
+        _, y, status = self._get_plan_no_prioties(
+            demand_lst, outcome, gold_demand, exp_demand, stage_idx, timer=timer
+        )
+        timer.record()
+        if status != 0:
+            raise ValueError(status_dct[status])
+        return y
+
+    def sweep(
+        self,
+        requirement_dct,
+        parameter,
+        values,
+        deposited_dct=None,
+        outcome=False,
+        gold_demand=True,
+        exp_demand=True,
+        language=None,
+        exclude=None,
+        non_cn_compat=False,
+        fuzzy=False,
+    ) -> List[Union[Dict[str, Any], Exception]]:
+        """
+        User API. Computing the plans of one demand for a sequence of values of a
+        parameter. The points are solved in order on a single HiGHS instance, each
+        one starting from the basis of the previous one, or with linprog if
+        highspy isn't installed.
+        Args:
+            parameter: string. One of SWEEP_PARAMETERS.
+                "exclude": each value is a stage code or a list of stage codes,
+                    toggled with respect to exclude.
+                "outcome_rate": each value replaces EXTRA_OUTCOME_RATE, the chance
+                    of a crafting byproduct. outcome is ignored.
+                "exp_unit": each value replaces EXP_UNIT, the AP worth of 200 exp.
+                    Requires exp_demand.
+                "gold_unit": each value replaces GOLD_UNIT, the AP worth of 1 LMD.
+                    Requires gold_demand.
+            values: list of the values of the parameter.
+            See get_plan for the other arguments, they apply to every point.
+        Returns:
+            plans: a list in the order of values holding, for each value, the plan
+                or the ValueError raised if no solution was found.
+        Raises:
+            ValueError: if the parameter or its values are invalid, or if some
+                requirement keys don't match any item (UnknownItemError).
+        """
+        values = _check_sweep(parameter, values, gold_demand, exp_demand)
+        timer = PhaseTimer()
+        if parameter == "outcome_rate":
+            outcome = True
+        plan_input = self._prepare_plan(
+            requirement_dct,
+            deposited_dct,
+            outcome,
+            gold_demand,
+            exp_demand,
+            language,
+            exclude,
+            non_cn_compat,
+            fuzzy,
+            timer=timer,
         )
-        x, status = solution.x / excp_factor, solution.status
-        y = dual_solution.x
+        # Byproducts are added to the matrix without any at the swept rate.
+        key = (outcome and parameter != "outcome_rate",) + plan_input.flags[1:]
+        template = self._lp_templates[key]
+        n_stages = len(self.cost_lst)
+        extra_outcomes = (self.convertion_outc_matrix - self.convertion_matrix).tocoo()
+        no_outcomes = np.asarray(
+            self.convertion_matrix[extra_outcomes.row, extra_outcomes.col]
+        ).ravel()
+
+        warm_solver = None
+        if highspy is not None:
+            warm_solver = WarmSolver(template.A_ub, template.cost, n_stages)
+        plans: List[Any] = []
+        for value in values:
+            point_input, cost, rate = plan_input, None, None
+            if parameter == "exclude":
+                stage_idx = self._stage_idx(
+                    set(exclude or []) ^ set(value), non_cn_compat
+                )
+                point_input = plan_input._replace(stage_idx=stage_idx)
+            elif parameter == "outcome_rate":
+                rate = value / EXTRA_OUTCOME_RATE
+            else:
+                cost = self._lp_cost(
+                    plan_input.flags[1], plan_input.flags[2], **{parameter: value}
+                )
+
+            status = None
+            if warm_solver is not None:
+                if cost is not None:
+                    warm_solver.set_cost(cost)
+                if rate is not None:
+                    warm_solver.set_coefficients(
+                        extra_outcomes.col,
+                        n_stages + extra_outcomes.row,
+                        no_outcomes + rate * extra_outcomes.data,
+                    )
+                with timer.phase("primal"):
+                    x, y, status = warm_solver.solve(
+                        point_input.demand_lst, point_input.stage_idx
+                    )
+                _record_solve(timer, "primal", "highs-warm", status)
+            if status is None or status in FALLBACK_STATUSES:
+                point_template = template
+                if cost is not None:
+                    point_template = point_template._replace(cost=cost)
+                if rate is not None:
+                    A_ub, A_dual = self._production(
+                        self.convertion_matrix + rate * extra_outcomes.tocsr()
+                    )
+                    point_template = point_template._replace(A_ub=A_ub, A_dual=A_dual)
+                x, y, status = self._solve_template(
+                    self._slice_template(point_template, point_input.stage_idx),
+                    point_input.demand_lst,
+                    timer,
+                )
+            try:
+                with timer.phase("render"):
+                    plans.append(self._render_plan(point_input, x, y, status))
+            except ValueError as err:
+                plans.append(err)
+        timer.record()
+        return plans
+
+    def pareto(
+        self,
+        requirement_dct,
+        resource,
+        points=PARETO_POINTS_DEFAULT,
+        deposited_dct=None,
+        outcome=False,
+        language=None,
+        exclude=None,
+        non_cn_compat=False,
+        fuzzy=False,
+    ) -> List[Dict[str, Any]]:
+        """
+        User API. Computing plans trading sanity off against the LMD or the exp
+        they yield. The frontier goes from the cheapest plan, ignoring the resource,
+        to the plan get_plan returns when the resource is demanded. Every point is
+        the cheapest plan yielding at least an amount of the resource evenly spaced
+        between theirs. The points are solved on a single HiGHS instance with the
+        yield as an extra row, each one starting from the basis of the previous
+        one, or with linprog if highspy isn't installed.
+        Args:
+            resource: string. One of PARETO_RESOURCES. The LMD yield is the LMD
+                dropped minus the LMD spent crafting.
+            points: int. Number of plans on the frontier, between 2 and
+                PARETO_POINTS_MAX.
+            See get_plan for the other arguments.
+        Returns:
+            plans: a list of plans ordered by increasing cost and yield.
+        Raises:
+            ValueError: if the resource or the number of points is invalid, if
+                some requirement keys don't match any item (UnknownItemError) or
+                if no solution was found.
+        """
+        if resource not in PARETO_RESOURCES:
+            raise ValueError(
+                "Unknown resource {}, expected one of {}".format(
+                    resource, PARETO_RESOURCES
+                )
+            )
+        if not 2 <= points <= PARETO_POINTS_MAX:
+            raise ValueError(
+                "points must be between 2 and {}, got {}".format(
+                    PARETO_POINTS_MAX, points
+                )
+            )
+        timer = PhaseTimer()
+        plan_input = self._prepare_plan(
+            requirement_dct,
+            deposited_dct,
+            outcome,
+            False,
+            False,
+            language,
+            exclude,
+            non_cn_compat,
+            fuzzy,
+            timer=timer,
+        )
+        demand_lst, stage_idx = plan_input.demand_lst, plan_input.stage_idx
+        yields = self._resource_yield(resource)
+        col_yields = yields
+        n_stages = len(self.cost_lst)
+        if stage_idx is not None:
+            col_yields = np.hstack([yields[stage_idx], yields[n_stages:]])
+
+        # The two ends of the frontier.
+        ends = []
+        for flags in (
+            plan_input.flags,
+            (plan_input.flags[0], resource == "gold", resource == "exp"),
+        ):
+            x, _, status = self._get_plan_no_prioties(
+                demand_lst, *flags, stage_idx, timer=timer
+            )
+            if status != 0:
+                raise ValueError(status_dct[status])
+            ends.append(np.dot(col_yields, x))
+        targets = np.linspace(ends[0], max(ends), points)
+
+        # The yield is demanded like an extra item.
+        template = self._lp_templates[plan_input.flags]
+        template = LPTemplate(
+            sparse.vstack([template.A_ub, -yields[None]], format="csc"),
+            sparse.hstack([template.A_dual, yields[:, None]], format="csr"),
+            template.cost,
+        )
+        warm_solver, scaled = None, None
+        if highspy is not None:
+            warm_solver = WarmSolver(template.A_ub, template.cost, n_stages)
+        plans = []
+        for target in targets:
+            point_demand = list(demand_lst) + [target]
+            status = None
+            if warm_solver is not None:
+                with timer.phase("primal"):
+                    x, y, status = warm_solver.solve(point_demand, stage_idx)
+                _record_solve(timer, "primal", "highs-warm", status)
+            if status is None or status in FALLBACK_STATUSES:
+                if scaled is None:
+                    scaled = self._slice_template(scale_lp(template), stage_idx)
+                x, y, status = self._solve_template(scaled, point_demand, timer)
+            with timer.phase("render"):
+                plans.append(
+                    self._render_plan(
+                        plan_input, x, None if y is None else y[:-1], status
+                    )
+                )
+        timer.record()
+        return plans
+
+    def _resource_yield(self, resource):
+        """
+        Returns:
+            yields: array of shape [n_stages + n_rules]. Amount of the resource
+                yielded per stage clear and per crafting, as reported in plans.
+        """
+        if resource == "gold":
+            yields = np.hstack([self.cost_gold_offset, self.convertion_cost_lst])
+            return -yields / GOLD_UNIT
+        n_rules = len(self.convertion_cost_lst)
+        return np.hstack([-self.cost_exp_offset * 7400 / 30.0, np.zeros(n_rules)])
+
+    def _prepare_plan(
+        self,
+        requirement_dct,
+        deposited_dct=None,
+        outcome=False,
+        gold_demand=True,
+        exp_demand=True,
+        language=None,
+        exclude=None,
+        non_cn_compat=False,
+        fuzzy=False,
+        presolve=False,
+        integral=False,
+        budget=0.0,
+        timer=None,
+    ) -> PlanInput:
+        """
+        Converts the arguments of get_plan to the inputs of the linear program.
+        Args:
+            timer: PhaseTimer or None. Accumulates the time spent converting the
+                requirements, hashing the cache key and masking the stages.
+        Raises:
+            ValueError: if budget is negative, or if some requirement or deposit
+                keys don't match any item (UnknownItemError).
+        """
+        if budget < 0:
+            raise ValueError("budget must be positive, got {}".format(budget))
+        timer = timer or PhaseTimer()
+        with timer.phase("convert"):
+            requirement_dct, requirement_lang = self.convert_requirements(
+                requirement_dct, fuzzy
+            )
+            deposited_dct, _ = self.convert_requirements(deposited_dct, fuzzy)
+            if language is None:
+                language = requirement_lang
+
+            demand_lst = [0 for x in range(len(self.item_array))]
+            for k, v in requirement_dct.items():
+                demand_lst[self.item_id_rv[k]] = v
+            for k, v in deposited_dct.items():
+                # A negative demand is a surplus the plan may craft with.
+                demand_lst[self.item_id_rv[k]] -= v
+
+        if exclude is None:
+            exclude = set()
+        else:
+            exclude = set(exclude)
+
+        with timer.phase("cache"):
+            request_key = plan_key(
+                solver=self.solver,
+                demand=[
+                    [self.item_id_array[i], v]
+                    for i, v in enumerate(demand_lst)
+                    if v != 0
+                ],
+                outcome=bool(outcome),
+                gold_demand=bool(gold_demand),
+                exp_demand=bool(exp_demand),
+                language=language,
+                exclude=sorted(exclude),
+                non_cn_compat=bool(non_cn_compat),
+                presolve=bool(presolve),
+                integral=bool(integral),
+                # The MILP may find better plans with more time.
+                budget=float(budget) if integral else 0.0,
+            )
+            cache_key = plan_key(generation=self.data_generation, request=request_key)
+
+        with timer.phase("mask"):
+            stage_idx = self._stage_idx(exclude, non_cn_compat)
+
+        return PlanInput(
+            demand_lst,
+            (bool(outcome), bool(gold_demand), bool(exp_demand)),
+            stage_idx,
+            language,
+            cache_key,
+            request_key,
+            bool(presolve),
+            bool(integral),
+            float(budget),
+        )
+
+    def _stage_idx(self, exclude, non_cn_compat=False):
+        """
+        Returns:
+            stage_idx: array of the indices of the stages allowed in a plan,
+                None if they all are.
+        """
+        # Excluded stages are only masked out of each request's LP, the shared
+        # matrices are never modified so concurrent plans don't interfere.
+        is_stage_alive = ~np.isin(self.stage_array, list(exclude))
+        if non_cn_compat:
+            is_stage_alive &= self.non_cn_stage_mask
+        return None if is_stage_alive.all() else np.flatnonzero(is_stage_alive)
+
+    def _render_plan(self, plan_input: PlanInput, x, y, status) -> Dict[str, Any]:
+        """
+        Formats the solution of a plan's linear program.
+        Args:
+            plan_input: PlanInput. The request the problem was built from.
+            x, y, status: the output of _get_plan_no_prioties.
+        Returns:
+            plan: dictionary. The plan returned by get_plan.
+        Raises:
+            ValueError: if no solution was found.
+        """
+        if status != 0:
+            raise ValueError(status_dct[status])
+        stage_idx, language = plan_input.stage_idx, plan_input.language
+        if stage_idx is not None:
+            # Scatter the clear times back to the full list of stages.
+            n_alive = len(stage_idx)
+            x_full = np.zeros(len(self.cost_lst) + len(x) - n_alive)
+            x_full[stage_idx] = x[:n_alive]
+            x_full[len(self.cost_lst) :] = x[n_alive:]
+            x = x_full
+
         n_looting, n_convertion = x[: len(self.cost_lst)], x[len(self.cost_lst) :]
 
         cost = np.dot(x[: len(self.cost_lst)], self.cost_lst)
-        gcost = np.dot(x[len(self.cost_lst) :], self.convertion_cost_lst) / 0.004
-        gold = -np.dot(n_looting, self.cost_gold_offset) / 0.004
+        gcost = np.dot(x[len(self.cost_lst) :], self.convertion_cost_lst) / GOLD_UNIT
+        gold = -np.dot(n_looting, self.cost_gold_offset) / GOLD_UNIT
         exp = -np.dot(n_looting, self.cost_exp_offset) * 7400 / 30.0
 
-        if status != 0:
-            raise ValueError(status_dct[status])
+        names = self.item_names.get(language, self.item_names["zh_CN"])
 
         stages = []
-        for i, t in enumerate(n_looting):
-            if t >= 0.1:
-                target_items = np.where(self.probs_matrix[i] >= 0.02)[0]
-                items = {}
-                for idx in target_items:
-                    if len(self.item_id_array[idx]) != 5:
-                        continue
-                    try:
-                        name_str = self.itemdata[language][int(self.item_id_array[idx])]
-                    except KeyError:
-                        # Fallback to CN if language is unavailable
-                        name_str = self.itemdata["zh_CN"][int(self.item_id_array[idx])]
-                    items[name_str] = float2str(self.probs_matrix[i, idx] * t)
-                stage = {
-                    "stage": self.stage_array[i],
-                    "count": float2str(t),
-                    "items": items,
-                }
-                stages.append(stage)
+        stage_rows = np.flatnonzero(n_looting >= 0.1)
+        drops = self.probs_matrix[stage_rows]
+        row_sizes = np.diff(drops.indptr)
+        amounts = drops.data * np.repeat(n_looting[stage_rows], row_sizes)
+        is_shown = (drops.data >= 0.02) & self.is_material[drops.indices]
+        # Shown drops of the n-th stage are item_names[bounds[n] : bounds[n + 1]].
+        shown_rows = np.repeat(np.arange(len(stage_rows)), row_sizes)[is_shown]
+        bounds = np.zeros(len(stage_rows) + 1, dtype=int)
+        bounds[1:] = np.cumsum(np.bincount(shown_rows, minlength=len(stage_rows)))
+        item_names, amounts = names[drops.indices[is_shown]], amounts[is_shown]
+        for n, i in enumerate(stage_rows):
+            start, end = bounds[n], bounds[n + 1]
+            stage = {
+                "stage": self.stage_array[i],
+                "count": float2str(n_looting[i]),
+                "items": {
+                    name: float2str(amount)
+                    for name, amount in zip(item_names[start:end], amounts[start:end])
+                },
+            }
+            stages.append(stage)
 
         crafts = []
-        for i, t in enumerate(n_convertion):
+        for i in np.flatnonzero(n_convertion >= 0.05):
+            t = n_convertion[i]
+            material_idx, material_counts = self.craft_materials[i]
             if t >= 0.1:
-                idx = np.argmax(self.convertion_matrix[i])
-                item_id = self.item_id_array[idx]
-                try:
-                    target_id = self.itemdata[language][int(item_id)]
-                except KeyError:
-                    target_id = self.itemdata["zh_CN"][int(item_id)]
-                materials = {}
-                for k, v in self.convertions_dct[item_id].items():
-                    try:
-                        key_name = self.itemdata[language][int(k)]
-                    except KeyError:
-                        key_name = self.itemdata["zh_CN"][int(k)]
-                    materials[key_name] = str(v * int(t + 0.9))
+                count = int(t + 0.9)
                 synthesis = {
-                    "target": target_id,
-                    "count": str(int(t + 0.9)),
-                    "materials": materials,
+                    "target": names[self.craft_target_idx[i]],
+                    "count": str(count),
+                    "materials": {
+                        name: str(v * count)
+                        for name, v in zip(names[material_idx], material_counts)
+                    },
                 }
-                crafts.append(synthesis)
-            elif t >= 0.05:
-                idx = np.argmax(self.convertion_matrix[i])
-                item_id = self.item_id_array[idx]
-                try:
-                    target_name = self.itemdata[language][int(item_id)]
-                except KeyError:
-                    target_name = self.itemdata["zh_CN"][int(item_id)]
-                materials = {}
-                for k, v in self.convertions_dct[item_id].items():
-                    try:
-                        key_name = self.itemdata[language][int(k)]
-                    except KeyError:
-                        key_name = self.itemdata["zh_CN"][int(k)]
-                    materials[key_name] = "%.1f" % (v * t)
+            else:
                 synthesis = {
-                    "target": target_name,
+                    "target": names[self.craft_target_idx[i]],
                     "count": "%.1f" % t,
-                    "materials": materials,
+                    "materials": {
+                        name: "%.1f" % (v * t)
+                        for name, v in zip(names[material_idx], material_counts)
+                    },
                 }
-                crafts.append(synthesis)
-
-        values = [
-            {"level": "1", "items": []},
-            {"level": "2", "items": []},
-            {"level": "3", "items": []},
-            {"level": "4", "items": []},
-            {"level": "5", "items": []},
-        ]
-        for i, item_id in enumerate(self.item_id_array):
-            if len(item_id) == 5 and y[i] > 0.1:
-                try:
-                    item_name = self.itemdata[language][int(item_id)]
-                except KeyError:
-                    item_name = self.itemdata["zh_CN"][int(item_id)]
-                item_value = {"name": item_name, "value": "%.2f" % y[i]}
-                values[int(self.item_id_array[i][-1]) - 1]["items"].append(item_value)
-        for group in values:
-            group["items"] = sorted(
-                group["items"], key=lambda k: float(k["value"]), reverse=True
-            )
+            crafts.append(synthesis)
 
         res = {
             "lang": language,
@@ -559,58 +2484,331 @@ class MaterialPlanning(object):
             "exp": int(exp),
             "stages": stages,
             "craft": crafts,
-            "values": list(reversed(values)),
+            "values": self._render_values(y, names),
         }
+        return res
 
-        if print_output:
-            print(
-                status_dct[status]
-                + (" Computed in %.4f seconds," % (time.time() - stt))
+    def _render_values(self, y, names) -> List[Dict[str, Any]]:
+        """
+        Formats the item values of a plan.
+        Args:
+            y: array of the value of each item.
+            names: array of the item names in the plan's language.
+        Returns:
+            values: the materials worth more than 0.1 sanity grouped by level,
+                highest first, and sorted by value within a level.
+        """
+        values = []
+        valued_idx = np.flatnonzero(self.is_material & (y > 0.1))
+        rounded = ["%.2f" % v for v in y[valued_idx]]
+        # Sorted by rounded value, ties keep the item order.
+        order = np.argsort(-np.array(rounded, dtype=float), kind="stable")
+        for level in range(5, 0, -1):
+            values.append(
+                {
+                    "level": str(level),
+                    "items": [
+                        {"name": names[valued_idx[j]], "value": rounded[j]}
+                        for j in order
+                        if self.item_levels[valued_idx[j]] == level
+                    ],
+                }
             )
+        return values
 
-        if print_output:
-            print(
-                "Estimated total cost: %d, gold: %d, exp: %d."
-                % (res["cost"], res["gold"], res["exp"])
-            )
-            print("Loot at following stages:")
-            for stage in stages:
-                display_lst = [k + "(%s) " % stage["items"][k] for k in stage["items"]]
-                print(
-                    "Stage "
-                    + stage["stage"]
-                    + "(%s times) ===> " % stage["count"]
-                    + ", ".join(display_lst)
+
+def is_non_cn_stage(stage: str) -> bool:
+    """
+    Whether a stage is available on the non Chinese servers (EN/JP/KR).
+    Args:
+        stage: string. The stage code, e.g. "4-6" or "S5-2".
+    """
+    try:
+        return int(stage.lstrip("S")[0]) <= NON_CN_WORLD_NUM
+    except ValueError:
+        return True
+
+
+def normalize_name(name: str) -> str:
+    """
+    Case folds an item name and removes its whitespace, for fuzzy lookups.
+    """
+    return "".join(name.split()).casefold()
+
+
+def _print_plan(res):
+    """
+    Prints a plan returned by get_plan in a human readable form.
+    """
+    print(
+        "Estimated total cost: %d, gold: %d, exp: %d."
+        % (res["cost"], res["gold"], res["exp"])
+    )
+    print("Loot at following stages:")
+    for stage in res["stages"]:
+        display_lst = [k + "(%s) " % stage["items"][k] for k in stage["items"]]
+        print(
+            "Stage "
+            + stage["stage"]
+            + "(%s times) ===> " % stage["count"]
+            + ", ".join(display_lst)
+        )
+
+    print("\nSynthesize following items:")
+    for synthesis in res["craft"]:
+        display_lst = [
+            k + "(%s) " % synthesis["materials"][k] for k in synthesis["materials"]
+        ]
+        print(
+            synthesis["target"]
+            + "(%s) <=== " % synthesis["count"]
+            + ", ".join(display_lst)
+        )
+
+    print("\nItems Values:")
+    for group in res["values"]:
+        display_lst = [
+            "%s:%s" % (item["name"], item["value"]) for item in group["items"]
+        ]
+        print("Level %s items: " % group["level"])
+        print(", ".join(display_lst))
+
+
+def _sparse_from_entries(entries: Dict[Tuple[int, int], float], shape) -> Any:
+    """
+    Builds a CSR matrix from a dict mapping (row, col) to a value.
+    Args:
+        entries: a Dict[Tuple[int, int], float] of the non-zero cells.
+        shape: the shape of the dense equivalent.
+    Returns:
+        matrix: a scipy.sparse.csr_matrix.
+    """
+    if not entries:
+        return sparse.csr_matrix(shape)
+    rows, cols = zip(*entries.keys())
+    return sparse.csr_matrix(
+        (np.fromiter(entries.values(), dtype=float), (rows, cols)), shape=shape
+    )
+
+
+def scale_lp(template: LPTemplate, passes=4) -> LPTemplate:
+    """
+    Equilibrates a linear program by geometric mean scaling: the rows and the
+    columns of A_ub are alternately multiplied so that the geometric mean of the
+    magnitudes of their nonzeros gets close to 1. The largest cost is then
+    brought close to 1 too, by multiplying every row and dividing every column by
+    the same factor. All factors are rounded to powers of two, which scales the
+    values without rounding errors.
+    Args:
+        template: LPTemplate. The unscaled program.
+        passes: int. Number of alternate row and column passes.
+    Returns:
+        template: LPTemplate. The scaled program with its row_scale and col_scale.
+            The demand has to be multiplied by row_scale, the solution x by
+            col_scale and the item values y by row_scale.
+    """
+    A = sparse.coo_matrix(template.A_ub)
+    is_nonzero = A.data != 0
+    rows, cols = A.row[is_nonzero], A.col[is_nonzero]
+    logs = np.log2(np.abs(A.data[is_nonzero]))
+    n_rows, n_cols = A.shape
+    row_counts = np.maximum(np.bincount(rows, minlength=n_rows), 1)
+    col_counts = np.maximum(np.bincount(cols, minlength=n_cols), 1)
+    row_log, col_log = np.zeros(n_rows), np.zeros(n_cols)
+    for _ in range(passes):
+        row_log = -np.bincount(rows, logs + col_log[cols], n_rows) / row_counts
+        col_log = -np.bincount(cols, logs + row_log[rows], n_cols) / col_counts
+    cost_max = np.abs(template.cost * 2.0**col_log).max()
+    if cost_max > 0:
+        # A_ub is unchanged, the objective is divided by cost_max.
+        row_log += np.log2(cost_max)
+        col_log -= np.log2(cost_max)
+    row_scale, col_scale = 2.0 ** np.round(row_log), 2.0 ** np.round(col_log)
+
+    A_ub, A_dual = template.A_ub, template.A_dual
+    if sparse.issparse(A_ub):
+        A_ub = (sparse.diags(row_scale) @ A_ub @ sparse.diags(col_scale)).asformat(
+            A_ub.format
+        )
+        A_dual = (sparse.diags(col_scale) @ A_dual @ sparse.diags(row_scale)).asformat(
+            A_dual.format
+        )
+    else:
+        A_ub = row_scale[:, None] * A_ub * col_scale
+        A_dual = col_scale[:, None] * A_dual * row_scale
+    return LPTemplate(A_ub, A_dual, template.cost * col_scale, row_scale, col_scale)
+
+
+def round_plan(A, cost, demand, x, max_steps=1000) -> np.ndarray:
+    """
+    Rounds the solution of a plan's linear program to whole stage clears and
+    crafts. Starting from the solution rounded down, the demand left uncovered
+    is solved again as a linear program, whose solution rounded down is added,
+    or a single run of its largest stage or rule if that is zero, until the
+    demand is covered. The stages and rules that became unnecessary are then
+    removed, the most expensive first.
+    Args:
+        A: array of shape [n_items, n_cols]. Items produced per stage clear and
+            per crafting, negative for consumed items.
+        cost: array of shape [n_cols]. Cost of the stages and rules.
+        demand: array of shape [n_items]. Demand of every item.
+        x: array of shape [n_cols]. Solution of the linear program.
+        max_steps: int. Maximum number of linear programs solved.
+    Returns:
+        x: array of shape [n_cols] holding whole numbers, such that A x >= demand.
+    Raises:
+        ValueError: if the demand couldn't be covered.
+    """
+    x = np.floor(x + ROUND_TOL)
+    for _ in range(max_steps):
+        residual = demand - A @ x
+        if np.all(residual <= ROUND_TOL):
+            break
+        solution = linprog(cost, A_ub=-A, b_ub=-residual, method="highs")
+        if solution.status != 0:
+            raise ValueError("Could not round the plan: " + solution.message)
+        step = np.floor(solution.x + ROUND_TOL)
+        if not step.any():
+            step[np.argmax(solution.x)] = 1
+        x += step
+    else:
+        raise ValueError("Could not round the plan in {} steps".format(max_steps))
+    if not np.all(np.isfinite(x)):
+        raise ValueError("Could not round the plan")
+    slack = A @ x - demand
+
+    # Removing a rule frees its materials, which may let stages be removed.
+    removed = True
+    while removed:
+        removed = False
+        for j in np.argsort(-cost, kind="stable"):
+            if x[j] == 0:
+                continue
+            column = A[:, j]
+            is_produced = column > ROUND_TOL
+            count = x[j]
+            if is_produced.any():
+                count = min(
+                    count,
+                    np.floor(
+                        np.min((slack[is_produced] + ROUND_TOL) / column[is_produced])
+                    ),
                 )
+            if count > 0:
+                x[j] -= count
+                slack -= count * column
+                removed = True
+    return x
 
-            print("\nSynthesize following items:")
-            for synthesis in crafts:
-                display_lst = [
-                    k + "(%s) " % synthesis["materials"][k]
-                    for k in synthesis["materials"]
-                ]
-                print(
-                    synthesis["target"]
-                    + "(%s) <=== " % synthesis["count"]
-                    + ", ".join(display_lst)
+
+def _check_sweep(parameter, values, gold_demand, exp_demand) -> List[Any]:
+    """
+    Validates the arguments of MaterialPlanning.sweep.
+    Returns:
+        values: the values, stage codes are put in lists.
+    Raises:
+        ValueError: if the parameter or some values are invalid.
+    """
+    if parameter not in SWEEP_PARAMETERS:
+        raise ValueError(
+            "Unknown parameter {}, expected one of {}".format(
+                parameter, SWEEP_PARAMETERS
+            )
+        )
+    if parameter == "exp_unit" and not exp_demand:
+        raise ValueError("Sweeping exp_unit requires exp_demand")
+    if parameter == "gold_unit" and not gold_demand:
+        raise ValueError("Sweeping gold_unit requires gold_demand")
+    checked = []
+    for value in values:
+        if parameter == "exclude":
+            value = [value] if isinstance(value, str) else value
+            if not isinstance(value, list) or not all(
+                isinstance(stage, str) for stage in value
+            ):
+                raise ValueError(
+                    "Invalid value {!r}, expected a stage code or a list of "
+                    "stage codes".format(value)
                 )
+        elif (
+            isinstance(value, bool)
+            or not isinstance(value, (int, float))
+            or not value >= 0
+        ):
+            raise ValueError(
+                "Invalid value {!r} for {}, expected a positive number".format(
+                    value, parameter
+                )
+            )
+        checked.append(value)
+    return checked
 
-            print("\nItems Values:")
-            for i, group in reversed(list(enumerate(values))):
-                display_lst = [
-                    "%s:%s" % (item["name"], item["value"]) for item in group["items"]
-                ]
-                print("Level %d items: " % (i + 1))
-                print(", ".join(display_lst))
-
-        if exclude:
-            self.stage_array = BackTrace[0]
-            self.cost_lst = BackTrace[1]
-            self.probs_matrix = BackTrace[2]
-            self.cost_exp_offset = BackTrace[3]
-            self.cost_gold_offset = BackTrace[4]
 
-        return res
+def _record_solve(timer: PhaseTimer, problem: str, method: str, status: int):
+    timer.add_solve(problem, method, status)
+    metrics.inc(
+        "arkplanner_solves_total", problem=problem, method=method, status=str(status)
+    )
+
+
+def _patch_sparse(matrix, rows, cols, values) -> Any:
+    """
+    Returns a copy of a CSR or CSC matrix with some of its stored entries
+    replaced, its sparsity pattern is unchanged.
+    Args:
+        matrix: scipy.sparse.csr_matrix or csc_matrix.
+        rows, cols: arrays of the indices of the entries, which must be stored.
+        values: array of the new values.
+    """
+    patched = matrix.copy()
+    patched.sort_indices()
+    major, minor = (rows, cols) if patched.format == "csr" else (cols, rows)
+    positions = np.array(
+        [
+            start + np.searchsorted(patched.indices[start:end], index)
+            for start, end, index in zip(
+                patched.indptr[major], patched.indptr[major + 1], minor
+            )
+        ],
+        dtype=int,
+    )
+    assert np.array_equal(patched.indices[positions], minor)
+    patched.data[positions] = values
+    return patched
+
+
+def _sparse_to_arrays(name: str, matrix) -> Dict[str, np.ndarray]:
+    """
+    Splits a CSR or CSC matrix into the arrays stored in a snapshot.
+    Args:
+        name: string. Prefix of the array names.
+        matrix: a scipy.sparse.csr_matrix or csc_matrix.
+    Returns:
+        arrays: a dict of the data, indices, indptr and shape arrays.
+    """
+    return {
+        name + "_data": matrix.data,
+        name + "_indices": matrix.indices,
+        name + "_indptr": matrix.indptr,
+        name + "_shape": np.array(matrix.shape),
+    }
+
+
+def _sparse_from_arrays(name: str, arrays, fmt="csr") -> Any:
+    """
+    Reassembles a matrix split by _sparse_to_arrays, without copying the arrays.
+    Args:
+        name: string. Prefix of the array names.
+        arrays: a mapping of numpy arrays.
+        fmt: string. "csr" or "csc", the format the matrix was stored in.
+    Returns:
+        matrix: a scipy.sparse.csr_matrix or csc_matrix.
+    """
+    matrix_cls = sparse.csc_matrix if fmt == "csc" else sparse.csr_matrix
+    return matrix_cls(
+        (arrays[name + "_data"], arrays[name + "_indices"], arrays[name + "_indptr"]),
+        shape=tuple(arrays[name + "_shape"]),
+    )
 
 
 def float2str(x: float, offset=0.5):
@@ -637,7 +2835,8 @@ def request_data(
         save_path_stats: string. local path for storing the stats data.
         save_path_rules: string. local path for storing the composing rules data.
     Returns:
-        material_probs: dictionary. Content of the stats json file.
+        material_probs: dictionary. The stats data, with the "matrix" records
+            streamed as they are iterated over.
         convertion_rules: dictionary. Content of the rules json file.
     """
     if not dont_save_data:
@@ -650,25 +2849,135 @@ def request_data(
         except FileExistsError:
             pass
 
-    # TODO: async requests
-    req = urllib.request.Request(url_stats, None, headers)
-    with urllib.request.urlopen(req) as response:
-        material_probs = json.loads(response.read().decode())
-        if not dont_save_data:
-            with open(save_path_stats, "w") as outfile:
-                json.dump(material_probs, outfile)
+    if dont_save_data:
+        body, _ = request_conditional(url_stats, {})
+        material_probs = {"matrix": iter_matrix(_iter_bytes(body))}
+    else:
+        # Written to disk as it is received, then parsed from there.
+        download_data(url_stats, save_path_stats)
+        material_probs = {"matrix": open_matrix(save_path_stats)}
 
-    req = urllib.request.Request(url_rules, None, headers)
-    with urllib.request.urlopen(req) as response:
-        response = urllib.request.urlopen(req)
-        convertion_rules = json.loads(response.read().decode())
-        if not dont_save_data:
-            with open(save_path_rules, "w") as outfile:
-                json.dump(convertion_rules, outfile)
+    body, validators = request_conditional(url_rules, {})
+    convertion_rules = json.loads(body)
+    if not dont_save_data:
+        save_data(save_path_rules, body, validators)
 
     return material_probs, convertion_rules
 
 
+def request_conditional(url: str, validators: Dict[str, str]):
+    """
+    Requests a resource unless it is identical to the version described by validators.
+    Args:
+        url: string. url to request.
+        validators: a dict which may hold the "etag", "last_modified" and "sha1"
+            of the version we already have.
+    Returns:
+        body: bytes, or None if the resource is unchanged.
+        validators: the validators of the current version of the resource.
+    """
+    req = urllib.request.Request(url, None, conditional_headers(validators))
+    try:
+        with urllib.request.urlopen(req) as response:
+            return check_modified(response.read(), response.headers, validators)
+    except urllib.error.HTTPError as err:
+        if err.code == 304:
+            return None, validators
+        raise
+
+
+def download_data(url: str, path: str) -> Dict[str, str]:
+    """
+    Requests a resource and stores it along with its validators, without
+    holding the whole response in memory.
+    Args:
+        url: string. url to request.
+        path: string. local path for storing the data.
+    Returns:
+        validators: the validators of the resource.
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    sha1 = hashlib.sha1()
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    req = urllib.request.Request(url, None, headers)
+    with urllib.request.urlopen(req) as response, open(tmp_path, "wb") as f:
+        for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+            sha1.update(chunk)
+            f.write(chunk)
+        validators = {"sha1": sha1.hexdigest()}
+        if response.headers.get("ETag"):
+            validators["etag"] = response.headers.get("ETag")
+        if response.headers.get("Last-Modified"):
+            validators["last_modified"] = response.headers.get("Last-Modified")
+    os.replace(tmp_path, path)
+    replace_file(validators_path(path), json.dumps(validators).encode())
+    return validators
+
+
+def conditional_headers(validators: Dict[str, str]) -> Dict[str, str]:
+    """
+    Builds request headers asking for the resource only if it changed.
+    """
+    req_headers = dict(headers)
+    if "etag" in validators:
+        req_headers["If-None-Match"] = validators["etag"]
+    if "last_modified" in validators:
+        req_headers["If-Modified-Since"] = validators["last_modified"]
+    return req_headers
+
+
+def check_modified(body: bytes, response_headers, validators: Dict[str, str]):
+    """
+    Compares a full response with the version described by validators, for
+    servers that don't support conditional requests.
+    Args:
+        body: bytes. Body of the response.
+        response_headers: a case insensitive mapping of the response headers.
+        validators: the validators of the version we already have.
+    Returns:
+        body: bytes, or None if the content is identical.
+        validators: the validators of the response.
+    """
+    new_validators = {"sha1": hashlib.sha1(body).hexdigest()}
+    if response_headers.get("ETag"):
+        new_validators["etag"] = response_headers.get("ETag")
+    if response_headers.get("Last-Modified"):
+        new_validators["last_modified"] = response_headers.get("Last-Modified")
+    if new_validators["sha1"] == validators.get("sha1"):
+        return None, new_validators
+    return body, new_validators
+
+
+def request_data_conditional(url_stats, url_rules, gamedata_path, validators):
+    """
+    Conditionally requests the stats, the rules and every item table.
+    Args:
+        url_stats: string. url to the dropping rate stats data.
+        url_rules: string. url to the composing rules data.
+        gamedata_path: a format string that takes in 1 argument to format in the region name.
+        validators: a dict with the "stats", "rules" and "items" (per region)
+            validators of the data we already have.
+    Returns:
+        bodies: a dict with the same structure as validators holding the response
+            bodies, None where the data is unchanged.
+        validators: the validators of the current data.
+    """
+    bodies, new_validators = {"items": {}}, {"items": {}}
+    for key, url in (("stats", url_stats), ("rules", url_rules)):
+        bodies[key], new_validators[key] = request_conditional(
+            url, validators.get(key, {})
+        )
+    for lang in gamedata_langs:
+        (
+            bodies["items"][lang],
+            new_validators["items"][lang],
+        ) = request_conditional(
+            gamedata_path.format(lang), validators.get("items", {}).get(lang, {})
+        )
+    return bodies, new_validators
+
+
 def request_itemdata(gamedata_path: str) -> Dict[str, Dict[int, str]]:
     """
     Pulls item data github sources.
@@ -677,22 +2986,170 @@ def request_itemdata(gamedata_path: str) -> Dict[str, Dict[int, str]]:
     Returns:
         itemdata: a dict mapping a region's name to a dict mapping an item ID to its name.
     """
-    itemdata = {}
+    return request_itemdata_conditional(gamedata_path, {}, {})[0]
+
+
+def request_itemdata_conditional(
+    gamedata_path: str, validators: Dict[str, Dict[str, str]], itemdata
+) -> Tuple[Dict[str, Dict[int, str]], Dict[str, Dict[str, str]]]:
+    """
+    Pulls item data github sources, skipping the regions that are unchanged.
+    Args:
+        gamedata_path: a format string that takes in 1 argument to format in the region name.
+        validators: a dict mapping a region's name to the validators of its item table.
+        itemdata: the current item data, reused for the unchanged regions.
+    Returns:
+        itemdata: a dict mapping a region's name to a dict mapping an item ID to its name.
+        validators: the validators of the current item tables.
+    """
+    new_itemdata, new_validators = {}, {}
     for lang in gamedata_langs:
-        req = urllib.request.Request(gamedata_path.format(lang), None, headers)
-        with urllib.request.urlopen(req) as response:
-            response = urllib.request.urlopen(req)
-            # filter out unneeded data, we only care about ones with purely numerical IDs
-            data = {}
-            for k, v in json.loads(response.read().decode())["items"].items():
-                try:
-                    i = int(k)
-                except ValueError:
-                    continue
-                data[i] = v["name"]
-            itemdata[lang] = data
+        body, new_validators[lang] = request_conditional(
+            gamedata_path.format(lang), validators.get(lang, {})
+        )
+        if body is None:
+            new_itemdata[lang] = itemdata[lang]
+        else:
+            new_itemdata[lang] = parse_itemdata(json.loads(body))
+
+    return new_itemdata, new_validators
+
+
+def parse_itemdata(item_table) -> Dict[int, str]:
+    """
+    Extracts the item names from a game data item table.
+    Args:
+        item_table: dictionary. Content of an item_table.json file.
+    Returns:
+        names: a dict mapping an item ID to its name.
+    """
+    # filter out unneeded data, we only care about ones with purely numerical IDs
+    data = {}
+    for k, v in item_table["items"].items():
+        try:
+            i = int(k)
+        except ValueError:
+            continue
+        data[i] = v["name"]
+    return data
+
+
+def async_http_client(timeout: float, max_connections: Optional[int] = None):
+    """
+    Opens an async client of the installed httpx. Up to httpx 0.9, the version
+    pinned by sanic 19.12, it is httpx.Client and its pool is sized by a
+    PoolLimits, later versions have httpx.AsyncClient and then Limits.
+    Args:
+        timeout: float. Seconds before a request times out.
+        max_connections: int or None. Maximum number of open connections,
+            the default of httpx if None.
+    Returns:
+        client: an async client, to be used as an async context manager.
+    """
+    import httpx
+
+    kwargs = {"timeout": timeout}
+    if max_connections is not None and hasattr(httpx, "Limits"):
+        kwargs["limits"] = httpx.Limits(max_connections=max_connections)
+    elif max_connections is not None:
+        kwargs["pool_limits"] = httpx.PoolLimits(hard_limit=max_connections)
+    return getattr(httpx, "AsyncClient", httpx.Client)(**kwargs)
+
+
+async def request_data_async(
+    client,
+    url_stats,
+    url_rules,
+    gamedata_path,
+    validators,
+):
+    """
+    Conditionally requests the stats, the rules and every item table concurrently.
+    Args:
+        client: an async httpx client, see async_http_client.
+        See request_data_conditional for the other arguments and the return values.
+    """
 
-    return itemdata
+    async def fetch(url, url_validators):
+        response = await client.get(url, headers=conditional_headers(url_validators))
+        if response.status_code == 304:
+            return None, url_validators
+        response.raise_for_status()
+        return check_modified(response.content, response.headers, url_validators)
+
+    item_validators = validators.get("items", {})
+    results = await asyncio.gather(
+        fetch(url_stats, validators.get("stats", {})),
+        fetch(url_rules, validators.get("rules", {})),
+        *[
+            fetch(gamedata_path.format(lang), item_validators.get(lang, {}))
+            for lang in gamedata_langs
+        ],
+    )
+    bodies = {"stats": results[0][0], "rules": results[1][0]}
+    new_validators = {"stats": results[0][1], "rules": results[1][1]}
+    bodies["items"] = {lang: r[0] for lang, r in zip(gamedata_langs, results[2:])}
+    new_validators["items"] = {
+        lang: r[1] for lang, r in zip(gamedata_langs, results[2:])
+    }
+    return bodies, new_validators
+
+
+def save_data(path: str, body: bytes, validators: Dict[str, str]):
+    """
+    Stores a data file along with the validators of the response it came from.
+    The body is stored first, validators left over from the previous body are
+    ignored by file_validators.
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    replace_file(path, body)
+    replace_file(validators_path(path), json.dumps(validators).encode())
+
+
+def replace_file(path: str, content: bytes):
+    """
+    Writes a file aside and renames it, so that readers and a crash never
+    leave a partial file.
+    """
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def validators_path(path: str) -> str:
+    """
+    Path of the validators stored alongside a data file.
+    """
+    return os.path.splitext(path)[0] + ".meta.json"
+
+
+def file_validators(path: str) -> Dict[str, str]:
+    """
+    Validators of a local data file, only trusting the stored ones if they
+    match its content.
+    Args:
+        path: string. local path to the data file.
+    Returns:
+        validators: a dict, empty if the file doesn't exist.
+    """
+    try:
+        with open(path, "rb") as f:
+            sha1_hash = hashlib.sha1()
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                sha1_hash.update(chunk)
+            sha1 = sha1_hash.hexdigest()
+    except FileNotFoundError:
+        return {}
+    try:
+        with open(validators_path(path)) as f:
+            validators = json.load(f)
+    except (FileNotFoundError, ValueError):
+        validators = {}
+    if validators.get("sha1") != sha1:
+        validators = {"sha1": sha1}
+    return validators
 
 
 def load_data(path_stats, path_rules):
@@ -711,3 +3168,183 @@ def load_data(path_stats, path_rules):
         convertion_rules = json.load(json_file)
 
     return material_probs, convertion_rules
+
+
+def stream_data(path_stats, path_rules):
+    """
+    To load stats and rules data from local directories, streaming the stats.
+    Args:
+        path_stats: string. local path to the stats data.
+        path_rules: string. local path to the composing rules data.
+    Returns:
+        material_probs: dictionary. The stats data, with the "matrix" records
+            read from the file as they are iterated over.
+        convertion_rules: dictionary. Content of the rules json file.
+    Raises:
+        FileNotFoundError: right away if either file is missing.
+    """
+    material_probs = {"matrix": open_matrix(path_stats)}
+    with open(path_rules) as json_file:
+        convertion_rules = json.load(json_file)
+
+    return material_probs, convertion_rules
+
+
+def open_matrix(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Opens a stats data file and returns an iterator over its matrix records.
+    The file is opened right away and closed once the records are exhausted.
+    """
+    f = open(path, "rb")
+
+    def records():
+        with f:
+            yield from iter_matrix(iter(lambda: f.read(CHUNK_SIZE), b""))
+
+    return records()
+
+
+_MATRIX_START = re.compile(r'"matrix"\s*:\s*\[')
+
+
+def iter_matrix(chunks: Iterable[bytes]) -> Iterator[Dict[str, Any]]:
+    """
+    Parses the records of the "matrix" array of the stats data one at a time,
+    only keeping the current record and the unparsed part of the current
+    chunk in memory.
+    Args:
+        chunks: an iterable of bytes, the UTF-8 encoded stats json in order.
+    Yields:
+        record: dictionary. A record of the matrix.
+    Raises:
+        ValueError: if the data has no matrix or is truncated.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buf = ""
+    while True:
+        match = _MATRIX_START.search(buf)
+        if match is not None:
+            pos = match.end()
+            break
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError("No matrix in the stats data")
+        buf += utf8.decode(chunk)
+
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        try:
+            if pos == len(buf):
+                raise json.JSONDecodeError("Expecting value", buf, pos)
+            record, pos = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # The record is cut by the end of the chunk, read the next one.
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise
+            buf = buf[pos:] + utf8.decode(chunk)
+            pos = 0
+            continue
+        yield record
+
+
+def _iter_bytes(body: bytes) -> Iterator[bytes]:
+    """
+    Splits a response body in chunks for iter_matrix.
+    """
+    for start in range(0, len(body), CHUNK_SIZE):
+        yield body[start : start + CHUNK_SIZE]
+
+
+def _filter_matrix(records, filter_freq, filter_stages) -> Iterator[Dict[str, Any]]:
+    """
+    Drops the records of stages that cost no sanity, are filtered out by code
+    or have fewer samples than filter_freq.
+    """
+    filter_stages = set(filter_stages)
+    for dct in records:
+        if dct["stage"]["apCost"] > 0.1 and dct["stage"]["code"] not in filter_stages:
+            if not filter_freq or dct["times"] >= filter_freq:
+                yield dct
+
+
+def _read_farms(records) -> Farms:
+    """
+    Reads the stage data from the stats records in a single pass, so that they
+    can be streamed: items and stages are indexed in order of appearance.
+    Args:
+        records: iterable of dictionaries recording the dropping info per stage
+            per item, as yielded by _filter_matrix.
+    """
+    # To count items and stages.
+    additional_items = {"30135": u"D32钢", "30125": u"双极纳米片", "30115": u"聚合剂"}
+    exp_unit = EXP_UNIT
+    gold_unit = GOLD_UNIT
+    exp_worths = {
+        "2001": exp_unit,
+        "2002": exp_unit * 2,
+        "2003": exp_unit * 5,
+        "2004": exp_unit * 10,
+        "3003": exp_unit * 2,
+    }
+    gold_worths: Dict[str, float] = {}
+
+    item_idx: Dict[str, int] = {}
+    item_array = []
+    stage_dct: Dict[str, int] = {}
+    probs_entries = {}
+    cost_lst: List[float] = []
+    cost_exp_offset: List[float] = []
+    cost_gold_offset: List[float] = []
+    for dct in records:
+        stage_code, item_id = dct["stage"]["code"], dct["item"]["itemId"]
+        stage = stage_dct.setdefault(stage_code, len(stage_dct))
+        if stage == len(cost_lst):
+            cost_lst.append(0.0)
+            cost_exp_offset.append(0.0)
+            cost_gold_offset.append(0.0)
+        cost_lst[stage] = dct["stage"]["apCost"]
+        try:
+            float(item_id)
+        except ValueError:
+            continue
+        if item_id not in item_idx:
+            item_idx[item_id] = len(item_array)
+            item_array.append(dct["item"]["name"])
+        rate = dct["quantity"] / float(dct["times"])
+        probs_entries[stage, item_idx[item_id]] = rate
+        if cost_lst[stage] != 0:
+            cost_gold_offset[stage] = -dct["stage"]["apCost"] * (12 * gold_unit)
+        if item_id in exp_worths:
+            cost_exp_offset[stage] -= (
+                exp_worths[item_id] * dct["quantity"] / float(dct["times"])
+            )
+        if item_id in gold_worths:
+            cost_gold_offset[stage] -= (
+                gold_worths[item_id] * dct["quantity"] / float(dct["times"])
+            )
+    for item_id, name in additional_items.items():
+        if item_id in item_idx:
+            item_array[item_idx[item_id]] = name
+        else:
+            item_idx[item_id] = len(item_array)
+            item_array.append(name)
+
+    gold_offset = np.array(cost_gold_offset, dtype=float)
+    # Hardcoding: extra gold farmed.
+    gold_offset[stage_dct["S4-6"]] -= 3228 * gold_unit
+    gold_offset[stage_dct["S5-2"]] -= 2484 * gold_unit
+    return Farms(
+        item_array,
+        list(item_idx),
+        list(stage_dct),
+        probs_entries,
+        np.array(cost_lst, dtype=float),
+        np.array(cost_exp_offset, dtype=float),
+        gold_offset,
+    )
@@ -0,0 +1,259 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+SECONDS_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+SIZE_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+ATTEMPT_BUCKETS = (1, 2, 3, 4, 5)
+# name -> (type, help, buckets of histograms)
+METRICS = {
+    "arkplanner_plan_phase_seconds": (
+        "histogram",
+        "Time spent in each phase of computing a plan.",
+        SECONDS_BUCKETS,
+    ),
+    "arkplanner_plans_total": (
+        "counter",
+        "Plans computed or loaded from the plan cache or the plan store.",
+        None,
+    ),
+    "arkplanner_plan_store_errors_total": (
+        "counter",
+        "Plan store operations that failed and were treated as misses.",
+        None,
+    ),
+    "arkplanner_solves_total": (
+        "counter",
+        "Solver calls by problem, method and status.",
+        None,
+    ),
+    "arkplanner_solve_attempts": (
+        "histogram",
+        "Methods tried per problem before one succeeded or the chain ended.",
+        ATTEMPT_BUCKETS,
+    ),
+    "arkplanner_lp_rows": (
+        "histogram",
+        "Number of items of the solved linear programs.",
+        SIZE_BUCKETS,
+    ),
+    "arkplanner_lp_columns": (
+        "histogram",
+        "Number of stages and rules of the solved linear programs.",
+        SIZE_BUCKETS,
+    ),
+    "arkplanner_refresh_seconds": (
+        "histogram",
+        "Duration of the data refreshes, downloads included.",
+        SECONDS_BUCKETS,
+    ),
+    "arkplanner_refreshes_total": (
+        "counter",
+        "Data refreshes by result.",
+        None,
+    ),
+    "arkplanner_request_seconds": (
+        "histogram",
+        "Duration of the HTTP requests per endpoint.",
+        SECONDS_BUCKETS,
+    ),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Metrics(object):
+    def __init__(self):
+        """
+        Counters and histograms of the metrics declared in METRICS, safe to share
+        between threads. Processes keep their own registry, a worker's metrics
+        are moved to the server's with drain and merge.
+        """
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        # (name, labels) -> [count per bucket, sum, count]
+        self._histograms: Dict[Tuple[str, Labels], list] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value=1.0, **labels):
+        """
+        Adds value to a counter.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        Records a value in a histogram.
+        """
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        i = bisect_left(buckets, value)
+        with self._lock:
+            try:
+                hist = self._histograms[key]
+            except KeyError:
+                hist = self._histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            hist[0][i] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def drain(self) -> Dict[str, Any]:
+        """
+        Empties the registry.
+        Returns:
+            state: the recorded values, to be passed to merge.
+        """
+        with self._lock:
+            state = {"counters": self._counters, "histograms": self._histograms}
+            self._counters, self._histograms = {}, {}
+        return state
+
+    def merge(self, state: Dict[str, Any]):
+        """
+        Adds values returned by drain, usually by another process, to the registry.
+        """
+        with self._lock:
+            for key, value in state["counters"].items():
+                self._counters[key] = self._counters.get(key, 0.0) + value
+            for key, (counts, total, count) in state["histograms"].items():
+                hist = self._histograms.setdefault(key, [[0] * len(counts), 0.0, 0])
+                hist[0] = [a + b for a, b in zip(hist[0], counts)]
+                hist[1] += total
+                hist[2] += count
+
+    def render(self) -> str:
+        """
+        Returns:
+            text: the metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {
+                k: (list(v[0]), v[1], v[2]) for k, v in self._histograms.items()
+            }
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, kind))
+            if kind == "counter":
+                for (key, labels), value in sorted(counters.items()):
+                    if key == name:
+                        lines.append(
+                            "{}{} {}".format(name, _format_labels(labels), value)
+                        )
+                continue
+            for (key, labels), (counts, total, count) in sorted(histograms.items()):
+                if key != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    lines.append(
+                        "{}_bucket{} {}".format(
+                            name,
+                            _format_labels(labels + (("le", str(bound)),)),
+                            cumulative,
+                        )
+                    )
+                lines.append("{}_sum{} {}".format(name, _format_labels(labels), total))
+                lines.append(
+                    "{}_count{} {}".format(name, _format_labels(labels), count)
+                )
+        return "\n".join(lines) + "\n"
+
+
+class PhaseTimer(object):
+    def __init__(self):
+        """
+        Accumulates the time spent in the phases of one plan, and the solver
+        calls it took.
+        """
+        self.phases: Dict[str, float] = {}
+        self.solves: List[Dict[str, Any]] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        stt = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + (time.perf_counter() - stt)
+
+    def add_solve(self, problem: str, method: str, status: int):
+        """
+        Records a solver call.
+        Args:
+            problem: string. "primal" or "dual".
+            method: string. The linprog method, or "highs-warm".
+            status: int. The linprog status of the call.
+        """
+        self.solves.append({"problem": problem, "method": method, "status": status})
+
+    def record(self, registry=None):
+        """
+        Records every phase in the arkplanner_plan_phase_seconds histogram.
+        Args:
+            registry: Metrics or None. Defaults to the registry of this process.
+        """
+        registry = registry or metrics
+        for name, seconds in self.phases.items():
+            registry.observe("arkplanner_plan_phase_seconds", seconds, phase=name)
+
+    def milliseconds(self) -> Dict[str, float]:
+        """
+        Returns:
+            timings: a dict mapping each phase to its duration in milliseconds.
+        """
+        return {name: round(s * 1000, 3) for name, s in self.phases.items()}
+
+
+def record_refresh(seconds: float, result: str, registry=None):
+    """
+    Records a data refresh.
+    Args:
+        seconds: float. Duration of the refresh.
+        result: string. "patched", "updated", "unchanged" or "failed".
+        registry: Metrics or None. Defaults to the registry of this process.
+    """
+    registry = registry or metrics
+    registry.observe("arkplanner_refresh_seconds", seconds)
+    registry.inc("arkplanner_refreshes_total", result=result)
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            '{}="{}"'.format(
+                k,
+                str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+            )
+            for k, v in labels
+        )
+        + "}"
+    )
+
+
+# Registry of the current process.
+metrics = Metrics()
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+PLAN_CACHE_SIZE_DEFAULT = 1024
+
+
+class PlanCache(object):
+    def __init__(self, maxsize=PLAN_CACHE_SIZE_DEFAULT, ttl=None):
+        """
+        Bounded LRU cache of computed plans, safe to share between threads.
+        Args:
+            maxsize: int. Maximum number of plans kept, 0 disables the cache.
+            ttl: float or None. Seconds after which a plan expires.
+                Plans never expire if None.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Locks can't be pickled, a copied cache starts empty.
+        return {"maxsize": self.maxsize, "ttl": self.ttl}
+
+    def __setstate__(self, state):
+        self.__init__(state["maxsize"], state["ttl"])
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Looks up a plan and marks it as recently used.
+        Returns:
+            plan: the cached value or None on a miss.
+        """
+        with self._lock:
+            try:
+                expiry, value, _ = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            if expiry is not None and expiry < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: Any, tag: Any = None):
+        """
+        Stores a plan, evicting the least recently used ones above maxsize.
+        Args:
+            tag: any value describing the plan, passed to the keep function
+                of copy.
+        """
+        if self.maxsize <= 0:
+            return
+        expiry = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (expiry, value, tag)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def copy(self, keep=None) -> "PlanCache":
+        """
+        Returns a cache with the same settings and counters holding the plans
+        kept by keep, in the same order.
+        Args:
+            keep: function called with the tag of every plan, returning whether
+                the plan is copied. Every plan is copied if None.
+        """
+        cache = PlanCache(self.maxsize, self.ttl)
+        with self._lock:
+            cache.hits, cache.misses = self.hits, self.misses
+            for key, entry in self._data.items():
+                if keep is None or keep(entry[2]):
+                    cache._data[key] = entry
+        return cache
+
+    def clear(self):
+        """
+        Drops every cached plan, the hit and miss counters are kept.
+        """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            stats: a dict with the current size and the hit and miss counters.
+        """
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def plan_key(**params) -> str:
+    """
+    Hashes the parameters a plan depends on into a canonical cache key.
+    Args:
+        params: JSON serializable values. Sets and tuples should already be
+            converted to sorted lists by the caller.
+    Returns:
+        key: a hex digest, identical for identical parameters.
+    """
+    dump = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(dump.encode()).hexdigest()
@@ -0,0 +1,143 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from Metrics import metrics
+
+PLAN_STORE_SIZE_DEFAULT = 10000
+# Seconds a process waits for another one to release the database.
+PLAN_STORE_TIMEOUT = 5.0
+# The last use of a plan is only written back when older than this many seconds,
+# so that hits on popular plans don't serialize on the write lock.
+USE_RESOLUTION = 60.0
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS plans (
+        version TEXT NOT NULL,
+        key TEXT NOT NULL,
+        plan TEXT NOT NULL,
+        used REAL NOT NULL,
+        PRIMARY KEY (version, key)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS plans_used ON plans (used)",
+)
+
+
+class PlanStore(object):
+    def __init__(
+        self, path, maxsize=PLAN_STORE_SIZE_DEFAULT, timeout=PLAN_STORE_TIMEOUT
+    ):
+        """
+        Plans persisted in a SQLite database, shared by every process opening the
+        same file and kept across restarts. Plans are stored under the hash of
+        their request and the version of the data they were computed on, the
+        least recently used ones are evicted above maxsize. The store is a cache:
+        database errors are counted in arkplanner_plan_store_errors_total and
+        treated as misses.
+        Args:
+            path: string. local path of the database, created if missing.
+            maxsize: int. Maximum number of plans kept, all data versions included.
+            timeout: float. Seconds to wait for a lock held by another process.
+        """
+        self.path = path
+        self.maxsize = maxsize
+        self.timeout = timeout
+        # Connections can't be shared between threads or inherited by a fork,
+        # each thread of each process opens its own.
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def __getstate__(self):
+        return {"path": self.path, "maxsize": self.maxsize, "timeout": self.timeout}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["maxsize"], state["timeout"])
+
+    def _connect(self) -> sqlite3.Connection:
+        if getattr(self._local, "pid", None) == os.getpid():
+            return self._local.conn
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        # Readers don't block the writer, nor the writer the readers.
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            conn.execute(statement)
+        self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key: str, version: str) -> Optional[Dict[str, Any]]:
+        """
+        Looks up a plan and marks it as recently used.
+        Args:
+            key: string. Hash of the request.
+            version: string. Version of the data, see MaterialPlanning.data_version.
+        Returns:
+            plan: the stored plan or None on a miss.
+        """
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT plan, used FROM plans WHERE version = ? AND key = ?",
+                (version, key),
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[1] > USE_RESOLUTION:
+                conn.execute(
+                    "UPDATE plans SET used = ? WHERE version = ? AND key = ?",
+                    (now, version, key),
+                )
+            return json.loads(row[0])
+        except sqlite3.Error:
+            metrics.inc("arkplanner_plan_store_errors_total", operation="get")
+            return None
+
+    def put(self, key: str, version: str, plan: Dict[str, Any]):
+        """
+        Stores a plan, evicting the least recently used ones above maxsize.
+        Args:
+            plan: JSON serializable dict.
+        """
+        if self.maxsize <= 0:
+            return
+        dump = json.dumps(plan, ensure_ascii=False, separators=(",", ":"))
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    "INSERT OR REPLACE INTO plans VALUES (?, ?, ?, ?)",
+                    (version, key, dump, time.time()),
+                )
+                conn.execute(
+                    "DELETE FROM plans WHERE rowid IN (SELECT rowid FROM plans "
+                    "ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                    (self.maxsize,),
+                )
+        except sqlite3.Error:
+            metrics.inc("arkplanner_plan_store_errors_total", operation="put")
+
+    def clear(self):
+        """
+        Drops every stored plan, for every process.
+        """
+        conn = self._connect()
+        conn.execute("DELETE FROM plans")
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            stats: a dict with the number of stored plans and of data versions.
+        """
+        conn = self._connect()
+        size, versions = conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT version) FROM plans"
+        ).fetchone()
+        return {"size": size, "maxsize": self.maxsize, "versions": versions}
@@ -0,0 +1,328 @@
+import json
+import os
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Allow development on Windows, where the shared model is unavailable.
+    fcntl = None
+
+SHARED_MODEL_PREFIX_DEFAULT = "arkplanner"
+SHARED_MODEL_LOCK_DEFAULT = "data/model.lock"
+# Arrays start on cache line boundaries.
+_ALIGN = 64
+
+
+class SharedModel(object):
+    def __init__(
+        self,
+        model_cls,
+        prefix=SHARED_MODEL_PREFIX_DEFAULT,
+        lock_path=SHARED_MODEL_LOCK_DEFAULT,
+        **runtime
+    ):
+        """
+        Shares one model between the processes of a server. A single process,
+        the leader, builds the model and publishes it to a shared memory segment,
+        the others attach to it without copying the arrays. Every publication
+        bumps a generation counter stored in a small control segment, readers
+        compare it with the generation they are attached to pick up new models.
+        Args:
+            model_cls: the MaterialPlanning class, used to attach to a segment.
+            prefix: string. Name of the control segment, the model segments are
+                named prefix_generation.
+            lock_path: string. local path of the file locked by the leader.
+            runtime: solver, cache_size and cache_ttl of the attached models,
+                see MaterialPlanning.__init__.
+        """
+        if fcntl is None:
+            raise ImportError("A shared model requires fcntl")
+        self.model_cls = model_cls
+        self.prefix = prefix
+        self.lock_path = lock_path
+        self.runtime = runtime
+        self.generation = 0
+        self.is_leader = False
+        self._lock_file = None
+        self._control = None
+
+    def try_lead(self) -> bool:
+        """
+        Becomes the leader if no other process is. The lock is released by the
+        operating system when the leader exits, another process takes over on
+        its next call.
+        Returns:
+            is_leader: bool.
+        """
+        if self.is_leader:
+            return True
+        if os.path.dirname(self.lock_path):
+            os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        self.is_leader = True
+        return True
+
+    def load(self, build, poll=0.5):
+        """
+        Returns the published model, building and publishing it first if this
+        process becomes the leader and nothing was published yet.
+        Args:
+            build: callable returning a new MaterialPlanning.
+            poll: float. Seconds between two checks while waiting for the leader.
+        Returns:
+            mp: a MaterialPlanning attached to the shared memory.
+        """
+        while True:
+            if self.try_lead():
+                mp = self.attach()
+                if mp is None:
+                    self.publish(build())
+                    mp = self.attach()
+                return mp
+            mp = self.attach()
+            if mp is not None:
+                return mp
+            time.sleep(poll)
+
+    def publish(self, mp):
+        """
+        Copies a model to a new segment and makes it the current generation.
+        The segment of the generation before the previous one is removed,
+        processes still attached to it keep their mapping.
+        Args:
+            mp: MaterialPlanning. The model to share.
+        """
+        if not self.is_leader:
+            raise RuntimeError("Only the leader publishes models")
+        control = self._attach_control(create=True)
+        generation = int(control[0]) + 1
+        name = self._segment_name(generation)
+        try:
+            shm = mp.to_shared_memory(name)
+        except FileExistsError:
+            # Left over from a leader that died before bumping the counter.
+            _unlink(name)
+            shm = mp.to_shared_memory(name)
+        shm.close()
+        control[0] = generation
+        if generation > 2:
+            _unlink(self._segment_name(generation - 2))
+
+    def published_generation(self) -> int:
+        """
+        Returns:
+            generation: int. Generation of the latest published model,
+                0 if none was published yet.
+        """
+        control = self._attach_control()
+        return 0 if control is None else int(control[0])
+
+    def attach(self):
+        """
+        Attaches to the latest published model.
+        Returns:
+            mp: a MaterialPlanning, or None if no model was published yet.
+        """
+        while True:
+            generation = self.published_generation()
+            if generation == 0:
+                return None
+            try:
+                mp = self.model_cls.from_shared_memory(
+                    self._segment_name(generation), **self.runtime
+                )
+            except FileNotFoundError:
+                # Removed by two publications in between, read the counter again.
+                continue
+            self.generation = generation
+            return mp
+
+    def refresh(self):
+        """
+        Checks the generation counter, cheap enough to be called per request.
+        Returns:
+            mp: a MaterialPlanning attached to a newer model, or None if the
+                current one is still the latest.
+        """
+        if self.published_generation() == self.generation:
+            return None
+        return self.attach()
+
+    def _segment_name(self, generation: int) -> str:
+        return "{}_{}".format(self.prefix, generation)
+
+    def _attach_control(self, create=False):
+        """
+        Maps the control segment, which holds the generation counter.
+        Returns:
+            control: an array of one uint64, or None if it doesn't exist yet.
+        """
+        if self._control is None:
+            try:
+                shm = _attach(self.prefix)
+            except FileNotFoundError:
+                if not create:
+                    return None
+                shm = SharedMemory(self.prefix, create=True, size=8)
+                _untrack(shm)
+            self._control = (shm, np.ndarray((1,), dtype=np.uint64, buffer=shm.buf))
+        return self._control[1]
+
+
+def write_segment(
+    name: str, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]
+) -> SharedMemory:
+    """
+    Creates a shared memory segment holding a JSON header followed by the arrays.
+    The segment outlives the process, it has to be removed with _unlink.
+    Args:
+        name: string. Name of the segment.
+        arrays: a dict of numpy arrays, object arrays aren't supported.
+        meta: a JSON serializable dict stored in the header.
+    Returns:
+        shm: the SharedMemory of the segment.
+    Raises:
+        FileExistsError: if a segment with that name already exists.
+    """
+    header, size = _layout(arrays, meta)
+    shm = SharedMemory(name, create=True, size=size)
+    _untrack(shm)
+    _fill(shm.buf, header, arrays)
+    return shm
+
+
+def read_segment(
+    name: str,
+) -> Tuple[SharedMemory, Dict[str, np.ndarray], Dict[str, Any]]:
+    """
+    Attaches to a segment created by write_segment.
+    Args:
+        name: string. Name of the segment.
+    Returns:
+        shm: the SharedMemory of the segment, it must be kept alive with the arrays.
+        arrays: a dict of read-only numpy arrays backed by the segment.
+        meta: dictionary. The meta passed to write_segment.
+    Raises:
+        FileNotFoundError: if the segment doesn't exist.
+    """
+    shm = _attach(name)
+    arrays, meta = _views(shm.buf)
+    return shm, arrays, meta
+
+
+def write_segment_file(path: str, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]):
+    """
+    Writes a file holding what write_segment would store in a segment.
+    Args:
+        path: string. local path of the file.
+        See write_segment for the other arguments.
+    """
+    header, size = _layout(arrays, meta)
+    buf = bytearray(size)
+    _fill(memoryview(buf), header, arrays)
+    with open(path, "wb") as f:
+        f.write(buf)
+
+
+def read_segment_file(path: str) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """
+    Reads a file written by write_segment_file, in a single read.
+    Args:
+        path: string. local path of the file.
+    Returns:
+        arrays: a dict of read-only numpy arrays backed by the content of the file.
+        meta: dictionary. The meta passed to write_segment_file.
+    Raises:
+        ValueError: if the file isn't a complete segment.
+    """
+    with open(path, "rb") as f:
+        return _views(f.read())
+
+
+def _layout(arrays: Dict[str, np.ndarray], meta: Dict[str, Any]) -> Tuple[bytes, int]:
+    """
+    Returns:
+        header: bytes. The JSON header of a segment holding the arrays, with the
+            offset, dtype and shape of every array.
+        size: int. Size of the segment in bytes.
+    """
+    layout = {}
+    offset = 0
+    for key, array in arrays.items():
+        array = np.asarray(array)
+        layout[key] = [offset, array.dtype.str, list(array.shape)]
+        offset += -(-array.nbytes // _ALIGN) * _ALIGN
+    header = json.dumps({"meta": meta, "arrays": layout}, ensure_ascii=False).encode()
+    data_offset = -(-(8 + len(header)) // _ALIGN) * _ALIGN
+    return header, data_offset + max(offset, 1)
+
+
+def _fill(buf, header: bytes, arrays: Dict[str, np.ndarray]):
+    """
+    Writes the header returned by _layout and the arrays to the buffer of a segment.
+    """
+    buf[:8] = np.uint64(len(header)).tobytes()
+    buf[8 : 8 + len(header)] = header
+    data_offset = -(-(8 + len(header)) // _ALIGN) * _ALIGN
+    for key, (start, dtype, shape) in json.loads(header)["arrays"].items():
+        view = np.ndarray(shape, dtype=dtype, buffer=buf, offset=data_offset + start)
+        view[...] = arrays[key]
+        del view
+
+
+def _views(buf) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """
+    Returns the read-only arrays backed by the buffer of a segment and its meta.
+    """
+    if len(buf) < 8:
+        raise ValueError("Truncated segment header")
+    header_size = int(np.frombuffer(buf[:8], dtype=np.uint64)[0])
+    if 8 + header_size > len(buf):
+        raise ValueError("Truncated segment header")
+    header = json.loads(bytes(buf[8 : 8 + header_size]))
+    data_offset = -(-(8 + header_size) // _ALIGN) * _ALIGN
+
+    arrays = {}
+    for key, (start, dtype, shape) in header["arrays"].items():
+        dtype = np.dtype(dtype)
+        if data_offset + start + dtype.itemsize * int(np.prod(shape)) > len(buf):
+            raise ValueError("Truncated segment array {}".format(key))
+        array = np.ndarray(shape, dtype=dtype, buffer=buf, offset=data_offset + start)
+        array.flags.writeable = False
+        arrays[key] = array
+    return arrays, header["meta"]
+
+
+def _attach(name: str) -> SharedMemory:
+    shm = SharedMemory(name)
+    _untrack(shm)
+    return shm
+
+
+def _untrack(shm: SharedMemory):
+    # The resource tracker would remove the segment when this process exits,
+    # while the other processes still rely on it.
+    resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore
+
+
+def _unlink(name: str):
+    try:
+        shm = _attach(name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    # unlink registers nothing but unregisters the segment again.
+    resource_tracker.register(shm._name, "shared_memory")  # type: ignore
+    shm.unlink()
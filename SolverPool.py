@@ -0,0 +1,218 @@
+import asyncio
+import functools
+import os
+import pickle
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from Metrics import metrics
+
+EXECUTOR_KINDS = ["process", "thread", "inline"]
+EXECUTOR_DEFAULT = "process"
+
+# Model of the current worker process and the version of the pool's model it
+# is, set by _init_worker and replaced by _load_model.
+_worker_mp = None
+_worker_version = 0
+
+
+class PoolFullError(Exception):
+    """
+    Raised when a plan is submitted while max_pending plans are already
+    queued or being solved.
+    """
+
+
+class StaleModelError(Exception):
+    """
+    Raised by a process worker called with a newer version of the model than
+    the one it holds.
+    """
+
+
+class SolverPool(object):
+    def __init__(self, mp, kind=EXECUTOR_DEFAULT, workers=None, max_pending=None):
+        """
+        Runs MaterialPlanning.get_plan off the event loop.
+        Args:
+            mp: MaterialPlanning. The model every worker is preloaded with.
+            kind: string. One of EXECUTOR_KINDS. "process" solves in a pool of
+                processes each holding a copy of mp, "thread" solves in a pool of
+                threads sharing mp and "inline" solves on the event loop.
+            workers: int or None. Number of workers, defaults to the CPU count.
+            max_pending: int or None. Number of plans that may be queued or
+                solving at once before PoolFullError is raised.
+                Defaults to four plans per worker.
+        """
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError(
+                "Unknown executor {}, expected one of {}".format(kind, EXECUTOR_KINDS)
+            )
+        self.mp = mp
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4
+        self.pending = 0
+        # Version of mp, the version it was patched from or None and mp pickled,
+        # sent to the process workers still holding an older model.
+        self._update = (0, None, None)
+        # Model process workers start with, read when they are started.
+        self._initial = [mp, 0]
+        self._executor = self._create_executor()
+
+    def _create_executor(self) -> Optional[Executor]:
+        if self.kind == "process":
+            return ProcessPoolExecutor(
+                self.workers, initializer=_init_worker, initargs=(self._initial,)
+            )
+        if self.kind == "thread":
+            return ThreadPoolExecutor(self.workers)
+        return None
+
+    def swap(self, mp):
+        """
+        Replaces the model plans are solved with. Plans already submitted finish
+        on the previous model, unless a process worker loaded the new one first.
+        Process workers load the new model on their next call, if mp was patched
+        from the previous model (see MaterialPlanning.refreshed) they keep the
+        plans they cached that the patch left valid.
+        Args:
+            mp: MaterialPlanning. The new model.
+        """
+        if self.kind == "process":
+            version = self._update[0] + 1
+            patched = bool(mp.changes and mp.changes.get("patched"))
+            self._update = (
+                version,
+                version - 1 if patched else None,
+                pickle.dumps(mp, pickle.HIGHEST_PROTOCOL),
+            )
+            self._initial[:] = [mp, version]
+        self.mp = mp
+
+    async def get_plan(self, **kwargs) -> Dict[str, Any]:
+        """
+        Computes a plan on a worker, see MaterialPlanning.get_plan for the arguments.
+        Raises:
+            PoolFullError: if max_pending plans are already in flight.
+        """
+        return await self._run("get_plan", kwargs)
+
+    async def get_plans(self, batch) -> List[Any]:
+        """
+        Computes a batch of plans on a single worker, see MaterialPlanning.get_plans.
+        Raises:
+            PoolFullError: if max_pending plans are already in flight.
+        """
+        return await self._run("get_plans", {"batch": batch})
+
+    async def sweep(self, **kwargs) -> List[Any]:
+        """
+        Computes the plans of a parameter sweep on a single worker, see
+        MaterialPlanning.sweep for the arguments.
+        Raises:
+            PoolFullError: if max_pending plans are already in flight.
+        """
+        return await self._run("sweep", kwargs)
+
+    async def pareto(self, **kwargs) -> List[Dict[str, Any]]:
+        """
+        Computes the plans of a Pareto frontier on a single worker, see
+        MaterialPlanning.pareto for the arguments.
+        Raises:
+            PoolFullError: if max_pending plans are already in flight.
+        """
+        return await self._run("pareto", kwargs)
+
+    async def item_values(self, **kwargs) -> Dict[str, Any]:
+        """
+        Values of the materials, see MaterialPlanning.item_values for the
+        arguments. Read from the pool's model once it solved them, see
+        MaterialPlanning.precompute_item_values, solved on a worker otherwise.
+        Raises:
+            PoolFullError: if the values have to be solved and max_pending plans
+                are already in flight.
+        """
+        flags = {name: value for name, value in kwargs.items() if name != "language"}
+        if self.mp.has_item_values(**flags):
+            return self.mp.item_values(**kwargs)
+        return await self._run("item_values", kwargs)
+
+    async def _run(self, method: str, kwargs: Dict[str, Any]) -> Any:
+        if self.pending >= self.max_pending:
+            raise PoolFullError("{} plans are already pending".format(self.pending))
+        self.pending += 1
+        try:
+            # Read once so that a concurrent swap can't pair the new model
+            # with the previous version.
+            mp, update, executor = self.mp, self._update, self._executor
+            if executor is None:
+                return getattr(mp, method)(**kwargs)
+            loop = asyncio.get_event_loop()
+            if self.kind != "process":
+                func = functools.partial(getattr(mp, method), **kwargs)
+                return await loop.run_in_executor(executor, func)
+            func = functools.partial(_worker_call, method, kwargs, update[0])
+            try:
+                res = await loop.run_in_executor(executor, func)
+            except StaleModelError:
+                # The model is only sent along once a worker asks for it.
+                res = await loop.run_in_executor(
+                    executor, functools.partial(func, update=update)
+                )
+            # Workers record their metrics in their own registry.
+            res, worker_metrics = res
+            metrics.merge(worker_metrics)
+            return res
+        finally:
+            self.pending -= 1
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+
+def _init_worker(initial):
+    global _worker_mp, _worker_version
+    _worker_mp, _worker_version = initial
+    # A forked worker starts with a copy of the server's metrics, which must not
+    # be sent back to it.
+    metrics.drain()
+
+
+def _load_model(version: int, base_version: Optional[int], dump: bytes):
+    """
+    Replaces the model of the worker, keeping its cached plans if the new model
+    was patched from it.
+    """
+    global _worker_mp, _worker_version
+    mp = pickle.loads(dump)
+    if base_version is not None and base_version == _worker_version:
+        mp.keep_plans(_worker_mp)
+    _worker_mp, _worker_version = mp, version
+
+
+def _worker_call(method: str, kwargs: Dict[str, Any], version: int, update=None):
+    """
+    Args:
+        version: int. Version of the pool's model the call is meant for.
+        update: the version, base version and pickle of the pool's model, see
+            SolverPool._update, or None.
+    Returns:
+        res: the result of the call.
+        metrics: the metrics recorded by this worker since its last call,
+            those of a call that raised are returned with the next one.
+    Raises:
+        StaleModelError: if the worker holds an older model and update is None.
+    """
+    # A worker already holding a newer model solves with it.
+    if version > _worker_version:
+        if update is None:
+            raise StaleModelError(
+                "Worker holds version {} of the model, not {}".format(
+                    _worker_version, version
+                )
+            )
+        _load_model(*update)
+    res = getattr(_worker_mp, method)(**kwargs)
+    return res, metrics.drain()
@@ -0,0 +1,150 @@
+import threading
+from typing import Any, Tuple
+
+import numpy as np
+
+try:
+    import highspy  # type: ignore
+except ImportError:
+    # Installed from requirements.txt, MaterialPlanning falls back to linprog
+    # without it.
+    highspy = None
+
+
+class WarmSolver(object):
+    def __init__(self, A_ub, cost: np.ndarray, n_stages: int):
+        """
+        Keeps one HiGHS instance loaded with a planning LP so that consecutive
+        solves only change the demand vector (and the excluded stages) and
+        re-optimize from the previous optimal basis with the dual simplex.
+        Args:
+            A_ub: sparse matrix of shape [n_items, n_stages + n_rules].
+                Negated production matrix, as stored in LPTemplate.
+            cost: array of shape [n_stages + n_rules]. Objective of the problem.
+            n_stages: int. Number of leading columns that are stages.
+        """
+        if highspy is None:
+            raise ImportError("highspy is required for warm-started solves")
+        A = (-A_ub).tocsc()
+        self.n_items, self.n_vars = A.shape
+        self.n_stages = n_stages
+        self._stage_idx = np.arange(n_stages, dtype=np.int32)
+        # Demand the rows currently hold, only the changed ones are sent to HiGHS.
+        self._row_lower = np.zeros(self.n_items)
+        self._lock = threading.Lock()
+
+        lp = highspy.HighsLp()
+        lp.num_col_ = self.n_vars
+        lp.num_row_ = self.n_items
+        lp.col_cost_ = np.asarray(cost, dtype=float)
+        lp.col_lower_ = np.zeros(self.n_vars)
+        lp.col_upper_ = np.full(self.n_vars, highspy.kHighsInf)
+        lp.row_lower_ = np.zeros(self.n_items)
+        lp.row_upper_ = np.full(self.n_items, highspy.kHighsInf)
+        lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+        lp.a_matrix_.start_ = A.indptr.astype(np.int32)
+        lp.a_matrix_.index_ = A.indices.astype(np.int32)
+        lp.a_matrix_.value_ = A.data.astype(float)
+
+        self._highs = highspy.Highs()
+        self._highs.setOptionValue("output_flag", False)
+        self._highs.passModel(lp)
+
+    def set_cost(self, cost: np.ndarray):
+        """
+        Replaces the objective, the next solve starts from the current basis.
+        Args:
+            cost: array of shape [n_stages + n_rules].
+        """
+        with self._lock:
+            self._highs.changeColsCost(
+                self.n_vars,
+                np.arange(self.n_vars, dtype=np.int32),
+                np.asarray(cost, dtype=float),
+            )
+
+    def set_coefficients(self, rows, cols, values):
+        """
+        Replaces entries of the production matrix (not negated), the next solve
+        starts from the current basis.
+        Args:
+            rows: array of item indices.
+            cols: array of stage or rule indices.
+            values: array of the new entries.
+        """
+        with self._lock:
+            for row, col, value in zip(rows, cols, values):
+                self._highs.changeCoeff(int(row), int(col), float(value))
+
+    def solve(self, demand_lst, stage_idx=None) -> Tuple[Any, Any, int]:
+        """
+        Solves the loaded LP for a new demand vector, reusing the basis of the
+        previous solve.
+        Args:
+            demand_lst: list of materials demand. Should include all items.
+            stage_idx: array of the indices of the stages allowed in the plan.
+                All stages are considered if None.
+        Returns:
+            x: array of the stage clear times followed by the crafting times,
+                restricted to stage_idx. None if no solution was found.
+            y: array of the value of each item. None if no solution was found.
+            status: int. The status code linprog would have returned.
+        """
+        stage_upper = np.full(self.n_stages, highspy.kHighsInf)
+        if stage_idx is not None:
+            stage_upper[:] = 0
+            stage_upper[stage_idx] = highspy.kHighsInf
+
+        with self._lock:
+            h = self._highs
+            self._set_demand(np.asarray(demand_lst, dtype=float))
+            h.changeColsBounds(
+                self.n_stages, self._stage_idx, np.zeros(self.n_stages), stage_upper
+            )
+            h.run()
+            status = _linprog_status(h.getModelStatus())
+            if status != 0:
+                # Start the next request from scratch rather than from a basis
+                # that did not lead anywhere.
+                h.clearSolver()
+                return None, None, status
+            solution = h.getSolution()
+            x = np.array(solution.col_value)
+            y = np.array(solution.row_dual)
+
+        if stage_idx is not None:
+            x = np.hstack([x[stage_idx], x[self.n_stages :]])
+        return x, y, status
+
+    def _set_demand(self, demand: np.ndarray):
+        rows = np.flatnonzero(demand != self._row_lower).astype(np.int32)
+        if hasattr(self._highs, "changeRowsBounds"):
+            self._highs.changeRowsBounds(
+                len(rows), rows, demand[rows], np.full(len(rows), highspy.kHighsInf)
+            )
+        else:
+            # highspy 1.11, the last release for Python 3.8, has no batch setter.
+            for row in rows:
+                self._highs.changeRowBounds(int(row), demand[row], highspy.kHighsInf)
+        self._row_lower = demand.copy()
+
+
+def _linprog_status(model_status) -> int:
+    """
+    Maps a HighsModelStatus to the status codes used by scipy's linprog.
+    """
+    if model_status == highspy.HighsModelStatus.kOptimal:
+        return 0
+    if model_status in (
+        highspy.HighsModelStatus.kIterationLimit,
+        highspy.HighsModelStatus.kTimeLimit,
+    ):
+        return 1
+    if model_status == highspy.HighsModelStatus.kInfeasible:
+        return 2
+    if model_status in (
+        highspy.HighsModelStatus.kUnbounded,
+        highspy.HighsModelStatus.kUnboundedOrInfeasible,
+    ):
+        return 3
+    return 4
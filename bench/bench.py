@@ -0,0 +1,438 @@
+"""
+Benchmarks planning latency and throughput on the checked-in fixtures, without
+any network access. Run from the repository root:
+
+    python bench/bench.py --out results.json
+    python bench/bench.py --http --out results.json --compare baseline.json
+
+Every benchmark reports the p50/p95/p99 latencies in milliseconds and the number
+of calls per second. The results are saved as JSON together with the versions
+they were measured with so that builds can be compared.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import scipy
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import MaterialPlanning as planning  # noqa: E402
+from MaterialPlanning import DEFAULT_SOLVER, SOLVERS, MaterialPlanning  # noqa: E402
+
+FIXTURES_DEFAULT = os.path.join(REPO, "bench", "fixtures")
+
+
+def read_requirements(path: str) -> Dict[str, int]:
+    """
+    Reads a requirement file in the format of required.txt, "name count" per line.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        dct = {}
+        for line in f:
+            if line.strip():
+                name, count = line.rsplit(" ", 1)
+                dct[name] = int(count)
+    return dct
+
+
+def plan_profiles() -> Dict[str, Dict[str, Any]]:
+    """
+    Representative get_plan arguments, named after what they exercise.
+    """
+    e2 = read_requirements(os.path.join(REPO, "required.txt"))
+    return {
+        "single": {"requirement_dct": {"30014": 10}},
+        "e2": {"requirement_dct": e2},
+        "e2_exclude": {"requirement_dct": e2, "exclude": ["1-7", "S4-1", "S5-2"]},
+        "e2_non_cn_compat": {"requirement_dct": e2, "non_cn_compat": True},
+        "e2_extra_outc": {
+            "requirement_dct": e2,
+            "outcome": True,
+            "exp_demand": True,
+            "gold_demand": False,
+        },
+    }
+
+
+def http_profiles() -> List[Dict[str, Any]]:
+    """
+    /plan request bodies matching plan_profiles.
+    """
+    e2 = read_requirements(os.path.join(REPO, "required_en.txt"))
+    return [
+        {"required": {"Orirock Concentration": 10}},
+        {"required": e2},
+        {"required": e2, "exclude": ["1-7", "S4-1", "S5-2"]},
+        {"required": e2, "non_cn_compat": True},
+        {"required": e2, "extra_outc": True, "exp_demand": True, "gold_demand": False},
+    ]
+
+
+def summarize(samples: List[float], elapsed=None) -> Dict[str, float]:
+    """
+    Args:
+        samples: list of latencies in seconds.
+        elapsed: float or None. Wall time the samples were taken in,
+            their sum if None (sequential calls).
+    Returns:
+        summary: a dict with the number of samples, the mean and percentile
+            latencies in milliseconds and the throughput per second.
+    """
+    ms = np.asarray(samples) * 1000
+    elapsed = float(np.sum(samples)) if elapsed is None else elapsed
+    return {
+        "n": len(samples),
+        "mean": float(ms.mean()),
+        "p50": float(np.percentile(ms, 50)),
+        "p95": float(np.percentile(ms, 95)),
+        "p99": float(np.percentile(ms, 99)),
+        "per_s": len(samples) / elapsed if elapsed > 0 else float("inf"),
+    }
+
+
+def measure(func: Callable[[], Any], repeat: int, setup=None) -> Dict[str, float]:
+    """
+    Calls func repeat times after one warm-up call.
+    Args:
+        setup: callable or None. Called before each call, outside of the timing.
+    """
+    if setup is not None:
+        setup()
+    func()
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        stt = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - stt)
+    return summarize(samples)
+
+
+def prepare_data(fixtures: str, data_dir: str) -> Dict[str, str]:
+    """
+    Copies the stats and rules to data_dir, where models may save their snapshot.
+    Returns:
+        paths: MaterialPlanning.__init__ arguments reading the copied data.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    for name in ("matrix.json", "formula.json"):
+        shutil.copy(os.path.join(fixtures, name), os.path.join(data_dir, name))
+    return {
+        "path_stats": os.path.join(data_dir, "matrix.json"),
+        "path_rules": os.path.join(data_dir, "formula.json"),
+        "path_snapshot": os.path.join(data_dir, "model.snapshot"),
+        "gamedata_path": "file://"
+        + os.path.join(os.path.abspath(fixtures), "item_table_{}.json"),
+    }
+
+
+def bench_model(args, paths: Dict[str, str]) -> Dict[str, Dict[str, float]]:
+    results = {}
+
+    def remove_snapshot():
+        if os.path.exists(paths["path_snapshot"]):
+            os.remove(paths["path_snapshot"])
+
+    def build():
+        return MaterialPlanning(dont_save_data=False, solver=args.solver, **paths)
+
+    results["init_data"] = measure(build, args.init_repeat, setup=remove_snapshot)
+    results["init_snapshot"] = measure(build, args.init_repeat)
+
+    mp = MaterialPlanning(
+        dont_save_data=False, solver=args.solver, cache_size=0, **paths
+    )
+    # update fetches from penguin_url, point it at the fixtures.
+    planning.penguin_url = "file://" + os.path.abspath(args.fixtures) + "/"
+    update_kwargs = {
+        "url_stats": "matrix.json",
+        "url_rules": "formula.json",
+        "gamedata_path": paths["gamedata_path"],
+        "dont_save_data": True,
+    }
+    results["update_unchanged"] = measure(
+        lambda: mp.update(**update_kwargs), args.init_repeat
+    )
+
+    def forget_validators():
+        mp.validators = {"stats": {}, "rules": {}, "items": {}}
+
+    results["update_rebuild"] = measure(
+        lambda: mp.update(**update_kwargs), args.init_repeat, setup=forget_validators
+    )
+
+    def forget_stats_validators():
+        mp.validators["stats"] = {}
+
+    # Same stages, items and rules: the changed cells are patched.
+    results["update_patch"] = measure(
+        lambda: mp.update(**update_kwargs),
+        args.init_repeat,
+        setup=forget_stats_validators,
+    )
+
+    for name, path, fuzzy in (
+        ("convert_zh", "required.txt", False),
+        ("convert_en", "required_en.txt", False),
+        ("convert_id", "required_id.txt", False),
+        ("convert_fuzzy", "required_en.txt", True),
+    ):
+        dct = read_requirements(os.path.join(REPO, path))
+        if fuzzy:
+            dct = {key.lower(): value for key, value in dct.items()}
+        results[name] = measure(
+            lambda: mp.convert_requirements(dct, fuzzy=fuzzy), args.repeat * 10
+        )
+
+    for name, kwargs in plan_profiles().items():
+        results["plan_" + name] = measure(
+            lambda: mp.get_plan(print_output=False, **kwargs), args.repeat
+        )
+        results["plan_{}_presolve".format(name)] = measure(
+            lambda: mp.get_plan(print_output=False, presolve=True, **kwargs),
+            args.repeat,
+        )
+
+    mp.plan_cache.maxsize = 16
+    results["plan_e2_cached"] = measure(
+        lambda: mp.get_plan(print_output=False, **plan_profiles()["e2"]),
+        args.repeat * 10,
+    )
+    return results
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(fixtures: str, workdir: str, solver: str):
+    """
+    Starts server.py on a free port, working in workdir so that it reads the data
+    and a snapshot built from the fixtures from workdir/data instead of
+    downloading them.
+    Returns:
+        process: the server subprocess.
+        url: string. url of the /plan endpoint.
+    """
+    paths = prepare_data(fixtures, os.path.join(workdir, "data"))
+    MaterialPlanning(dont_save_data=False, solver=solver, **paths)
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=REPO)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "sanic", "server.app", "--host", "127.0.0.1"]
+        + ["--port", str(port)],
+        cwd=workdir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    return process, "http://127.0.0.1:{}/plan".format(port)
+
+
+async def wait_ready(url: str, process=None, timeout=60.0):
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    async with planning.async_http_client(timeout=5) as client:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(
+                    "The server exited with {}".format(process.returncode)
+                )
+            try:
+                await client.post(url, json=http_profiles()[0])
+                return
+            except (OSError, httpx.HTTPError):
+                # Refused connections raise an OSError up to httpx 0.9.
+                await asyncio.sleep(0.2)
+    raise RuntimeError("The server didn't start within {}s".format(timeout))
+
+
+async def load_test(
+    url: str, bodies: List[Dict[str, Any]], n_requests: int, concurrency: int
+) -> Dict[str, float]:
+    """
+    Sends n_requests POST requests, concurrency at a time, cycling through bodies.
+    """
+    samples, errors = [], 0
+    queue = iter(range(n_requests))
+
+    async def worker(client):
+        nonlocal errors
+        for i in queue:
+            stt = time.perf_counter()
+            res = await client.post(url, json=bodies[i % len(bodies)])
+            samples.append(time.perf_counter() - stt)
+            if res.status_code != 200 or "error" in res.json():
+                errors += 1
+
+    async with planning.async_http_client(120, concurrency) as client:
+        stt = time.perf_counter()
+        await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - stt
+    summary = summarize(samples, elapsed)
+    summary["errors"] = errors
+    return summary
+
+
+async def count_misses(url: str) -> int:
+    """
+    Returns:
+        misses: the number of plans computed without the plan cache or the plan
+            store by the server worker serving url, read from /metrics.
+    """
+    metrics_url = url.rsplit("/", 1)[0] + "/metrics"
+    async with planning.async_http_client(timeout=30) as client:
+        res = await client.get(metrics_url)
+    for line in res.text.splitlines():
+        if line.startswith('arkplanner_plans_total{cache="miss"}'):
+            return int(float(line.split()[-1]))
+    return 0
+
+
+def bench_http(args) -> Dict[str, Dict[str, float]]:
+    process, workdir = None, None
+    url = args.url
+    if url is None:
+        workdir = tempfile.mkdtemp(prefix="arkplanner-bench-")
+        process, url = start_server(args.fixtures, workdir, args.solver)
+    try:
+        asyncio.run(wait_ready(url, process))
+        profiles = http_profiles()
+        # Raise a required quantity by a different amount in every request so
+        # that each of them misses the plan cache.
+        unique = []
+        for i, body in enumerate(profiles * (args.requests // len(profiles) + 1)):
+            required = dict(body["required"])
+            key = next(iter(required))
+            required[key] += i + 1
+            unique.append(dict(body, required=required))
+        misses = asyncio.run(count_misses(url))
+        results = {
+            "http_plan": asyncio.run(
+                load_test(url, unique, args.requests, args.concurrency)
+            )
+        }
+        misses = asyncio.run(count_misses(url)) - misses
+        # A server started here has a single worker which saw every request,
+        # the workers behind --url may be several.
+        expected = args.requests if args.url is None else 1
+        if misses < expected:
+            raise RuntimeError(
+                "Expected {} plan cache misses, got {}".format(expected, misses)
+            )
+        results["http_plan_cached"] = asyncio.run(
+            load_test(url, profiles, args.requests, args.concurrency)
+        )
+        return results
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def build_info(args) -> Dict[str, Any]:
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO,
+            stderr=subprocess.DEVNULL,
+        )
+        commit = commit.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "machine": platform.machine(),
+        "solver": args.solver,
+        "fixtures": os.path.relpath(args.fixtures, REPO),
+    }
+
+
+def print_results(results, baseline=None):
+    header = "{:<32}{:>7}{:>10}{:>10}{:>10}{:>10}".format(
+        "benchmark", "n", "p50 ms", "p95 ms", "p99 ms", "per s"
+    )
+    if baseline is not None:
+        header += "{:>10}".format("p50 diff")
+    print(header)
+    for name, res in results.items():
+        line = "{:<32}{:>7}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.1f}".format(
+            name, res["n"], res["p50"], res["p95"], res["p99"], res["per_s"]
+        )
+        if baseline is not None and name in baseline:
+            line += "{:>+9.1f}%".format((res["p50"] / baseline[name]["p50"] - 1) * 100)
+        if res.get("errors"):
+            # Failed requests, e.g. 503 once the solver pool is full.
+            line += "  ({} errors)".format(res["errors"])
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--fixtures", default=FIXTURES_DEFAULT)
+    parser.add_argument("--solver", default=DEFAULT_SOLVER, choices=SOLVERS)
+    parser.add_argument(
+        "--repeat", type=int, default=50, help="get_plan calls per profile"
+    )
+    parser.add_argument(
+        "--init-repeat", type=int, default=5, help="model builds and updates"
+    )
+    parser.add_argument(
+        "--http", action="store_true", help="load test the /plan endpoint"
+    )
+    parser.add_argument(
+        "--url", help="/plan url of a running server, one is started if missing"
+    )
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--skip-model", action="store_true")
+    parser.add_argument("--out", help="path of the JSON results")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    args = parser.parse_args()
+    if args.url is not None:
+        args.http = True
+
+    results = {}
+    if not args.skip_model:
+        workdir = tempfile.mkdtemp(prefix="arkplanner-bench-")
+        try:
+            results.update(bench_model(args, prepare_data(args.fixtures, workdir)))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if args.http:
+        results.update(bench_http(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"build": build_info(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
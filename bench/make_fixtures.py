@@ -0,0 +1,211 @@
+"""
+Generates the synthetic penguin-stats and game data fixtures the benchmarks run on.
+The output is deterministic, the checked-in fixtures only need to be regenerated
+when the generator changes:
+
+    python bench/make_fixtures.py [out_dir]
+"""
+
+import json
+import os
+import random
+import sys
+
+# (id, zh_CN, en_US, ja_JP, ko_KR)
+ITEMS = [
+    ("2001", "基础作战记录", "Drill Battle Record", "初級作戦記録", "기초작전기록"),
+    ("2002", "初级作战记录", "Frontline Battle Record", "中級作戦記録", "초급작전기록"),
+    ("2003", "中级作战记录", "Tactical Battle Record", "上級作戦記録", "중급작전기록"),
+    ("2004", "高级作战记录", "Strategic Battle Record", "特級作戦記録", "고급작전기록"),
+    ("3003", "赤金", "Pure Gold", "純金", "순금"),
+    ("30011", "源岩", "Orirock", "源岩", "원암"),
+    ("30012", "固源岩", "Orirock Cube", "固源岩", "원암 큐브"),
+    ("30013", "固源岩组", "Orirock Cluster", "固源岩の塊", "원암 큐브 묶음"),
+    ("30014", "提纯源岩", "Orirock Concentration", "精製源岩", "정제원암"),
+    ("30021", "代糖", "Sugar Substitute", "ブドウ糖", "대체당"),
+    ("30022", "糖", "Sugar", "ブドウ糖パック", "포도당"),
+    ("30023", "糖组", "Sugar Pack", "糖の塊", "포도당 팩"),
+    ("30024", "糖聚块", "Sugar Lump", "糖凝集体", "포도당 덩어리"),
+    ("30031", "酯原料", "Ester", "エステル原料", "에스테르 원료"),
+    ("30032", "聚酸酯", "Polyester", "ポリエステル", "폴리에스테르"),
+    ("30033", "聚酸酯组", "Polyester Pack", "ポリエステルパック", "폴리에스테르 팩"),
+    ("30034", "聚酸酯块", "Polyester Lump", "ポリエステル塊", "폴리에스테르 덩어리"),
+    ("30041", "异铁碎片", "Oriron Shard", "異鉄の欠片", "이철 조각"),
+    ("30042", "异铁", "Oriron", "異鉄", "이철"),
+    ("30043", "异铁组", "Oriron Cluster", "異鉄の塊", "이철 팩"),
+    ("30044", "异铁块", "Oriron Block", "異鉄ブロック", "이철 덩어리"),
+    ("30051", "双酮", "Diketon", "ケトン原料", "케톤"),
+    ("30052", "酮凝集", "Polyketon", "アケトン", "폴리케톤"),
+    ("30053", "酮凝集组", "Aketon", "アケトン試剤", "케톤 응집체"),
+    ("30054", "酮阵列", "Keton Colloid", "ケトンコロイド", "케톤 콜로이드"),
+    ("30061", "破损装置", "Damaged Device", "破損装置", "손상된 장치"),
+    ("30062", "装置", "Device", "装置", "장치"),
+    ("30063", "全新装置", "Integrated Device", "新品装置", "새 장치"),
+    ("30064", "改量装置", "Optimized Device", "改良装置", "개량 장치"),
+    ("30073", "扭转醇", "Loxic Kohl", "ロキシック", "록식 콜"),
+    ("30074", "白马醇", "White Horse Kohl", "白馬醇", "백마 콜"),
+    ("30083", "轻锰矿", "Manganese Ore", "マンガン鉱", "망간"),
+    ("30084", "三水锰矿", "Manganese Trihydrate", "三水マンガン鉱", "망간 중합체"),
+    ("30093", "研磨石", "Grindstone", "砥石", "연마석"),
+    ("30094", "五水研磨石", "Grindstone Pentahydrate", "五水砥石", "5수 연마석"),
+    ("30103", "RMA70-12", "RMA70-12", "RMA70-12", "RMA70-12"),
+    ("30104", "RMA70-24", "RMA70-24", "RMA70-24", "RMA70-24"),
+    ("30115", "聚合剂", "Polymerization Preparation", "重合剤", "중합제"),
+    ("30125", "双极纳米片", "Bipolar Nanoflake", "ナノフレーク", "나노플레이크"),
+    ("30135", "D32钢", "D32 Steel", "D32鋼", "D32강"),
+]
+LANGS = {"zh_CN": 1, "en_US": 2, "ja_JP": 3, "ko_KR": 4}
+NAME = {item[0]: item[1] for item in ITEMS}
+
+# (target, {ingredient: count}, gold)
+FORMULAS = [
+    ("30012", {"30011": 3}, 0),
+    ("30013", {"30012": 5}, 200),
+    ("30014", {"30013": 4}, 300),
+    ("30022", {"30021": 3}, 0),
+    ("30023", {"30022": 4}, 200),
+    ("30024", {"30023": 2, "30042": 1, "30062": 1}, 300),
+    ("30032", {"30031": 3}, 0),
+    ("30033", {"30032": 4}, 200),
+    ("30034", {"30033": 2, "30012": 1, "30022": 1}, 300),
+    ("30042", {"30041": 3}, 0),
+    ("30043", {"30042": 4}, 200),
+    ("30044", {"30043": 2, "30032": 1, "30063": 1}, 300),
+    ("30052", {"30051": 3}, 0),
+    ("30053", {"30052": 4}, 200),
+    ("30054", {"30053": 2, "30022": 1, "30093": 1}, 300),
+    ("30062", {"30061": 3}, 0),
+    ("30063", {"30062": 4}, 200),
+    ("30064", {"30063": 1, "30013": 2, "30083": 1}, 300),
+    ("30073", {"30023": 1, "30033": 1, "30043": 1}, 200),
+    ("30074", {"30073": 1, "30023": 1, "30093": 1}, 300),
+    ("30083", {"30033": 2, "30013": 1, "30053": 1}, 200),
+    ("30084", {"30083": 2, "30033": 1, "30073": 1}, 300),
+    ("30093", {"30043": 1, "30063": 1, "30013": 1}, 200),
+    ("30094", {"30093": 1, "30043": 1, "30063": 1}, 300),
+    ("30103", {"30013": 2, "30093": 1, "30023": 1}, 200),
+    ("30104", {"30103": 1, "30013": 2, "30053": 1}, 300),
+    ("30115", {"30044": 1, "30014": 1, "30054": 1}, 400),
+    ("30125", {"30064": 1, "30074": 2}, 400),
+    ("30135", {"30084": 1, "30094": 1, "30104": 1}, 400),
+]
+
+FARMABLE = [i[0] for i in ITEMS if len(i[0]) == 5 and i[0][-1] in "123"]
+RARE = [i[0] for i in ITEMS if len(i[0]) == 5 and i[0][-1] == "4"]
+
+
+def make_stages(rng):
+    stages = []
+    for chapter in range(0, 8):
+        for num in range(1, 11):
+            stages.append(("%d-%d" % (chapter, num), 6 + chapter * 2 + num // 4))
+    for chapter in range(2, 8):
+        for num in range(1, 11):
+            stages.append(("S%d-%d" % (chapter, num), 8 + chapter * 2 + num // 4))
+    for num in range(1, 7):
+        stages.append(("GT-%d" % num, 10 + num))
+    for chapter in ("CE", "LS", "AP"):
+        for num in range(1, 6):
+            stages.append(("%s-%d" % (chapter, num), 10 * num))
+    return stages
+
+
+def make_matrix(rng):
+    records = []
+    for code, ap in make_stages(rng):
+        times = rng.choice([rng.randint(20, 99), rng.randint(100, 200000)])
+        if code in ("S4-6", "S5-2"):
+            # Referenced by the hardcoded gold offsets in _pre_processing.
+            times = max(times, 1000)
+        stage = {"stageId": "main_" + code, "code": code, "apCost": ap}
+        if code.startswith(("CE", "LS", "AP")):
+            # Exp/gold stages stay just below break-even against exp_unit.
+            drops = {("3003" if code[0] == "C" else "2004"): 0.12 * stage["apCost"]}
+        else:
+            main = rng.choice(FARMABLE)
+            drops = {main: rng.uniform(0.3, 1.1)}
+            for extra in rng.sample(FARMABLE, 4):
+                drops.setdefault(extra, rng.uniform(0.01, 0.2))
+            drops[rng.choice(RARE)] = rng.uniform(0.01, 0.04)
+            for exp_id in ("2001", "2002"):
+                drops[exp_id] = rng.uniform(0.1, 0.6)
+        if code == "S4-6":
+            # Every farmable and rare item drops somewhere above the frequency filter.
+            drops.update({i: 0.03 for i in FARMABLE + RARE if i not in drops})
+        for item_id, rate in drops.items():
+            records.append(
+                {
+                    "stage": stage,
+                    "item": {"itemId": item_id, "name": NAME[item_id]},
+                    "times": times,
+                    "quantity": int(rate * times),
+                }
+            )
+        # Non-numeric ids appear in the real matrix (furniture, event tokens).
+        if rng.random() < 0.1:
+            records.append(
+                {
+                    "stage": stage,
+                    "item": {"itemId": "furni_%s" % code, "name": "家具%s" % code},
+                    "times": times,
+                    "quantity": 1,
+                }
+            )
+    return {"matrix": records}
+
+
+def make_formula(rng):
+    rules = []
+    for target, costs, gold in FORMULAS:
+        level = int(target[-1])
+        peers = [i for i in FARMABLE if i[-1] == target[-1] and i != target]
+        outcomes = peers or [target]
+        rules.append(
+            {
+                "id": target,
+                "name": NAME[target],
+                "level": level,
+                "costs": [
+                    {"id": k, "name": NAME[k], "count": v} for k, v in costs.items()
+                ],
+                "goldCost": gold,
+                "extraOutcome": [
+                    {"id": k, "name": NAME[k], "count": 1, "weight": rng.randint(1, 10)}
+                    for k in outcomes
+                ],
+                "totalWeight": 0,
+            }
+        )
+    return rules
+
+
+def make_item_table(lang):
+    col = LANGS[lang]
+    items = {item[0]: {"itemId": item[0], "name": item[col]} for item in ITEMS}
+    items["4001"] = {
+        "itemId": "4001",
+        "name": ["龙门币", "LMD", "龍門幣", "용문폐"][col - 1],
+    }
+    items["furni_1"] = {"itemId": "furni_1", "name": "furniture"}
+    return {"items": items}
+
+
+def main(out_dir):
+    rng = random.Random(20200213)
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, "matrix.json"), "w", encoding="utf-8") as f:
+        json.dump(make_matrix(rng), f, ensure_ascii=False)
+    with open(os.path.join(out_dir, "formula.json"), "w", encoding="utf-8") as f:
+        json.dump(make_formula(rng), f, ensure_ascii=False)
+    for lang in LANGS:
+        path = os.path.join(out_dir, "item_table_%s.json" % lang)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(make_item_table(lang), f, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main(
+        sys.argv[1]
+        if len(sys.argv) > 1
+        else os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+    )
@@ -1,15 +1,64 @@
 import asyncio
+import os
+import time
 from signal import SIGINT, signal
+from typing import Any, Dict, Optional
 
 from marshmallow import Schema, fields, validate
 from marshmallow.exceptions import ValidationError
 from sanic import Sanic, response
 from sanic.exceptions import MethodNotSupported, NotFound
 
-from MaterialPlanning import MaterialPlanning
+from MaterialPlanning import (
+    GAMEDATA_PATH_DEFAULT,
+    PARETO_POINTS_DEFAULT,
+    PARETO_POINTS_MAX,
+    PARETO_RESOURCES,
+    SWEEP_PARAMETERS,
+    URL_RULES_DEFAULT,
+    URL_STATS_DEFAULT,
+    MaterialPlanning,
+    async_http_client,
+    penguin_url,
+    request_data_async,
+)
+from Metrics import metrics, record_refresh
+from PlanCache import plan_key
+from PlanStore import PLAN_STORE_SIZE_DEFAULT, PlanStore
+from SharedModel import SharedModel
+from SolverPool import EXECUTOR_DEFAULT, PoolFullError, SolverPool
 
 app = Sanic(name="ArkPlanner")
-mp = MaterialPlanning(dont_save_data=False)
+# With ARKPLANNER_SHARED_MODEL set to a segment name, one server worker builds
+# and refreshes the model and the others attach to it in shared memory.
+shared_model_name = os.environ.get("ARKPLANNER_SHARED_MODEL")
+shared = None
+if shared_model_name:
+    shared = SharedModel(MaterialPlanning, prefix=shared_model_name)
+    mp = shared.load(lambda: MaterialPlanning(dont_save_data=False))
+else:
+    mp = MaterialPlanning(dont_save_data=False)
+# With ARKPLANNER_PLAN_STORE set to a file path, plans are also persisted in a
+# SQLite database shared by the server workers and kept across restarts.
+plan_store_path = os.environ.get("ARKPLANNER_PLAN_STORE")
+plan_store = None
+if plan_store_path:
+    plan_store = PlanStore(
+        plan_store_path,
+        int(os.environ.get("ARKPLANNER_PLAN_STORE_SIZE", PLAN_STORE_SIZE_DEFAULT)),
+    )
+mp.plan_store = plan_store
+# Solves run on a pool started per server worker, see SolverPool for the options.
+pool_config = {
+    "kind": os.environ.get("ARKPLANNER_EXECUTOR", EXECUTOR_DEFAULT),
+    "workers": int(os.environ.get("ARKPLANNER_WORKERS", 0)) or None,
+    "max_pending": int(os.environ.get("ARKPLANNER_MAX_PENDING", 0)) or None,
+}
+retry_after = os.environ.get("ARKPLANNER_RETRY_AFTER", "1")
+max_batch = int(os.environ.get("ARKPLANNER_MAX_BATCH", 500))
+max_budget = float(os.environ.get("ARKPLANNER_MAX_BUDGET", 1.0))
+pool = None
+PLAN_ENDPOINTS = ("/plan", "/plan/batch", "/plan/sweep", "/plan/pareto")
 region_lang_map = {
     "en": "en_US",
     "jp": "ja_JP",
@@ -42,16 +91,85 @@ class PlanSchema(Schema):
     exclude = fields.List(fields.Str(), missing=None)
     exp_demand = fields.Bool(missing=False)
     gold_demand = fields.Bool(missing=True)
+    # Match item names regardless of case and whitespace, or by an unambiguous
+    # prefix of the name.
+    fuzzy = fields.Bool(missing=False)
+    # Only solve the stages and crafts that can contribute to the required items,
+    # values are then only given for the items involved.
+    presolve = fields.Bool(missing=False)
+    # Plan whole stage clears and crafts still covering the required items.
+    integral = fields.Bool(missing=False)
+    # Seconds an integral plan may spend improving on the rounded plan.
+    budget = fields.Float(missing=0.0, validate=validate.Range(min=0, max=max_budget))
+    # Add the time spent in each phase of the request, in milliseconds, to the
+    # plan under "timings".
+    debug = fields.Bool(missing=False)
+
+
+class BatchSchema(Schema):
+    # Plan requests, each one is validated against PlanSchema separately so that
+    # an invalid request doesn't fail the whole batch.
+    requests = fields.List(
+        fields.Dict(), required=True, validate=validate.Length(min=1, max=max_batch)
+    )
+
+
+class SweepSchema(PlanSchema):
+    class Meta:
+        exclude = ("presolve", "integral", "budget", "debug")
+
+    # One of "exclude", "outcome_rate", "exp_unit" or "gold_unit", see
+    # MaterialPlanning.sweep.
+    parameter = fields.Str(required=True, validate=validate.OneOf(SWEEP_PARAMETERS))
+    # Values of the parameter, checked by MaterialPlanning.sweep.
+    values = fields.List(
+        fields.Raw(), required=True, validate=validate.Length(min=1, max=max_batch)
+    )
+
+
+class ParetoSchema(PlanSchema):
+    class Meta:
+        exclude = (
+            "exp_demand",
+            "gold_demand",
+            "presolve",
+            "integral",
+            "budget",
+            "debug",
+        )
+
+    # "gold" or "exp", the resource traded off against sanity.
+    resource = fields.Str(required=True, validate=validate.OneOf(PARETO_RESOURCES))
+    # Number of plans on the frontier.
+    points = fields.Int(
+        missing=PARETO_POINTS_DEFAULT,
+        validate=validate.Range(min=2, max=PARETO_POINTS_MAX),
+    )
+
+
+class ValuesSchema(Schema):
+    # Query arguments of /values, with the defaults and meaning of /plan.
+    out_lang = fields.Str(
+        missing="en", validate=validate.OneOf(["en", "cn", "jp", "kr", "id"])
+    )
+    extra_outc = fields.Bool(missing=False)
+    non_cn_compat = fields.Bool(missing=False)
+    exp_demand = fields.Bool(missing=False)
+    gold_demand = fields.Bool(missing=True)
 
 
 schema = PlanSchema()
+batch_schema = BatchSchema()
+sweep_schema = SweepSchema()
+pareto_schema = ParetoSchema()
+values_schema = ValuesSchema()
 
 
 @app.exception(MethodNotSupported)
 async def post_only(request, exp):
-    if request.path == "/plan":
+    if request.path in PLAN_ENDPOINTS:
         return response.text(
-            "Error: Method GET not allowed for URL /plan."
+            "Error: Method GET not allowed for URL {}.".format(request.path)
             + " Only POST requests are allowed on this endpoint.",
             status=405,
         )
@@ -68,39 +186,338 @@ async def not_found(request, exp):
     )
 
 
+@app.listener("before_server_start")
+async def start_pool(app, loop):
+    global pool
+    pool = SolverPool(mp, **pool_config)
+
+
+@app.listener("before_server_start")
+async def start_updates(app, loop):
+    loop.create_task(update_coro())
+
+
+@app.listener("after_server_start")
+async def precompute_values(app, loop):
+    # Ready before the first /values request in most cases, computed on demand
+    # otherwise.
+    loop.run_in_executor(None, mp.precompute_item_values)
+
+
+@app.middleware("request")
+async def start_timer(request):
+    request.ctx.start = time.perf_counter()
+
+
+@app.middleware("response")
+async def record_duration(request, response):
+    # Unknown paths aren't recorded to keep the number of series bounded.
+    if request.path in PLAN_ENDPOINTS and hasattr(request.ctx, "start"):
+        metrics.observe(
+            "arkplanner_request_seconds",
+            time.perf_counter() - request.ctx.start,
+            endpoint=request.path,
+        )
+
+
+@app.listener("after_server_stop")
+async def stop_pool(app, loop):
+    pool.shutdown()
+
+
+def current_model():
+    """
+    Returns the model plans are solved with, switching to the latest published
+    one first if the model is shared.
+    """
+    global mp
+    if shared is not None:
+        new_mp = shared.refresh()
+        if new_mp is not None:
+            new_mp.plan_store = plan_store
+            mp = new_mp
+            pool.swap(new_mp)
+            # Published by another worker without its values, /values solves
+            # on the pool until they are precomputed here.
+            asyncio.get_event_loop().run_in_executor(
+                None, new_mp.precompute_item_values
+            )
+    return mp
+
+
 @app.route("/plan", methods=["POST"])
 async def plan(request):
+    stt = time.perf_counter()
     try:
         request = schema.load(request.json)
     except ValidationError as e:
         return response.json({"error": {"request_validation_error": e.messages}})
+    validate_time = time.perf_counter() - stt
+    metrics.observe("arkplanner_plan_phase_seconds", validate_time, phase="validate")
 
-    if request["owned"] is None:
-        request["owned"] = {}
-
+    current_model()
     try:
-        dct = mp.get_plan(
-            request["required"],
-            request["owned"],
-            False,
-            outcome=request["extra_outc"],
-            exp_demand=request["exp_demand"],
-            gold_demand=request["gold_demand"],
-            language=region_lang_map[request["out_lang"]],
-            non_cn_compat=request["non_cn_compat"],
-            exclude=request["exclude"],
+        dct = await pool.get_plan(
+            print_output=False, debug=request["debug"], **plan_kwargs(request)
+        )
+    except PoolFullError as e:
+        return response.json(
+            {"error": True, "reason": str(e)},
+            status=503,
+            headers={"Retry-After": retry_after},
         )
     except ValueError as e:
         return response.json({"error": True, "reason": str(e)})
 
+    if request["debug"]:
+        dct["timings"]["validate"] = round(validate_time * 1000, 3)
+        dct["timings"]["total"] = round((time.perf_counter() - stt) * 1000, 3)
     return response.json(dct)
 
 
+@app.route("/plan/batch", methods=["POST"])
+async def plan_batch(request):
+    stt = time.perf_counter()
+    try:
+        request = batch_schema.load(request.json)
+    except ValidationError as e:
+        return response.json({"error": {"request_validation_error": e.messages}})
+
+    plans = [None] * len(request["requests"])
+    batch, positions = [], []
+    for i, item in enumerate(request["requests"]):
+        try:
+            item = schema.load(item)
+        except ValidationError as e:
+            plans[i] = {"error": {"request_validation_error": e.messages}}
+            continue
+        batch.append(plan_kwargs(item))
+        positions.append(i)
+    metrics.observe(
+        "arkplanner_plan_phase_seconds", time.perf_counter() - stt, phase="validate"
+    )
+
+    current_model()
+    try:
+        results = await pool.get_plans(batch) if batch else []
+    except PoolFullError as e:
+        return response.json(
+            {"error": True, "reason": str(e)},
+            status=503,
+            headers={"Retry-After": retry_after},
+        )
+
+    for i, res in zip(positions, results):
+        if isinstance(res, BaseException):
+            res = {"error": True, "reason": str(res)}
+        plans[i] = res
+    return response.json({"plans": plans})
+
+
+@app.route("/plan/sweep", methods=["POST"])
+async def plan_sweep(request):
+    stt = time.perf_counter()
+    try:
+        request = sweep_schema.load(request.json)
+    except ValidationError as e:
+        return response.json({"error": {"request_validation_error": e.messages}})
+    metrics.observe(
+        "arkplanner_plan_phase_seconds", time.perf_counter() - stt, phase="validate"
+    )
+
+    current_model()
+    try:
+        results = await pool.sweep(
+            parameter=request["parameter"],
+            values=request["values"],
+            **plan_kwargs(request)
+        )
+    except PoolFullError as e:
+        return response.json(
+            {"error": True, "reason": str(e)},
+            status=503,
+            headers={"Retry-After": retry_after},
+        )
+    except ValueError as e:
+        return response.json({"error": True, "reason": str(e)})
+
+    plans = [
+        {"error": True, "reason": str(res)} if isinstance(res, BaseException) else res
+        for res in results
+    ]
+    return response.json({"parameter": request["parameter"], "plans": plans})
+
+
+@app.route("/plan/pareto", methods=["POST"])
+async def plan_pareto(request):
+    stt = time.perf_counter()
+    try:
+        request = pareto_schema.load(request.json)
+    except ValidationError as e:
+        return response.json({"error": {"request_validation_error": e.messages}})
+    metrics.observe(
+        "arkplanner_plan_phase_seconds", time.perf_counter() - stt, phase="validate"
+    )
+
+    current_model()
+    try:
+        plans = await pool.pareto(
+            resource=request["resource"],
+            points=request["points"],
+            **plan_kwargs(request)
+        )
+    except PoolFullError as e:
+        return response.json(
+            {"error": True, "reason": str(e)},
+            status=503,
+            headers={"Retry-After": retry_after},
+        )
+    except ValueError as e:
+        return response.json({"error": True, "reason": str(e)})
+    return response.json({"resource": request["resource"], "plans": plans})
+
+
+@app.route("/values", methods=["GET"])
+async def item_values(request):
+    """
+    Value of every material in sanity, see MaterialPlanning.item_values. The
+    response carries an ETag that changes with the data, a request whose
+    If-None-Match header holds it gets an empty 304 response.
+    """
+    try:
+        query = values_schema.load({key: request.args.get(key) for key in request.args})
+    except ValidationError as e:
+        return response.json({"error": {"request_validation_error": e.messages}})
+    model = current_model()
+    kwargs = {
+        "outcome": query["extra_outc"],
+        "gold_demand": query["gold_demand"],
+        "exp_demand": query["exp_demand"],
+        "non_cn_compat": query["non_cn_compat"],
+        "language": region_lang_map[query["out_lang"]],
+    }
+    headers = {
+        "ETag": '"{}"'.format(plan_key(data=model.data_version(), **kwargs)),
+        "Cache-Control": "no-cache",
+    }
+    if etag_matches(request.headers.get("If-None-Match"), headers["ETag"]):
+        return response.HTTPResponse(status=304, headers=headers)
+    try:
+        # Only solves until the values of the model are precomputed.
+        dct = await pool.item_values(**kwargs)
+    except PoolFullError as e:
+        return response.json(
+            {"error": True, "reason": str(e)},
+            status=503,
+            headers={"Retry-After": retry_after},
+        )
+    except ValueError as e:
+        return response.json({"error": True, "reason": str(e)})
+    return response.json(dct, headers=headers)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Whether an If-None-Match header matches an ETag, weakly compared.
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in (
+        tag[2:] if tag.startswith("W/") else tag for tag in tags
+    )
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics_endpoint(request):
+    """
+    Metrics of this server worker in the Prometheus text format.
+    """
+    return response.text(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+def plan_kwargs(request):
+    """
+    Converts a request loaded by PlanSchema to MaterialPlanning.get_plan arguments,
+    or by SweepSchema and ParetoSchema to the common arguments of
+    MaterialPlanning.sweep and MaterialPlanning.pareto.
+    """
+    kwargs = {
+        "requirement_dct": request["required"],
+        "deposited_dct": request["owned"] or {},
+        "outcome": request["extra_outc"],
+        "language": region_lang_map[request["out_lang"]],
+        "non_cn_compat": request["non_cn_compat"],
+        "exclude": request["exclude"],
+        "fuzzy": request["fuzzy"],
+    }
+    for name in ("exp_demand", "gold_demand", "presolve", "integral", "budget"):
+        if name in request:
+            kwargs[name] = request[name]
+    return kwargs
+
+
+async def refresh_model() -> Optional[Dict[str, Any]]:
+    """
+    Conditionally downloads the latest data concurrently, builds a new model in a
+    thread if anything changed and swaps it in once it is complete. Plans in
+    flight finish on the old model.
+    Returns:
+        changes: dict or None. Summary of the changes, see
+            MaterialPlanning.refreshed, or None if the data was unchanged.
+    """
+    global mp
+    # A worker that just became the leader may not have seen the last model.
+    current_model()
+    async with async_http_client(timeout=60) as client:
+        bodies, validators = await request_data_async(
+            client,
+            penguin_url + URL_STATS_DEFAULT,
+            penguin_url + URL_RULES_DEFAULT,
+            GAMEDATA_PATH_DEFAULT,
+            mp.validators,
+        )
+    new_mp = await asyncio.get_event_loop().run_in_executor(
+        None, mp.refreshed, bodies, validators
+    )
+    if new_mp is None:
+        # Nothing changed upstream, keep the current model and its cached plans.
+        return None
+    if shared is not None:
+        shared.publish(new_mp)
+        current_model()
+        return new_mp.changes
+    # Solved before the swap so that /values answers from the new model right away.
+    await asyncio.get_event_loop().run_in_executor(None, new_mp.precompute_item_values)
+    mp = new_mp
+    pool.swap(new_mp)
+    return new_mp.changes
+
+
 async def update_coro():
     while True:
         # Sleep an hour before checking for updates
         await asyncio.sleep(60 * 60)
-        mp.update(dont_save_data=True)
+        if shared is not None and not shared.try_lead():
+            # The leader refreshes the shared model for every worker.
+            continue
+        stt = time.perf_counter()
+        try:
+            changes = await refresh_model()
+        except Exception as e:
+            # Keep serving the current model, retry in an hour.
+            record_refresh(time.perf_counter() - stt, "failed")
+            print("Failed to update data: {!r}".format(e))
+            continue
+        if changes is None:
+            record_refresh(time.perf_counter() - stt, "unchanged")
+            continue
+        record_refresh(
+            time.perf_counter() - stt, "patched" if changes["patched"] else "updated"
+        )
+        print("Updated data: {}".format(changes))
 
 
 if __name__ == "__main__":
@@ -118,7 +535,6 @@ if __name__ == "__main__":
     signal(SIGINT, lambda s, f: loop.stop())
     serv_task = asyncio.ensure_future(serv_coro, loop=loop)
     loop.run_until_complete(serv_task)
-    asyncio.Task(update_coro(), loop=loop)  # type: ignore
     try:
         loop.run_forever()
     except BaseException:
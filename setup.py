@@ -16,5 +16,5 @@ setup(
     author_email="ethan.ycx@gmail.com",
     description=("A tiny program that helps on material planning in Arknight"),
     # url = "http://packages.python.org/an_example_pypi_project",
-    install_requires=["numpy", "scipy", "sanic"],
+    install_requires=["numpy", "scipy>=1.7", "sanic", "highspy"],
 )
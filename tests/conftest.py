@@ -0,0 +1,89 @@
+import copy
+import json
+import os
+import random
+import sys
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from MaterialPlanning import MaterialPlanning, request_itemdata  # noqa: E402
+from Metrics import metrics  # noqa: E402
+
+# Synthetic data generated by bench/make_fixtures.py.
+FIXTURES = os.path.join(REPO, "bench", "fixtures")
+
+
+@pytest.fixture(scope="session")
+def data():
+    """
+    The stats, the rules and the item names of the fixtures.
+    """
+    with open(os.path.join(FIXTURES, "matrix.json"), encoding="utf-8") as f:
+        material_probs = json.load(f)
+    with open(os.path.join(FIXTURES, "formula.json"), encoding="utf-8") as f:
+        convertion_rules = json.load(f)
+    itemdata = request_itemdata(
+        "file://" + os.path.join(FIXTURES, "item_table_{}.json")
+    )
+    return material_probs, convertion_rules, itemdata
+
+
+@pytest.fixture
+def mp(data):
+    """
+    A model built from the fixtures, with an empty plan cache.
+    """
+    return MaterialPlanning.from_data(*copy.deepcopy(data))
+
+
+def random_requests(mp, n, seed=0):
+    """
+    Yields n get_plan requirements and keyword arguments of 1 to 4 materials,
+    a byproduct setting alternating between requests and 3 excluded stages.
+    """
+    rng = random.Random(seed)
+    materials = sorted(i for i in mp.item_id_array if len(i) == 5)
+    stages = sorted(mp.stage_array)
+    for i in range(n):
+        required = {
+            item: rng.randint(20, 100)
+            for item in rng.sample(materials, rng.randint(1, 4))
+        }
+        kwargs = {
+            "outcome": i % 2 == 0,
+            "gold_demand": rng.random() < 0.5,
+            "exp_demand": rng.random() < 0.5,
+            "exclude": rng.sample(stages, 3),
+        }
+        yield required, kwargs
+
+
+# Validators of the data of refreshed models, see patched.
+VALIDATORS = {"stats": {"sha1": "stats"}, "rules": {"sha1": "rules"}, "items": {}}
+
+
+def patched(mp, data, stage):
+    """
+    Refreshes mp with data in which one drop of stage changed.
+    """
+    material_probs, convertion_rules, itemdata = copy.deepcopy(data)
+    record = next(r for r in material_probs["matrix"] if r["stage"]["code"] == stage)
+    record["quantity"] += 1000
+    mp.validators = copy.deepcopy(VALIDATORS)
+    new_mp = mp._patched(
+        (material_probs, convertion_rules, itemdata), copy.deepcopy(VALIDATORS)
+    )
+    assert new_mp.changes["patched"] and new_mp.changes["stages"] == [stage]
+    return new_mp
+
+
+def counter(name, **labels):
+    """
+    Current value of a counter of this process.
+    """
+    state = metrics.drain()
+    metrics.merge(state)
+    return state["counters"].get((name, tuple(sorted(labels.items()))), 0)
@@ -0,0 +1,84 @@
+import copy
+
+from conftest import counter, random_requests
+from MaterialPlanning import MaterialPlanning, UnknownItemError
+
+
+def primal_solves():
+    return counter(
+        "arkplanner_solves_total", problem="primal", method="highs", status="0"
+    )
+
+
+def test_batch_matches_get_plan(mp, data):
+    batch = [
+        dict(kwargs, requirement_dct=required)
+        for required, kwargs in random_requests(mp, 12)
+    ]
+    # The same requests, with the items or the excluded stages in another order.
+    batch.append(copy.deepcopy(batch[0]))
+    batch.append(
+        dict(
+            batch[1],
+            requirement_dct=dict(reversed(list(batch[1]["requirement_dct"].items()))),
+        )
+    )
+    batch.append(dict(batch[2], exclude=batch[2]["exclude"][::-1]))
+    batch += [
+        {"requirement_dct": {"Orirock Cubee": 10}},
+        {"requirement_dct": {"30013": 10}, "budget": -1.0},
+        {"requirement_dct": {"30013": 10}, "exclude": list(mp.stage_array)},
+        {"requirement_dct": {"30013": 10}, "unknown_argument": True},
+    ]
+    reference = MaterialPlanning.from_data(*copy.deepcopy(data))
+    expected = []
+    for request in batch:
+        try:
+            expected.append(reference.get_plan(print_output=False, **request))
+        except (TypeError, ValueError) as err:
+            expected.append(err)
+
+    # Each group of flags and excluded stages is masked once and each distinct
+    # request solved once.
+    templates = []
+    get_template = mp._get_template
+    mp._get_template = lambda *args: templates.append(args[0]) or get_template(*args)
+    solves = primal_solves()
+    plans = mp.get_plans(batch)
+    assert len(plans) == len(batch)
+    for plan, exp in zip(plans, expected):
+        if isinstance(exp, TypeError):
+            assert type(plan) is TypeError
+        elif isinstance(exp, Exception):
+            assert type(plan) is type(exp) and str(plan) == str(exp)
+        else:
+            assert plan == exp
+    assert isinstance(plans[-4], UnknownItemError)
+    assert isinstance(plans[-1], TypeError)
+    # 12 distinct plans and the infeasible one.
+    assert primal_solves() - solves == 12
+    assert len(templates) == 13
+    # Every copy of a plan is its own.
+    assert plans[12] == plans[0] and plans[12] is not plans[0]
+
+    # Cached, nothing is solved again.
+    hits = counter("arkplanner_plans_total", cache="hit")
+    assert mp.get_plans(batch[:15]) == plans[:15]
+    assert primal_solves() - solves == 12
+    assert counter("arkplanner_plans_total", cache="hit") == hits + 15
+
+
+def test_batch_groups(mp):
+    stages = sorted(mp.stage_array)[:3]
+    batch = [
+        {"requirement_dct": {"30013": n}, "exclude": stages, "outcome": outcome}
+        for n in (10, 20, 30)
+        for outcome in (False, True)
+    ]
+    templates = []
+    get_template = mp._get_template
+    mp._get_template = lambda *args: templates.append(args[0]) or get_template(*args)
+    plans = mp.get_plans(batch)
+    assert sorted(templates) == [(False, True, True), (True, True, True)]
+    for plan, request in zip(plans, batch):
+        assert plan == mp.get_plan(print_output=False, **request)
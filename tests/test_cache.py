@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import pickle
+import types
+
+import pytest
+
+import PlanCache
+from conftest import counter
+from SolverPool import PoolFullError, SolverPool
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    A list holding the time seen by PlanCache, to be advanced by the test.
+    """
+    now = [1000.0]
+    monkeypatch.setattr(
+        PlanCache, "time", types.SimpleNamespace(monotonic=lambda: now[0])
+    )
+    return now
+
+
+def test_lru_eviction():
+    cache = PlanCache.PlanCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    # "b" is now the least recently used.
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    cache.put("a", 4)
+    cache.put("d", 5)
+    assert cache.get("c") is None and cache.get("a") == 4
+    assert cache.stats() == {"size": 2, "maxsize": 2, "hits": 4, "misses": 2}
+
+    disabled = PlanCache.PlanCache(maxsize=0)
+    disabled.put("a", 1)
+    assert disabled.get("a") is None and disabled.stats()["size"] == 0
+
+
+def test_ttl_expiry(clock):
+    cache = PlanCache.PlanCache(maxsize=4, ttl=10)
+    cache.put("a", 1)
+    clock[0] += 5
+    cache.put("b", 2)
+    clock[0] += 5
+    assert cache.get("a") == 1
+    # A hit doesn't extend the lifetime of a plan.
+    clock[0] += 0.5
+    assert cache.get("a") is None and cache.get("b") == 2
+    assert cache.stats()["size"] == 1
+    clock[0] += 5
+    assert cache.get("b") is None and cache.stats()["size"] == 0
+
+
+def test_pickled_cache_is_empty():
+    cache = PlanCache.PlanCache(maxsize=3, ttl=60)
+    cache.put("a", 1)
+    copy = pickle.loads(pickle.dumps(cache))
+    assert copy.stats() == {"size": 0, "maxsize": 3, "hits": 0, "misses": 0}
+    assert copy.ttl == 60
+
+
+def test_plan_key_stability(mp, data):
+    # Canonical JSON, independent of the order of the arguments and the process.
+    assert PlanCache.plan_key(b=[1, "x"], a=True) == PlanCache.plan_key(
+        a=True, b=[1, "x"]
+    )
+    assert (
+        PlanCache.plan_key(b=[1, "x"], a=True)
+        == hashlib.sha1(b'{"a":true,"b":[1,"x"]}').hexdigest()
+    )
+
+    def keys(required, **kwargs):
+        plan_input = mp._prepare_plan(required, **kwargs)
+        return plan_input.cache_key, plan_input.request_key
+
+    idx = mp.item_id_rv[30012]
+    name = mp.item_names["en_US"][idx]
+    stages = sorted(mp.stage_array)[:2]
+    key = keys({name: 10}, language="en_US", exclude=stages)
+    assert keys({"30012": 10}, language="en_US", exclude=stages[::-1]) == key
+    assert keys({name: 10, "30013": 0}, language="en_US", exclude=stages) == key
+    assert keys({name: 10}, exclude=stages) == key
+    for kwargs in (
+        {"language": "ja_JP"},
+        {"owned": {"30013": 1}},
+        {"exclude": stages[:1]},
+        {"presolve": True},
+        {"outcome": True},
+    ):
+        args = {"language": "en_US", "exclude": stages}
+        args.update(kwargs)
+        required = {name: 10}
+        other = keys(required, deposited_dct=args.pop("owned", None), **args)
+        assert other[0] != key[0] and other[1] != key[1]
+
+    # Plans hit the cache under the same key, in the next generation of the
+    # data under another key, while the request key stays the same.
+    mp.get_plan({name: 10}, print_output=False, exclude=stages)
+    hits = counter("arkplanner_plans_total", cache="hit")
+    mp.get_plan(
+        {"30012": 10}, print_output=False, language="en_US", exclude=stages[::-1]
+    )
+    assert counter("arkplanner_plans_total", cache="hit") == hits + 1
+    mp._load_data(*data, mp.filter_freq, mp.filter_stages)
+    cache_key, request_key = keys({name: 10}, language="en_US", exclude=stages)
+    assert cache_key != key[0] and request_key == key[1]
+
+
+def test_pool_backpressure(mp):
+    pool = SolverPool(mp, kind="thread", workers=2, max_pending=3)
+    try:
+        plan = asyncio.run(
+            pool.get_plan(requirement_dct={"30012": 10}, print_output=False)
+        )
+        assert plan == mp.get_plan({"30012": 10}, print_output=False)
+        assert pool.pending == 0
+
+        pool.pending = pool.max_pending
+        with pytest.raises(PoolFullError):
+            asyncio.run(
+                pool.get_plan(requirement_dct={"30012": 10}, print_output=False)
+            )
+        pool.pending -= 1
+        assert (
+            asyncio.run(
+                pool.get_plan(requirement_dct={"30012": 10}, print_output=False)
+            )
+            == plan
+        )
+        assert pool.pending == pool.max_pending - 1
+    finally:
+        pool.shutdown()
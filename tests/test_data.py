@@ -0,0 +1,104 @@
+import asyncio
+import http.server
+import os
+import threading
+
+import pytest
+
+from MaterialPlanning import (
+    async_http_client,
+    file_validators,
+    gamedata_langs,
+    request_conditional,
+    request_data_async,
+    save_data,
+)
+
+BODY = b'{"matrix": []}'
+ETAG = '"v1"'
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    # Whether the server answers conditional requests with a 304.
+    conditional = True
+    requests = []
+
+    def do_GET(self):
+        StubHandler.requests.append(self.headers)
+        if self.conditional and self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def url():
+    StubHandler.conditional = True
+    StubHandler.requests = []
+    server = http.server.HTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}/matrix".format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+def test_conditional_request(url):
+    body, validators = request_conditional(url, {})
+    assert body == BODY and validators["etag"] == ETAG
+    assert request_conditional(url, validators) == (None, validators)
+    assert StubHandler.requests[-1]["If-None-Match"] == ETAG
+
+
+def test_unconditional_server(url):
+    StubHandler.conditional = False
+    _, validators = request_conditional(url, {})
+    # The body is compared with the stored version instead.
+    body, new_validators = request_conditional(url, validators)
+    assert body is None and new_validators == validators
+
+
+def test_saved_validators(url, tmp_path):
+    path = str(tmp_path / "matrix.json")
+    body, validators = request_conditional(url, {})
+    save_data(path, body, validators)
+    assert sorted(os.listdir(str(tmp_path))) == ["matrix.json", "matrix.meta.json"]
+    assert file_validators(path) == validators
+    assert request_conditional(url, file_validators(path))[0] is None
+
+    # A body that doesn't match its validators is requested again in full.
+    with open(path, "wb") as f:
+        f.write(BODY[:5])
+    assert "etag" not in file_validators(path)
+    assert request_conditional(url, file_validators(path))[0] == BODY
+
+
+async def refresh_requests(url, validators):
+    async with async_http_client(timeout=10) as client:
+        return await request_data_async(
+            client, url + "/stats", url + "/rules", url + "/{}/items", validators
+        )
+
+
+def test_async_refresh_requests(url):
+    # The requests of refresh_model, on the httpx client of the server.
+    bodies, validators = asyncio.run(refresh_requests(url, {}))
+    assert bodies["stats"] == bodies["rules"] == BODY
+    assert bodies["items"] == {lang: BODY for lang in gamedata_langs}
+    assert validators["items"]["en_US"]["etag"] == ETAG
+
+    StubHandler.requests = []
+    assert asyncio.run(refresh_requests(url, validators)) == (
+        {"stats": None, "rules": None, "items": dict.fromkeys(gamedata_langs)},
+        validators,
+    )
+    assert len(StubHandler.requests) == 2 + len(gamedata_langs)
+    assert all(r["If-None-Match"] == ETAG for r in StubHandler.requests)
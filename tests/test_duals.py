@@ -0,0 +1,53 @@
+import itertools
+import os
+
+import numpy as np
+import pytest
+
+from conftest import REPO
+
+
+@pytest.fixture
+def demand_lst(mp):
+    with open(os.path.join(REPO, "required.txt"), encoding="utf-8") as f:
+        required = {
+            line.rsplit(" ", 1)[0]: int(line.rsplit(" ", 1)[1])
+            for line in f
+            if line.strip()
+        }
+    requirements, _ = mp.convert_requirements(required)
+    demand_lst = np.zeros(len(mp.item_array))
+    for k, v in requirements.items():
+        demand_lst[mp.item_id_rv[k]] = v
+    return demand_lst
+
+
+@pytest.mark.parametrize("flags", list(itertools.product([False, True], repeat=3)))
+def test_highs_marginals_match_dual_solve(mp, demand_lst, flags):
+    # The item values read from the HiGHS marginals agree with the ones of the
+    # dual problem solved by the interior-point method.
+    results = {}
+    for solver in ("highs", "interior-point"):
+        mp.solver = solver
+        results[solver] = mp._get_plan_no_prioties(demand_lst, *flags)
+    (x_h, y_h, status_h), (x_i, y_i, status_i) = (
+        results["highs"],
+        results["interior-point"],
+    )
+    assert status_h == status_i == 0
+    cost = mp._lp_templates[flags].cost
+    assert abs(cost @ x_h - cost @ x_i) <= 1e-4 * max(1.0, abs(cost @ x_i))
+    demanded = demand_lst > 0
+    np.testing.assert_allclose(y_h[demanded], y_i[demanded], rtol=1e-3, atol=1e-3)
+
+    # Every item value, reported or not, is an optimal solution of the dual
+    # problem: no stage clear or craft yields more value than it costs and the
+    # values of the demand add up to the cost of the plan.
+    A = -mp._lp_templates[flags].A_ub
+    for y in (y_h, y_i):
+        assert (y >= -1e-6).all()
+        assert (A.T @ y <= cost + 1e-4 * (1 + np.abs(cost))).all()
+        assert demand_lst @ y == pytest.approx(cost @ x_i, rel=1e-4)
+    # The items the demand doesn't bind have no unique value: the marginals
+    # leave them at zero where the interior-point method valued them anyway.
+    assert set(np.flatnonzero(y_h > 1e-6)) <= set(np.flatnonzero(y_i > 1e-6))
@@ -0,0 +1,45 @@
+import math
+
+import pytest
+
+import MaterialPlanning
+from conftest import random_requests
+
+# Integral plans of requests of 20 to 100 items stay close to the LP cost.
+MAX_COST_RATIO = 1.25
+
+
+def check_integral(mp, required, **kwargs):
+    plan = mp.get_plan(required, None, False, **kwargs)
+    integral_plan = mp.get_plan(required, None, False, integral=True, **kwargs)
+    assert math.isfinite(integral_plan["cost"])
+    assert plan["cost"] <= integral_plan["cost"] <= MAX_COST_RATIO * plan["cost"]
+    for stage in integral_plan["stages"]:
+        assert float(stage["count"]) == int(stage["count"])
+    return plan, integral_plan
+
+
+def test_integral_plan_with_byproducts(mp):
+    check_integral(
+        mp,
+        {"30053": 23, "30042": 39, "30032": 26},
+        outcome=True,
+        gold_demand=False,
+        exp_demand=False,
+        exclude=["S6-3", "S5-6", "S3-1"],
+    )
+
+
+def test_integral_plan_cost(mp):
+    for required, kwargs in random_requests(mp, 40):
+        check_integral(mp, required, **kwargs)
+
+
+@pytest.mark.skipif(MaterialPlanning.milp is None, reason="requires scipy >= 1.9")
+def test_milp_never_costs_more_sanity(mp):
+    for required, kwargs in random_requests(mp, 10, seed=1):
+        rounded = mp.get_plan(required, None, False, integral=True, **kwargs)
+        improved = mp.get_plan(
+            required, None, False, integral=True, budget=0.2, **kwargs
+        )
+        assert improved["cost"] <= rounded["cost"]
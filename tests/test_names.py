@@ -0,0 +1,75 @@
+import pickle
+
+import pytest
+
+from MaterialPlanning import UnknownItemError
+
+
+def test_multilingual_names(mp):
+    # Names in every language and IDs, however written.
+    assert mp.convert_requirements({"Orirock Cube": 1, "Device": 2}) == (
+        {30012: 1, 30062: 2},
+        "en_US",
+    )
+    assert mp.convert_requirements({"원암 큐브 묶음": 3}) == ({30013: 3}, "ko_KR")
+    assert mp.convert_requirements({"30013": 3, "030062": 4}) == (
+        {30013: 3, 30062: 4},
+        "id",
+    )
+    # Names shared by several languages resolve to the first of them, or to
+    # the one the other keys are in.
+    assert mp.convert_requirements({"固源岩": 1}) == ({30012: 1}, "ja_JP")
+    assert mp.convert_requirements({"固源岩": 1, "固源岩组": 2}) == (
+        {30012: 1, 30013: 2},
+        "zh_CN",
+    )
+    assert mp.convert_requirements({"RMA70-12": 1}) == (
+        {int(mp.item_id_array[4]): 1},
+        "en_US",
+    )
+    # No shared language, the language of the first key.
+    assert mp.convert_requirements({"固源岩の塊": 1, "Device": 2})[1] == "ja_JP"
+    assert mp.convert_requirements({}) == ({}, "id")
+    assert mp.convert_requirements(None) == ({}, "")
+    # The plan is rendered in the language of the requirements.
+    plan = mp.get_plan({"원암 큐브 묶음": 3}, print_output=False)
+    assert plan["lang"] == "ko_KR"
+
+
+def test_fuzzy_names(mp):
+    assert mp.convert_requirements({" orirock  CUBE": 1}, fuzzy=True) == (
+        {30012: 1},
+        "en_US",
+    )
+    # An unambiguous prefix, or an ambiguous one of a single item.
+    assert mp.convert_requirements({"orirock clu": 1}, fuzzy=True)[0] == {30013: 1}
+    assert mp.convert_requirements({"원암 큐브 묶": 1}, fuzzy=True)[0] == {30013: 1}
+    with pytest.raises(UnknownItemError):
+        mp.convert_requirements({"orirock c": 1}, fuzzy=True)
+    with pytest.raises(UnknownItemError):
+        mp.convert_requirements({"orirock cube": 1})
+
+
+def test_unknown_items(mp):
+    with pytest.raises(UnknownItemError) as info:
+        mp.convert_requirements({"Orirock Cubee": 1, "Device": 1, "zzzz": 2})
+    err = info.value
+    assert isinstance(err, ValueError)
+    assert err.unknown == ["Orirock Cubee", "zzzz"]
+    assert err.suggestions["Orirock Cubee"][0] == "Orirock Cube"
+    assert err.suggestions["zzzz"] == []
+    assert str(err).startswith("Unknown items: 'Orirock Cubee' (did you mean")
+    assert str(err).endswith("; 'zzzz'")
+    assert mp.suggest_items("orirock c") == [
+        "Orirock Cluster",
+        "Orirock Concentration",
+        "Orirock Cube",
+    ]
+    # Raised in process workers and sent back to the server.
+    copy = pickle.loads(pickle.dumps(err))
+    assert copy.unknown == err.unknown and copy.suggestions == err.suggestions
+    assert str(copy) == str(err)
+
+    # Owned items are looked up the same way.
+    with pytest.raises(UnknownItemError):
+        mp.get_plan({"Device": 1}, {"Oriroc": 1}, print_output=False)
@@ -0,0 +1,47 @@
+import pytest
+
+from conftest import counter
+
+REQUIRED = {"30031": 37, "30064": 83, "30023": 47, "30013": 53}
+
+
+def warm_solves():
+    return counter(
+        "arkplanner_solves_total", problem="primal", method="highs-warm", status="0"
+    )
+
+
+def resource_yield(plan, resource):
+    if resource == "gold":
+        return plan["gold"] - plan["gcost"]
+    return plan["exp"]
+
+
+@pytest.mark.parametrize("resource", ["gold", "exp"])
+def test_pareto_frontier(mp, resource):
+    solves = warm_solves()
+    plans = mp.pareto(REQUIRED, resource, points=5)
+    assert len(plans) == 5 and warm_solves() == solves + 5
+
+    # Sorted by cost and yield, and no plan yields as much for less sanity.
+    points = [(plan["cost"], resource_yield(plan, resource)) for plan in plans]
+    assert points == sorted(points)
+    for (cost, amount), (next_cost, next_amount) in zip(points, points[1:]):
+        assert next_amount > amount and next_cost >= cost
+
+    # The ends are the plans of get_plan without and with the resource demanded.
+    cheapest = mp.get_plan(REQUIRED, None, False, gold_demand=False, exp_demand=False)
+    demanded = mp.get_plan(
+        REQUIRED,
+        None,
+        False,
+        gold_demand=resource == "gold",
+        exp_demand=resource == "exp",
+    )
+    assert points[0][0] == pytest.approx(cheapest["cost"], abs=1)
+    assert points[-1][1] == pytest.approx(resource_yield(demanded, resource), rel=1e-3)
+    # Every point is at least as cheap as the cold plan yielding as much.
+    for cost, amount in points:
+        for plan in (cheapest, demanded):
+            if resource_yield(plan, resource) >= amount:
+                assert cost <= plan["cost"] + 1
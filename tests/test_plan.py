@@ -0,0 +1,25 @@
+def test_owned_items_lower_the_demand(mp):
+    required = {"30012": 100}
+    plan = mp.get_plan(required, None, False)
+    owned_plan = mp.get_plan(required, {"30012": 40}, False)
+    assert owned_plan["cost"] < plan["cost"]
+    other_plan = mp.get_plan(required, {"30012": 70}, False)
+    assert other_plan["cost"] < owned_plan["cost"]
+    stats = mp.plan_cache.stats()
+    assert stats["size"] == 3 and stats["hits"] == 0
+
+
+def test_owned_surplus_is_crafted_with(mp):
+    # 5 Orirock Cubes make an Orirock Cluster.
+    required = {"30013": 20}
+    plan = mp.get_plan(required, None, False)
+    some_plan = mp.get_plan(required, {"30012": 50}, False)
+    assert 0 < some_plan["cost"] < plan["cost"]
+    owned_plan = mp.get_plan(required, {"30012": 100}, False, language="en_US")
+    assert owned_plan["cost"] == 0 and owned_plan["stages"] == []
+    assert owned_plan["craft"][0]["materials"] == {"Orirock Cube": "100"}
+    for kwargs in ({"presolve": True}, {"integral": True}):
+        assert mp.get_plan(required, {"30012": 100}, False, **kwargs)["cost"] == 0
+        assert (
+            mp.get_plan(required, {"30012": 50}, False, **kwargs)["cost"] < plan["cost"]
+        )
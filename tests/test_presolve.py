@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from conftest import random_requests
+
+
+def test_presolve_same_cost(mp):
+    for i, (required, kwargs) in enumerate(random_requests(mp, 40, seed=1)):
+        kwargs["non_cn_compat"] = i % 3 == 0
+        plan = mp.get_plan(required, print_output=False, **kwargs)
+        presolved = mp.get_plan(required, print_output=False, presolve=True, **kwargs)
+        assert float(presolved["cost"]) == pytest.approx(
+            float(plan["cost"]), rel=1e-6, abs=1e-6
+        )
+
+    with pytest.raises(ValueError):
+        mp.get_plan(
+            {"30013": 10},
+            print_output=False,
+            presolve=True,
+            exclude=list(mp.stage_array),
+        )
+
+
+def test_presolve_reduces(mp):
+    key = (False, True, True)
+    n_items, n_cols = mp._lp_templates[key].A_ub.shape
+    demand = np.zeros(n_items)
+    demand[mp.item_id_rv[30013]] = 10
+    is_col_alive = np.ones(n_cols, dtype=bool)
+    rows, cols = mp._presolve(key, demand, is_col_alive)
+    assert mp.item_id_rv[30013] in rows and mp.item_id_rv[30012] in rows
+    assert len(rows) < n_items and len(cols) < n_cols
+    # Excluded stages are never kept.
+    is_col_alive[cols[0]] = False
+    assert cols[0] not in mp._presolve(key, demand, is_col_alive)[1]
+
+    # The kept part covers the demand at the cost of the full problem.
+    x, _, status = mp._get_plan_no_prioties(demand, *key, presolve=True)
+    x_full, _, status_full = mp._get_plan_no_prioties(demand, *key)
+    assert status == status_full == 0
+    cost = mp._lp_templates[key].cost
+    assert cost @ x == pytest.approx(cost @ x_full, rel=1e-6)
+    A = -mp._lp_templates[key].A_ub
+    assert (A @ x >= demand - 1e-6).all()
+    assert not x[np.setdiff1d(np.arange(n_cols), cols)].any()
+
+    # Negative costs would make the full problem unbounded, it isn't reduced.
+    template = mp._lp_templates[key]
+    mp._lp_templates[key] = template._replace(cost=template.cost - cost.max() - 1)
+    assert mp._presolve(key, demand, is_col_alive) == (None, None)
@@ -0,0 +1,63 @@
+import asyncio
+import copy
+
+from conftest import VALIDATORS, patched
+from Metrics import metrics
+from SolverPool import SolverPool
+
+
+def plans_total(cache):
+    state = metrics.drain()
+    metrics.merge(state)
+    return state["counters"].get(("arkplanner_plans_total", (("cache", cache),)), 0)
+
+
+def test_patch_keeps_unaffected_plans(mp, data):
+    stage = mp.stage_array[0]
+    required = {"30012": 100}
+    kept = mp.get_plan(required, None, False, exclude=[stage])
+    mp.get_plan(required, None, False)
+    new_mp = patched(mp, data, stage)
+    assert new_mp.changes["plans_kept"] == 1
+    hits = plans_total("hit")
+    assert new_mp.get_plan(required, None, False, exclude=[stage]) == kept
+    assert plans_total("hit") == hits + 1
+
+
+def test_process_pool_swap_keeps_plans(mp, data):
+    # The worker caches the plans in its own copy of the model, and patches it
+    # when it gets the new model.
+    stage = mp.stage_array[0]
+    kept = {
+        "requirement_dct": {"30012": 100},
+        "print_output": False,
+        "exclude": [stage],
+    }
+    dropped = {"requirement_dct": {"30012": 100}, "print_output": False}
+    pool = SolverPool(mp, kind="process", workers=1)
+    try:
+        for kwargs in (kept, dropped):
+            asyncio.run(pool.get_plan(**kwargs))
+        new_mp = patched(mp, data, stage)
+        pool.swap(new_mp)
+        hits, misses = plans_total("hit"), plans_total("miss")
+        for kwargs in (kept, dropped):
+            assert asyncio.run(pool.get_plan(**kwargs)) == new_mp.get_plan(**kwargs)
+        # Both were computed again in this process by new_mp, only the plan
+        # that excluded the changed stage was found by the worker.
+        assert plans_total("hit") == hits + 1
+        assert plans_total("miss") == misses + 3
+    finally:
+        pool.shutdown()
+
+
+def test_reordered_items_rebuild(mp, data):
+    material_probs, convertion_rules, itemdata = copy.deepcopy(data)
+    material_probs["matrix"].reverse()
+    mp.validators = copy.deepcopy(VALIDATORS)
+    new_mp = mp._patched(
+        (material_probs, convertion_rules, itemdata), copy.deepcopy(VALIDATORS)
+    )
+    changes = new_mp.changes
+    assert not changes["patched"] and changes["reason"] == "stages or items reordered"
+    assert changes["stages_reordered"] and not changes["stages_added"]
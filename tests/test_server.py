@@ -0,0 +1,79 @@
+import asyncio
+import importlib
+import os
+import shutil
+import sys
+
+import pytest
+
+from conftest import FIXTURES
+from MaterialPlanning import MaterialPlanning
+from SolverPool import PoolFullError, SolverPool
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    """
+    The server module, reading a snapshot of the fixtures from the data directory
+    of a temporary working directory and solving plans inline.
+    """
+    workdir = tmp_path_factory.mktemp("server")
+    os.makedirs(os.path.join(workdir, "data"))
+    for name in ("matrix.json", "formula.json"):
+        shutil.copy(os.path.join(FIXTURES, name), os.path.join(workdir, "data", name))
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    environ = os.environ.copy()
+    os.environ["ARKPLANNER_EXECUTOR"] = "inline"
+    try:
+        MaterialPlanning(
+            dont_save_data=False,
+            gamedata_path="file://" + os.path.join(FIXTURES, "item_table_{}.json"),
+        )
+        yield importlib.import_module("server")
+    finally:
+        sys.modules.pop("server", None)
+        os.environ.clear()
+        os.environ.update(environ)
+        os.chdir(cwd)
+
+
+def test_values_etag(server):
+    _, res = server.app.test_client.get("/values?out_lang=en")
+    assert res.status == 200
+    assert res.json["lang"] == "en_US" and res.json["values"]
+    etag = res.headers["ETag"]
+
+    _, res = server.app.test_client.get(
+        "/values?out_lang=en", headers={"If-None-Match": etag}
+    )
+    assert res.status == 304 and not res.body
+    assert res.headers["ETag"] == etag
+    _, res = server.app.test_client.get(
+        "/values?out_lang=en", headers={"If-None-Match": "W/" + etag + ', "other"'}
+    )
+    assert res.status == 304
+
+    # Other query arguments or other data have another ETag.
+    _, res = server.app.test_client.get(
+        "/values?out_lang=en&extra_outc=true", headers={"If-None-Match": etag}
+    )
+    assert res.status == 200 and res.headers["ETag"] != etag
+    server.mp._data_version = "other"
+    _, res = server.app.test_client.get(
+        "/values?out_lang=en", headers={"If-None-Match": etag}
+    )
+    assert res.status == 200 and res.headers["ETag"] != etag
+
+
+def test_values_pool(mp):
+    pool = SolverPool(mp, kind="inline")
+    pool.pending = pool.max_pending
+    # Solved on a worker while the values aren't precomputed.
+    with pytest.raises(PoolFullError):
+        asyncio.run(pool.item_values(language="en_US"))
+    mp.precompute_item_values()
+    assert mp.has_item_values(outcome=True, non_cn_compat=True)
+    assert asyncio.run(pool.item_values(language="en_US")) == mp.item_values(
+        language="en_US"
+    )
@@ -0,0 +1,68 @@
+import os
+import pickle
+
+import pytest
+
+from conftest import patched
+from MaterialPlanning import MaterialPlanning
+from SharedModel import SharedModel, _unlink
+
+REQUIRED = {"30012": 100, "30062": 20, "30043": 10}
+
+
+@pytest.fixture
+def shared(tmp_path):
+    """
+    A function returning SharedModel instances of the same segments, removed
+    after the test.
+    """
+    prefix = "arkplanner_test_{}".format(os.getpid())
+    lock_path = os.path.join(tmp_path, "model.lock")
+    yield lambda: SharedModel(MaterialPlanning, prefix=prefix, lock_path=lock_path)
+    for generation in range(1, 5):
+        _unlink("{}_{}".format(prefix, generation))
+    _unlink(prefix)
+
+
+def test_publish_and_attach(mp, data, shared):
+    leader, reader = shared(), shared()
+    assert reader.attach() is None and reader.refresh() is None
+    attached = leader.load(lambda: mp)
+    assert leader.is_leader and leader.generation == 1
+    assert not reader.try_lead()
+
+    def build():
+        raise AssertionError("Only the leader builds the model")
+
+    mp_1 = reader.load(build)
+    assert reader.generation == 1 and reader.refresh() is None
+    assert not mp_1.probs_matrix.data.flags.writeable
+    assert mp_1.data_version() == attached.data_version() == mp.data_version()
+    expected = mp.get_plan(REQUIRED, print_output=False)
+    assert mp_1.get_plan(REQUIRED, print_output=False) == expected
+    assert mp_1.item_values() == mp.item_values()
+    # Process workers attach to the segment instead of receiving the arrays.
+    copy = pickle.loads(pickle.dumps(mp_1))
+    assert copy._shared_memory is not None
+    assert copy.get_plan(REQUIRED, print_output=False) == expected
+
+    with pytest.raises(RuntimeError):
+        reader.publish(mp)
+    new_mp = patched(mp, data, sorted(mp.stage_array)[0])
+    leader.publish(new_mp)
+    assert reader.published_generation() == 2
+    mp_2 = reader.refresh()
+    assert reader.generation == 2 and reader.refresh() is None
+    assert mp_2.data_version() == new_mp.data_version() != mp.data_version()
+    assert mp_2.get_plan(REQUIRED, print_output=False) == new_mp.get_plan(
+        REQUIRED, print_output=False
+    )
+
+    # The segment of generation 1 is removed, the models attached to it keep
+    # their mapping.
+    leader.publish(mp)
+    with pytest.raises(FileNotFoundError):
+        MaterialPlanning.from_shared_memory(leader._segment_name(1))
+    assert reader.refresh().data_version() == mp.data_version()
+    mp_1.plan_cache.clear()
+    assert mp_1.get_plan(REQUIRED, print_output=False) == expected
@@ -0,0 +1,101 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import MaterialPlanning
+from conftest import FIXTURES, random_requests
+from MaterialPlanning import StaleSnapshotError
+
+
+@pytest.fixture
+def paths(tmp_path):
+    """
+    MaterialPlanning.__init__ arguments reading a copy of the fixtures.
+    """
+    for name in ("matrix.json", "formula.json"):
+        shutil.copy(os.path.join(FIXTURES, name), os.path.join(tmp_path, name))
+    return {
+        "path_stats": os.path.join(tmp_path, "matrix.json"),
+        "path_rules": os.path.join(tmp_path, "formula.json"),
+        "path_snapshot": os.path.join(tmp_path, "model.snapshot"),
+        "gamedata_path": "file://" + os.path.join(FIXTURES, "item_table_{}.json"),
+    }
+
+
+def load(paths):
+    return MaterialPlanning.MaterialPlanning.from_snapshot(
+        paths["path_snapshot"], paths["path_stats"], paths["path_rules"]
+    )
+
+
+def test_snapshot_round_trip(paths):
+    built = MaterialPlanning.MaterialPlanning(**paths)
+    loaded = load(paths)
+    assert loaded.data_version() == built.data_version()
+    assert loaded.validators == built.validators
+
+    # The LP templates and lookup tables are restored instead of rebuilt.
+    assert loaded._lp_templates.keys() == built._lp_templates.keys()
+    for key, template in built._lp_templates.items():
+        restored = loaded._lp_templates[key]
+        assert abs(restored.A_ub - template.A_ub).max() == 0
+        assert abs(restored.A_dual - template.A_dual).max() == 0
+        np.testing.assert_array_equal(restored.cost, template.cost)
+    for lang, names in built.item_names.items():
+        assert loaded.item_names[lang].tolist() == names.tolist()
+    for name in ("is_material", "item_levels", "craft_target_idx"):
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(built, name))
+    assert [(idx.tolist(), counts) for idx, counts in loaded.craft_materials] == [
+        (idx.tolist(), counts) for idx, counts in built.craft_materials
+    ]
+    assert loaded.name_index == built.name_index
+    assert loaded.normalized_index == built.normalized_index
+    assert loaded.normalized_names == built.normalized_names
+
+    for required, kwargs in random_requests(built, 10):
+        kwargs["language"] = "ja_JP"
+        assert loaded.get_plan(required, print_output=False, **kwargs) == (
+            built.get_plan(required, print_output=False, **kwargs)
+        )
+    name = built.item_names["en_US"][built.item_id_rv[30013]]
+    required = {name.lower(): 10}
+    assert loaded.get_plan(required, print_output=False, fuzzy=True) == (
+        built.get_plan(required, print_output=False, fuzzy=True)
+    )
+
+
+def test_stale_snapshot(paths, monkeypatch):
+    MaterialPlanning.MaterialPlanning(**paths)
+    with open(paths["path_stats"], "a", encoding="utf-8") as f:
+        f.write("\n")
+    with pytest.raises(StaleSnapshotError):
+        load(paths)
+    # Rebuilt from the data, and saved again.
+    MaterialPlanning.MaterialPlanning(**paths)
+    load(paths)
+
+    with pytest.raises(StaleSnapshotError):
+        MaterialPlanning.MaterialPlanning.from_snapshot(
+            paths["path_snapshot"],
+            paths["path_stats"],
+            paths["path_rules"],
+            filter_stages=["main_01-07"],
+        )
+    monkeypatch.setattr(
+        MaterialPlanning, "SNAPSHOT_VERSION", MaterialPlanning.SNAPSHOT_VERSION + 1
+    )
+    with pytest.raises(StaleSnapshotError):
+        load(paths)
+
+
+def test_truncated_snapshot(paths):
+    MaterialPlanning.MaterialPlanning(**paths)
+    size = os.path.getsize(paths["path_snapshot"])
+    with open(paths["path_snapshot"], "r+b") as f:
+        f.truncate(size // 2)
+    with pytest.raises(ValueError):
+        load(paths)
+    MaterialPlanning.MaterialPlanning(**paths)
+    assert os.path.getsize(paths["path_snapshot"]) == size
@@ -0,0 +1,114 @@
+import warnings
+
+import numpy as np
+import pytest
+from scipy import sparse
+from scipy.optimize import OptimizeWarning, linprog
+
+import MaterialPlanning
+from conftest import counter
+
+REQUIRED = {"30012": 100, "30062": 20, "30043": 10}
+KEY = (False, True, True)
+
+
+def test_scale_lp(mp):
+    template = mp._lp_templates[KEY]
+    scaled = MaterialPlanning.scale_lp(template)
+    row_scale, col_scale = scaled.row_scale, scaled.col_scale
+    # Powers of two, the scaled values are exact.
+    for scale in (row_scale, col_scale):
+        assert (np.exp2(np.round(np.log2(scale))) == scale).all()
+    A = sparse.diags(row_scale) @ template.A_ub @ sparse.diags(col_scale)
+    assert abs(scaled.A_ub - A).max() == 0
+    assert abs(scaled.A_dual + scaled.A_ub.T).max() == 0
+    np.testing.assert_array_equal(scaled.cost, template.cost * col_scale)
+    assert 0.5 <= np.abs(scaled.cost).max() <= 2
+
+    # The magnitudes of the nonzeros are brought closer to 1.
+    def spread(A):
+        logs = np.abs(np.log2(np.abs(sparse.coo_matrix(A).data)))
+        return logs.mean()
+
+    assert spread(scaled.A_ub) < spread(template.A_ub)
+
+    # Both programs have the same plan and item values once unscaled.
+    demand = np.zeros(len(mp.item_array))
+    for k, v in mp.convert_requirements(REQUIRED)[0].items():
+        demand[mp.item_id_rv[k]] = v
+    x, y, status = mp._solve_template(scaled, demand)
+    x_0, y_0, status_0 = mp._solve_template(template, demand)
+    assert status == status_0 == 0
+    assert template.cost @ x == pytest.approx(template.cost @ x_0, rel=1e-9)
+    np.testing.assert_allclose(y, y_0, rtol=1e-6, atol=1e-9)
+
+
+@pytest.fixture
+def failing(monkeypatch):
+    """
+    Makes linprog end with the status of a method in the returned dict, the
+    methods called are appended to its "calls" list.
+    """
+    statuses = {"calls": []}
+
+    def failing_linprog(*args, method, **kwargs):
+        statuses["calls"].append(method)
+        solution = linprog(*args, method=method, **kwargs)
+        solution.status = statuses.get(method, solution.status)
+        return solution
+
+    monkeypatch.setattr(MaterialPlanning, "linprog", failing_linprog)
+    return statuses
+
+
+def test_fallback_chain(mp, failing):
+    expected = mp.get_plan(REQUIRED, print_output=False)
+    mp.plan_cache.clear()
+    failing.update({"calls": [], "highs": 4})
+    attempts = counter(
+        "arkplanner_solves_total", problem="primal", method="highs-ipm", status="0"
+    )
+
+    plan = mp.get_plan(REQUIRED, print_output=False, debug=True)
+    assert failing["calls"] == ["highs", "highs-ipm"]
+    assert plan["solver_path"] == [
+        {"problem": "primal", "method": "highs", "status": 4},
+        {"problem": "primal", "method": "highs-ipm", "status": 0},
+    ]
+    assert float(plan["cost"]) == pytest.approx(float(expected["cost"]), rel=1e-6)
+    assert plan["values"] == expected["values"]
+    assert (
+        counter(
+            "arkplanner_solves_total", problem="primal", method="highs-ipm", status="0"
+        )
+        == attempts + 1
+    )
+
+
+def test_fallback_chain_ends(mp, failing):
+    # An infeasible or unbounded problem isn't solved again.
+    failing["highs"] = 2
+    with pytest.raises(ValueError):
+        mp.get_plan(REQUIRED, print_output=False)
+    assert failing["calls"] == ["highs"]
+
+    # The last method of the chain solves the dense matrices and has no
+    # marginals, the item values are solved along the same chain.
+    failing.update({"calls": [], "highs": 4, "highs-ipm": 1})
+    plan = mp.get_plan({"30013": 20}, print_output=False, debug=True)
+    assert failing["calls"] == ["highs", "highs-ipm", "revised simplex"] * 2
+    assert [(solve["problem"], solve["status"]) for solve in plan["solver_path"]] == [
+        (problem, status) for problem in ("primal", "dual") for status in (4, 1, 0)
+    ]
+    assert plan["values"]
+
+
+def test_interior_point_sparse(mp, failing):
+    mp.solver = "interior-point"
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", OptimizeWarning)
+        plan = mp.get_plan(REQUIRED, print_output=False, debug=True)
+    assert [solve["method"] for solve in plan["solver_path"]] == [
+        "interior-point",
+        "interior-point",
+    ]
@@ -0,0 +1,111 @@
+import copy
+import os
+import pickle
+import sqlite3
+import types
+
+import pytest
+
+import PlanStore
+from conftest import counter, patched
+from MaterialPlanning import MaterialPlanning
+
+PLAN = {"cost": "12.5", "stages": [{"stage": "1-7", "items": {"固源岩": "3.2"}}]}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    A list holding the time seen by PlanStore, to be advanced by the test.
+    """
+    now = [1000.0]
+    monkeypatch.setattr(PlanStore, "time", types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def path(tmp_path):
+    return os.path.join(tmp_path, "store", "plans.sqlite")
+
+
+def test_round_trip(path):
+    store = PlanStore.PlanStore(path)
+    store.put("a", "v1", PLAN)
+    assert store.get("a", "v1") == PLAN
+    assert store.get("a", "v2") is None and store.get("b", "v1") is None
+    # Shared with the other processes opening the file, and with pickled copies.
+    other = pickle.loads(pickle.dumps(PlanStore.PlanStore(path)))
+    assert other.get("a", "v1") == PLAN
+    other.put("a", "v2", dict(PLAN, cost="13"))
+    assert store.get("a", "v2")["cost"] == "13" and store.get("a", "v1") == PLAN
+    assert store.stats() == {"size": 2, "maxsize": store.maxsize, "versions": 2}
+    store.clear()
+    assert other.get("a", "v1") is None and other.stats()["size"] == 0
+
+    disabled = PlanStore.PlanStore(path, maxsize=0)
+    disabled.put("a", "v1", PLAN)
+    assert disabled.get("a", "v1") is None
+
+
+def test_lru_eviction(path, clock):
+    store = PlanStore.PlanStore(path, maxsize=3)
+    for key in "abc":
+        store.put(key, "v1", {"key": key})
+        clock[0] += PlanStore.USE_RESOLUTION + 1
+    # A recent use isn't written back, an older one is.
+    assert store.get("a", "v1") == {"key": "a"}
+    store.put("d", "v1", {"key": "d"})
+    assert store.get("b", "v1") is None
+    clock[0] += PlanStore.USE_RESOLUTION + 1
+    store.put("e", "v2", {"key": "e"})
+    assert store.get("c", "v1") is None
+    assert [store.get(key, "v1") is not None for key in "ad"] == [True, True]
+    assert store.stats() == {"size": 3, "maxsize": 3, "versions": 2}
+
+
+def test_errors_are_misses(path):
+    store = PlanStore.PlanStore(path, timeout=0.05)
+    store.put("a", "v1", PLAN)
+    # Another process holding the write lock longer than the timeout.
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("BEGIN IMMEDIATE")
+    errors = counter("arkplanner_plan_store_errors_total", operation="put")
+    store.put("b", "v1", PLAN)
+    assert counter("arkplanner_plan_store_errors_total", operation="put") == errors + 1
+    assert store.get("a", "v1") == PLAN
+    conn.rollback()
+    conn.close()
+
+    del store
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    with open(path, "wb") as f:
+        f.write(b"not a database" * 100)
+    errors = counter("arkplanner_plan_store_errors_total", operation="get")
+    assert PlanStore.PlanStore(path).get("a", "v1") is None
+    assert counter("arkplanner_plan_store_errors_total", operation="get") == errors + 1
+
+
+def test_models_share_plans(mp, data, path):
+    mp.plan_store = PlanStore.PlanStore(path)
+    required = {"30012": 100, "30062": 20}
+    plan = mp.get_plan(required, print_output=False)
+
+    # A model built from the same data, e.g. by another server worker.
+    other = MaterialPlanning.from_data(*copy.deepcopy(data))
+    other.plan_store = PlanStore.PlanStore(path)
+    stored = counter("arkplanner_plans_total", cache="store")
+    assert other.get_plan(required, print_output=False) == plan
+    assert counter("arkplanner_plans_total", cache="store") == stored + 1
+    # Then in its plan cache.
+    assert other.get_plan(required, print_output=False) == plan
+    assert counter("arkplanner_plans_total", cache="store") == stored + 1
+
+    # The plans of other data are never served.
+    new_mp = patched(mp, data, sorted(mp.stage_array)[0])
+    assert new_mp.plan_store is mp.plan_store
+    new_mp.plan_cache.clear()
+    new_mp.get_plan(required, print_output=False)
+    assert counter("arkplanner_plans_total", cache="store") == stored + 1
+    assert mp.plan_store.stats()["versions"] == 2
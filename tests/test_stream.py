@@ -0,0 +1,65 @@
+import json
+import os
+
+import pytest
+
+from conftest import FIXTURES
+from MaterialPlanning import iter_matrix, stream_data
+
+# Strings holding the delimiters the parser skips, and multi-byte characters.
+RECORDS = [
+    {"stage": {"code": "1-7", "apCost": 6}, "item": {"name": "固源岩, ]"}, "times": 1},
+    {"stage": {"code": "S4-1", "apCost": 18}, "item": {"name": '"[원암]"'}, "times": 2},
+    {"stage": {"code": "GT-5", "apCost": 15}, "item": {"name": "☃"}, "times": 3},
+]
+BODY = (
+    '{"updated": 1, "matrix" : [\n  '
+    + ",\n  ".join(json.dumps(r, ensure_ascii=False) for r in RECORDS)
+    + '\n], "matrix2": []}'
+).encode()
+
+
+def chunked(body, size):
+    return [body[start : start + size] for start in range(0, len(body), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 64, len(BODY)])
+def test_chunk_boundaries(size):
+    assert list(iter_matrix(chunked(BODY, size))) == RECORDS
+
+
+def test_fixture_matrix():
+    with open(os.path.join(FIXTURES, "matrix.json"), "rb") as f:
+        body = f.read()
+    records = json.loads(body)["matrix"]
+    for size in (1, 1000, 1 << 16):
+        assert list(iter_matrix(chunked(body, size))) == records
+    material_probs, _ = stream_data(
+        os.path.join(FIXTURES, "matrix.json"), os.path.join(FIXTURES, "formula.json")
+    )
+    assert list(material_probs["matrix"]) == records
+
+
+def test_empty_and_missing_matrix():
+    assert list(iter_matrix([b'{"matrix": []}'])) == []
+    assert list(iter_matrix(chunked(b'{"matrix":\n[ ] }', 1))) == []
+    with pytest.raises(ValueError):
+        list(iter_matrix([b'{"stats": []}']))
+    with pytest.raises(ValueError):
+        list(iter_matrix([]))
+
+
+def test_truncated_input():
+    # Position of the closing bracket of the matrix, it is parsed whole after it.
+    end = BODY.index(b"\n]") + 1
+    for cut in range(len(BODY)):
+        records = []
+        if cut > end:
+            records = list(iter_matrix(chunked(BODY[:cut], 1)))
+            assert records == RECORDS
+            continue
+        with pytest.raises(ValueError):
+            for record in iter_matrix(chunked(BODY[:cut], 1)):
+                records.append(record)
+        # The records before the cut are yielded first.
+        assert records == RECORDS[: len(records)]
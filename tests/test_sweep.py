@@ -0,0 +1,50 @@
+import pytest
+
+from conftest import counter
+
+REQUIRED = {"30012": 100, "30062": 20, "30043": 10}
+KWARGS = {"gold_demand": False, "exp_demand": False}
+
+
+def warm_solves():
+    return counter(
+        "arkplanner_solves_total", problem="primal", method="highs-warm", status="0"
+    )
+
+
+def test_exclude_sweep(mp):
+    stages = [
+        s["stage"] for s in mp.get_plan(REQUIRED, None, False, **KWARGS)["stages"]
+    ]
+    values = [stages[:i] for i in range(len(stages) + 1)]
+    solves = warm_solves()
+    plans = mp.sweep(REQUIRED, "exclude", values, **KWARGS)
+    assert warm_solves() == solves + len(values)
+
+    # Excluding more stages never makes a plan cheaper.
+    costs = [plan["cost"] for plan in plans]
+    assert costs == sorted(costs) and costs[-1] > costs[0]
+    for value, plan in zip(values, plans):
+        cold = mp.get_plan(REQUIRED, None, False, exclude=value, **KWARGS)
+        assert plan["cost"] == pytest.approx(cold["cost"], abs=1)
+        assert not {s["stage"] for s in plan["stages"]} & set(value)
+
+
+def test_outcome_rate_sweep(mp):
+    values = [0.0, 0.1, 0.175, 0.4]
+    plans = mp.sweep(REQUIRED, "outcome_rate", values, **KWARGS)
+    # More byproducts never make a plan more expensive.
+    costs = [plan["cost"] for plan in plans]
+    assert costs == sorted(costs, reverse=True) and costs[-1] < costs[0]
+    assert plans[0]["cost"] == mp.get_plan(REQUIRED, None, False, **KWARGS)["cost"]
+    # 0.175 is the rate of get_plan.
+    assert plans[2]["cost"] == pytest.approx(
+        mp.get_plan(REQUIRED, None, False, outcome=True, **KWARGS)["cost"], abs=1
+    )
+
+
+def test_sweep_errors_per_point(mp):
+    # At 10 sanity per 200 exp some stages pay for themselves, the LP is
+    # unbounded without failing the other points.
+    plans = mp.sweep(REQUIRED, "exp_unit", [0.0, 10.0], gold_demand=False)
+    assert isinstance(plans[0], dict) and isinstance(plans[1], ValueError)
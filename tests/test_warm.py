@@ -0,0 +1,24 @@
+import copy
+
+import pytest
+
+from conftest import random_requests
+from MaterialPlanning import MaterialPlanning
+
+
+@pytest.fixture
+def warm_mp(data):
+    return MaterialPlanning.from_data(*copy.deepcopy(data), solver="highs-warm")
+
+
+def test_warm_solves_match_linprog(mp, warm_mp):
+    # Each request starts from the basis the previous one left.
+    for required, kwargs in random_requests(mp, 30, seed=2):
+        plan = mp.get_plan(required, None, False, **kwargs)
+        warm_plan = warm_mp.get_plan(required, None, False, debug=True, **kwargs)
+        assert warm_plan["solver_path"] == [
+            {"problem": "primal", "method": "highs-warm", "status": 0}
+        ]
+        assert warm_plan["cost"] == pytest.approx(plan["cost"], rel=1e-6)
+    # Every flag combination of the requests got its own HiGHS instance.
+    assert len(warm_mp._warm_solvers) == 8